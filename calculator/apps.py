@@ -2,4 +2,14 @@ from django.apps import AppConfig
 
 class CalculatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'calculator'
\ No newline at end of file
+    name = 'calculator'
+    
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        
+        from . import metrics, profiling, sharding, signals  # noqa: F401
+        
+        connection_created.connect(metrics.install_db_timer, dispatch_uid='calculator-metrics-db-timer')
+        connection_created.connect(profiling.install_sql_recorder, dispatch_uid='calculator-profiling-sql')
+        post_migrate.connect(sharding.reserve_id_ranges, sender=self, dispatch_uid='calculator-shard-id-ranges')
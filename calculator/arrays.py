@@ -0,0 +1,169 @@
+"""
+Массивные вычисления: одна операция над столбцами num1 и num2.
+
+Операнды приходят либо JSON-списками, либо двоичным телом
+application/octet-stream: подряд num1 и num2 как little-endian float64
+(для sqrt — только num1). Двоичный ответ содержит results (float64, NaN
+на месте ошибок), а за ним коды ошибок (uint8, см. engine.ERROR_CODES).
+"""
+import math
+import sys
+from array import array
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .engine import ERROR_MESSAGES, UNARY_OPERATIONS, CalculationError, np
+
+
+BINARY_MEDIA_TYPE = 'application/octet-stream'
+
+HISTORY_NONE = 'none'
+HISTORY_SUMMARY = 'summary'
+HISTORY_ROWS = 'rows'
+HISTORY_MODES = (HISTORY_NONE, HISTORY_SUMMARY, HISTORY_ROWS)
+
+INVALID_NUMBER = 'Некорректный ввод чисел'
+INVALID_HISTORY = 'Неизвестный режим записи истории'
+LENGTH_MISMATCH = 'Массивы num1 и num2 должны быть одной длины'
+EMPTY = 'Ожидается непустой массив num1'
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_ARRAY', {})
+    return {
+        'max_size': config.get('MAX_SIZE', 1_000_000),
+        'max_history_rows': config.get('MAX_HISTORY_ROWS', 10000),
+        'default_history': config.get('DEFAULT_HISTORY', HISTORY_SUMMARY),
+    }
+
+
+class ArrayBinaryParser(BaseParser):
+    media_type = BINARY_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read() if stream is not None else b''
+
+
+class ArrayBinaryRenderer(BaseRenderer):
+    """
+    Отдаёт готовые байты как есть; ошибки и прочие ответы-словари
+    сериализуются в JSON.
+    """
+    media_type = BINARY_MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, bytearray)):
+            return data
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+def resolve_history(value):
+    history = value or get_config()['default_history']
+    if history not in HISTORY_MODES:
+        raise CalculationError(INVALID_HISTORY, 'history')
+    return history
+
+
+def _float64(values):
+    if np is not None:
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 1:
+            raise ValueError(values.shape)
+        return values
+    return array('d', (float(value) for value in values))
+
+
+def _from_bytes(buffer):
+    if np is not None:
+        return np.frombuffer(buffer, dtype='<f8')
+    values = array('d')
+    values.frombytes(buffer)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _check_size(count):
+    max_size = get_config()['max_size']
+    if count == 0:
+        raise CalculationError(EMPTY, 'num1')
+    if count > max_size:
+        raise CalculationError(f'Слишком большой массив (максимум {max_size} элементов)', 'num1')
+
+
+def parse_json(data, operation):
+    """
+    Возвращает (num1, num2) как массивы float64. num2 может быть одним
+    числом — тогда оно применяется ко всем элементам num1.
+    """
+    num1 = data.get('num1')
+    num2 = data.get('num2')
+    if not isinstance(num1, list):
+        raise CalculationError(EMPTY, 'num1')
+    _check_size(len(num1))
+
+    if operation not in UNARY_OPERATIONS and isinstance(num2, list) and len(num2) != len(num1):
+        raise CalculationError(LENGTH_MISMATCH, 'num2')
+
+    try:
+        num1 = _float64(num1)
+        if operation in UNARY_OPERATIONS:
+            return num1, None
+        if isinstance(num2, list):
+            return num1, _float64(num2)
+        num2 = float(num2)
+    except (TypeError, ValueError):
+        raise CalculationError(INVALID_NUMBER)
+
+    if np is not None:
+        return num1, np.broadcast_to(np.float64(num2), num1.shape)
+    return num1, array('d', [num2]) * len(num1)
+
+
+def parse_binary(body, operation):
+    if len(body) % 8:
+        raise CalculationError(INVALID_NUMBER)
+    values = _from_bytes(body)
+    if operation in UNARY_OPERATIONS:
+        _check_size(len(values))
+        return values, None
+    if len(values) % 2:
+        raise CalculationError(LENGTH_MISMATCH, 'num2')
+    half = len(values) // 2
+    _check_size(half)
+    return values[:half], values[half:]
+
+
+def encode_binary(results, codes):
+    if np is not None:
+        return results.astype('<f8', copy=False).tobytes() + codes.astype(np.uint8, copy=False).tobytes()
+    values = array('d', results)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes() + bytes(codes)
+
+
+def failures(codes):
+    """Словарь {индекс: сообщение} только для элементов с ошибкой."""
+    if np is not None:
+        failed = np.flatnonzero(codes)
+        return dict(zip(failed.tolist(), (ERROR_MESSAGES[code] for code in codes[failed].tolist())))
+    return {index: ERROR_MESSAGES[code] for index, code in enumerate(codes) if code}
+
+
+def to_list(results, errors):
+    values = results.tolist() if np is not None else list(results)
+    for index in errors:
+        values[index] = None
+    return values
+
+
+def total(results):
+    if np is not None:
+        return float(np.nansum(results))
+    return math.fsum(value for value in results if not math.isnan(value))
@@ -0,0 +1,310 @@
+import asyncio
+import base64
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import events, numeric, replication, sharding, stats
+from .authentication import user_from_claims
+from .cache import get_result_cache
+from .engine import CalculationError, evaluate
+from .filtering import filter_history
+from .models import Calculation
+from .pagination import CalculationCursorPagination
+from .serializers import CalculationListSerializer, calculation_payload
+from .views import evaluate_expression
+from .writebehind import FLUSH_ON_READ, get_write_behind
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data,
+        status=status,
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def error_response(message, status=400):
+    return json_response({'error': message}, status=status)
+
+
+async def authenticate(request):
+    """
+    Возвращает (user, via_session). Bearer-токен проверяется без обращения
+    к потокам; пользователь собирается из claims, а для старых токенов
+    загружается через async ORM. Иначе берётся пользователь сессии
+    через request.auser().
+    """
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0] in jwt_settings.AUTH_HEADER_TYPES:
+        user, via_session = await user_from_token(header[1]), False
+    else:
+        user = await request.auser()
+        user, via_session = (user if user.is_authenticated else None), True
+    if user is not None:
+        # Как и DRF: request.user нужен calculator.replication.
+        request.user = user
+    return user, via_session
+
+
+async def user_from_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    user = user_from_claims(token)
+    if user is not None:
+        return user
+    return await User.objects.filter(
+        **{jwt_settings.USER_ID_FIELD: user_id}, is_active=True
+    ).afirst()
+
+
+def enforce_csrf(request):
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+
+async def flush_pending_for_read():
+    write_behind = get_write_behind()
+    if write_behind is not None and write_behind.durability == FLUSH_ON_READ:
+        await sync_to_async(write_behind.flush)()
+
+
+@csrf_exempt
+@require_POST
+async def calculate_view(request):
+    user, via_session = await authenticate(request)
+    if user is None:
+        return error_response('Требуется авторизация', status=401)
+    if via_session:
+        rejected = enforce_csrf(request)
+        if rejected is not None:
+            return rejected
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return error_response('Некорректный JSON')
+    if not isinstance(data, dict):
+        return error_response('Некорректный JSON')
+
+    operation = data.get('operation')
+    mode = data.get('mode') or numeric.get_config()['default_mode']
+    try:
+        if operation == 'expression':
+            expression, result = evaluate_expression(data.get('expression'))
+            calculation = Calculation(
+                user_id=user.pk, operation=operation, expression=expression, result=result
+            )
+        elif mode != numeric.FLOAT:
+            fields = numeric.calculate(
+                operation,
+                data.get('num1', 0),
+                data.get('num2', 0),
+                numeric.resolve_mode(mode),
+                precision=numeric.resolve_precision(data.get('precision'))
+            )
+            calculation = Calculation(user_id=user.pk, operation=operation, **fields)
+        else:
+            num1 = float(data.get('num1', 0))
+            num2 = None if operation == 'sqrt' else float(data.get('num2', 0))
+
+            result_cache = get_result_cache()
+            result = await result_cache.aget(operation, num1, num2) if result_cache else None
+            if result is None:
+                result = evaluate(operation, num1, num2)
+                if result_cache:
+                    await result_cache.aset(operation, num1, num2, result)
+
+            calculation = Calculation(
+                user_id=user.pk, num1=num1, num2=num2, operation=operation, result=result
+            )
+    except CalculationError as e:
+        return error_response(e.message)
+    except (TypeError, ValueError):
+        return error_response('Некорректный ввод чисел')
+
+    response = {'result': calculation.result}
+    if calculation.mode != numeric.FLOAT:
+        response['result_exact'] = calculation.result_exact
+    write_behind = get_write_behind()
+    if write_behind is None:
+        await calculation.asave()
+    else:
+        # При переполнении очереди enqueue пишет синхронно через ORM.
+        await sync_to_async(write_behind.enqueue)(calculation)
+        response['queued'] = True
+
+    response['calculation'] = calculation_payload(calculation, user=user)
+    return json_response(response)
+
+
+def encode_cursor(row):
+    value = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+
+async def serialize_rows(rows, fields=None):
+    """
+    Строкам из шардов, кроме default, имена пользователей дописываются
+    синхронным запросом (см. serializers.attach_usernames).
+    """
+    if (fields is None or 'username' in fields) and any('username' not in row for row in rows):
+        return await sync_to_async(lambda: CalculationListSerializer(rows, many=True, fields=fields).data)()
+    return CalculationListSerializer(rows, many=True, fields=fields).data
+
+
+@require_GET
+async def calculation_list_view(request):
+    user, _ = await authenticate(request)
+    if user is None:
+        return error_response('Требуется авторизация', status=401)
+    await flush_pending_for_read()
+
+    params = request.GET
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 50)
+    try:
+        page_size = int(params.get('page_size', page_size))
+    except ValueError:
+        pass
+    page_size = max(1, min(page_size, CalculationCursorPagination.max_page_size))
+
+    using = replication.read_alias(await sharding.adatabase_for_user(user.pk))
+    queryset = filter_history(Calculation.objects.using(using).filter(user_id=user.pk), params)
+    if params.get('cursor'):
+        try:
+            created_at, pk = decode_cursor(params['cursor'])
+        except ValueError:
+            return error_response('Некорректный курсор')
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    fields = CalculationListSerializer.parse_fields(params.get('fields'))
+    queryset = CalculationListSerializer.project(
+        queryset.order_by('-created_at', '-id'),
+        fields=fields,
+        extra_columns={'created_at', 'id'}
+    )
+    rows = [row async for row in queryset[:page_size + 1]]
+
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        query = params.copy()
+        query['cursor'] = encode_cursor(rows[-1])
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+    return json_response({
+        'next': next_url,
+        'results': await serialize_rows(rows, fields),
+    })
+
+
+@require_GET
+async def statistics_view(request):
+    user, _ = await authenticate(request)
+    if user is None:
+        return error_response('Требуется авторизация', status=401)
+    await flush_pending_for_read()
+
+    if user.is_staff:
+        statistics = await stats.aget_statistics()
+        recent_calculations = [
+            CalculationListSerializer.project(
+                Calculation.objects.using(replication.read_alias(using)).order_by('-created_at')
+            )[:5]
+            for using in sharding.databases()
+        ]
+    else:
+        statistics = await stats.aget_statistics(user_id=user.pk)
+        using = replication.read_alias(await sharding.adatabase_for_user(user.pk))
+        recent_calculations = [
+            CalculationListSerializer.project(
+                Calculation.objects.using(using).filter(user_id=user.pk).order_by('-created_at')
+            )[:5]
+        ]
+
+    rows = [row for queryset in recent_calculations async for row in queryset]
+    rows.sort(key=lambda row: row['created_at'], reverse=True)
+    statistics['recent_calculations'] = await serialize_rows(rows[:5])
+
+    return json_response(statistics)
+
+
+def format_event(event):
+    data = json.dumps(
+        {key: value for key, value in event.items() if key not in ('id', 'type')},
+        cls=DjangoJSONEncoder,
+        ensure_ascii=False
+    )
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def event_stream(channel, config):
+    """
+    Подписка создаётся при первом чтении ответа и снимается, когда
+    сервер отменяет генератор после отключения клиента.
+    """
+    subscription = events.get_broker().subscribe(channel)
+    try:
+        yield f"retry: {config['retry_ms']}\nevent: ready\ndata: {{}}\n\n"
+        while True:
+            try:
+                event = await subscription.get(config['heartbeat'])
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        subscription.close()
+
+
+@require_GET
+async def events_view(request):
+    """
+    Поток Server-Sent Events с созданными и удалёнными вычислениями
+    пользователя; ?scope=all — всех пользователей (для администраторов).
+    EventSource не умеет передавать заголовки, поэтому кроме сессии и
+    Authorization принимается ?token=<access-токен>.
+    """
+    if not events.stream_supported(request):
+        return error_response('Поток событий доступен только при запуске через ASGI', status=501)
+    if request.GET.get('token'):
+        user = await user_from_token(request.GET['token'])
+    else:
+        user, _ = await authenticate(request)
+    if user is None:
+        return error_response('Требуется авторизация', status=401)
+
+    if request.GET.get('scope') == 'all':
+        if not user.is_staff:
+            return error_response('Требуются права администратора', status=403)
+        channel = stats.ALL_USERS
+    else:
+        channel = int(user.pk)
+
+    response = StreamingHttpResponse(
+        event_stream(channel, events.get_config()),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
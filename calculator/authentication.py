@@ -0,0 +1,101 @@
+from functools import cached_property
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import metrics
+
+
+USER_CLAIMS = ('username', 'email', 'is_staff')
+
+
+class CalculatorRefreshToken(RefreshToken):
+    """
+    Refresh-токен, в который кладутся данные пользователя, нужные
+    калькулятору. Access-токен копирует их при выпуске; при обновлении
+    они перечитываются из БД, см. CalculatorTokenRefreshSerializer.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """
+    Пользователь, собранный из claims access-токена без запроса к auth_user.
+
+    Права и данные профиля фиксируются на момент выпуска access-токена:
+    смена is_staff или блокировка вступают в силу, когда он истечёт
+    (ACCESS_TOKEN_LIFETIME) и клиент обновит его по refresh-токену.
+    """
+
+    @cached_property
+    def id(self):
+        # simplejwt кладёт id в claim строкой, а сравнивается он с
+        # целочисленными внешними ключами.
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+
+class CalculatorTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление access-токена с перечитанным пользователем: claims
+    USER_CLAIMS берутся из БД, а не копируются из refresh-токена, иначе
+    разжалованный администратор сохранял бы права до истечения
+    refresh-токена. Удалённым и заблокированным пользователям отказывается.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        for claim in USER_CLAIMS:
+            refresh[claim] = getattr(user, claim)
+        return super().validate({**attrs, 'refresh': str(refresh)})
+
+
+def user_from_claims(validated_token):
+    if all(claim in validated_token for claim in USER_CLAIMS):
+        return ClaimsUser(validated_token)
+    return None
+
+
+def stateless_login_requested(request):
+    """
+    Клиент API может попросить вход без серверной сессии полем
+    stateless в теле запроса; по умолчанию решает CALCULATOR_STATELESS_LOGIN.
+    """
+    value = request.data.get('stateless')
+    if value is None:
+        return getattr(settings, 'CALCULATOR_STATELESS_LOGIN', False)
+    return value in (True, 'true', '1', 1)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без обращения к БД для токенов с полным набором
+    claims. Токены, выпущенные до их появления, проверяются как раньше.
+    """
+
+    def authenticate(self, request):
+        with metrics.phase('auth'):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        return user_from_claims(validated_token) or super().get_user(validated_token)
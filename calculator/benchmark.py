@@ -0,0 +1,359 @@
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+
+from .authentication import CalculatorRefreshToken
+from . import compression, numeric, sharding
+from .engine import CalculationError, evaluate
+from .models import Calculation
+from .renderers import CalculationJSONRenderer
+from .serializers import CalculationListSerializer, CalculationSerializer, attach_usernames
+
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_ADMIN = 'bench_admin'
+SEED_CHUNK_SIZE = 5000
+ARITHMETIC_OPERATIONS = ['add', 'subtract', 'multiply', 'divide', 'power', 'sqrt']
+
+
+def random_operands(rng):
+    operation = rng.choice(ARITHMETIC_OPERATIONS)
+    num1 = round(rng.uniform(0, 1000), 3)
+    num2 = None if operation == 'sqrt' else round(rng.uniform(1, 10 if operation == 'power' else 1000), 3)
+    return operation, num1, num2
+
+
+def bench_users():
+    return User.objects.filter(username__startswith=BENCH_USER_PREFIX).order_by('id')
+
+
+def seed(rows, users, seed=0, stdout=None):
+    """
+    Создаёт users пользователей bench_user_N и rows вычислений,
+    равномерно распределённых между ними. Уже созданные строки
+    учитываются, поэтому повторный запуск досоздаёт только недостающее.
+    """
+    rng = random.Random(seed)
+
+    existing = set(bench_users().values_list('username', flat=True))
+    User.objects.bulk_create([
+        User(username=f'{BENCH_USER_PREFIX}{i}', password='!')
+        for i in range(users)
+        if f'{BENCH_USER_PREFIX}{i}' not in existing
+    ])
+    user_ids = list(bench_users().values_list('id', flat=True)[:users])
+
+    missing = rows - sharding.scatter(Calculation.objects.filter(user_id__in=user_ids)).count()
+    created = 0
+    while created < missing:
+        chunk = []
+        for _ in range(min(SEED_CHUNK_SIZE, missing - created)):
+            operation, num1, num2 = random_operands(rng)
+            calculation = Calculation(
+                user_id=user_ids[rng.randrange(len(user_ids))],
+                num1=num1,
+                num2=num2,
+                operation=operation,
+                result=evaluate(operation, num1, num2)
+            )
+            calculation.build_expression()
+            chunk.append(calculation)
+        Calculation.objects.bulk_create(chunk, batch_size=SEED_CHUNK_SIZE)
+        created += len(chunk)
+        if stdout is not None:
+            stdout.write(f'  засеяно {created}/{missing}')
+
+    return user_ids
+
+
+def bench_admin():
+    admin, _ = User.objects.get_or_create(
+        username=BENCH_ADMIN, defaults={'is_staff': True, 'password': '!'}
+    )
+    return admin
+
+
+def cleanup():
+    User.objects.filter(username=BENCH_ADMIN).delete()
+    return bench_users().delete()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, queries, errors, wall_time, sizes=()):
+    count = len(latencies)
+    wire = sum(size for size, _ in sizes)
+    uncompressed = sum(size for _, size in sizes)
+    return {
+        'requests': count,
+        'errors': errors,
+        'requests_per_second': round(count / wall_time, 2) if wall_time else None,
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+            'p50': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            'p95': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            'p99': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            'max': round(max(latencies) * 1000, 3) if latencies else None,
+        },
+        'queries_per_request': {
+            'mean': round(statistics.fmean(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+        'response_bytes': {
+            'mean': round(wire / len(sizes)) if sizes else None,
+            'mean_uncompressed': round(uncompressed / len(sizes)) if sizes else None,
+            'saved_percent': round((1 - wire / uncompressed) * 100, 1) if uncompressed else None,
+        },
+    }
+
+
+class Endpoint:
+    def __init__(self, name, method, url_name, payload=None, staff=False):
+        self.name = name
+        self.method = method
+        self.url_name = url_name
+        self.payload = payload
+        self.staff = staff
+
+    def request(self, client, rng, headers):
+        url = reverse(self.url_name)
+        if self.method == 'post':
+            return client.post(url, self.payload(rng), content_type='application/json', headers=headers)
+        return client.get(url, headers=headers)
+
+
+def calculate_payload(rng):
+    operation, num1, num2 = random_operands(rng)
+    payload = {'operation': operation, 'num1': num1}
+    if num2 is not None:
+        payload['num2'] = num2
+    return payload
+
+
+def decimal_payload(rng):
+    payload = calculate_payload(rng)
+    payload['mode'] = 'decimal'
+    for name in ('num1', 'num2'):
+        if name in payload:
+            payload[name] = str(payload[name])
+    return payload
+
+
+def fraction_payload(rng):
+    operation = rng.choice(['add', 'subtract', 'multiply', 'divide', 'power', 'sqrt'])
+    payload = {'operation': operation, 'mode': 'fraction'}
+    if operation == 'sqrt':
+        payload['num1'] = f'{rng.randint(1, 1000) ** 2}/{rng.randint(1, 100) ** 2}'
+    else:
+        payload['num1'] = f'{rng.randint(1, 100000)}/{rng.randint(1, 1000)}'
+        payload['num2'] = str(rng.randint(1, 8)) if operation == 'power' else f'{rng.randint(1, 100000)}/{rng.randint(1, 1000)}'
+    return payload
+
+
+ENDPOINTS = {
+    'calculate': Endpoint('calculate', 'post', 'calculate', calculate_payload),
+    'calculate_decimal': Endpoint('calculate_decimal', 'post', 'calculate', decimal_payload),
+    'calculate_fraction': Endpoint('calculate_fraction', 'post', 'calculate', fraction_payload),
+    'calculations': Endpoint('calculations', 'get', 'calculations-list'),
+    'admin_calculations': Endpoint('admin_calculations', 'get', 'admin-calculations', staff=True),
+    'statistics': Endpoint('statistics', 'get', 'statistics'),
+}
+DEFAULT_ENDPOINTS = ('calculate', 'calculations', 'admin_calculations', 'statistics')
+
+
+def response_sizes(body, encoding):
+    """Размер тела на проводе и после распаковки."""
+    return len(body), len(compression.decompress(body, encoding)) if encoding else len(body)
+
+
+def run_endpoint(endpoint, user_ids, clients, requests, seed=0, accept_encoding=None):
+    users = [bench_admin()] if endpoint.staff else User.objects.filter(id__in=user_ids)
+    tokens = [f'Bearer {CalculatorRefreshToken.for_user(user).access_token}' for user in users]
+    latencies = []
+    queries = []
+    sizes = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + worker_index)
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        local_latencies = []
+        local_queries = []
+        local_sizes = []
+        local_errors = 0
+        count = requests // clients + (1 if worker_index < requests % clients else 0)
+
+        for _ in range(count):
+            executed = 0
+
+            def counter(execute, sql, params, many, context):
+                nonlocal executed
+                executed += 1
+                return execute(sql, params, many, context)
+
+            headers = {'Authorization': tokens[rng.randrange(len(tokens))]}
+            if accept_encoding:
+                headers['Accept-Encoding'] = accept_encoding
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = endpoint.request(client, rng, headers)
+                if getattr(response, 'streaming', False):
+                    body = b''.join(response.streaming_content)
+                else:
+                    body = response.content
+                elapsed = time.perf_counter() - started
+            local_latencies.append(elapsed)
+            local_queries.append(executed)
+            local_sizes.append(response_sizes(body, response.get('Content-Encoding')))
+            if response.status_code >= 400:
+                local_errors += 1
+
+        close_old_connections()
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            sizes.extend(local_sizes)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(worker, range(clients)))
+    wall_time = time.perf_counter() - started
+
+    return summarize(latencies, queries, errors, wall_time, sizes)
+
+
+def engine_benchmark(iterations, seed=0):
+    """
+    Стоимость одной операции движка в каждом числовом режиме без HTTP и
+    БД: float — прямой вызов engine.evaluate, decimal/fraction — разбор
+    строковых операндов и вычисление через numeric.calculate.
+    """
+    rng = random.Random(seed)
+    payloads = {
+        numeric.FLOAT: [calculate_payload(rng) for _ in range(iterations)],
+        numeric.DECIMAL: [decimal_payload(rng) for _ in range(iterations)],
+        numeric.FRACTION: [fraction_payload(rng) for _ in range(iterations)],
+    }
+    results = {}
+    for mode, items in payloads.items():
+        errors = 0
+        started = time.perf_counter()
+        for item in items:
+            try:
+                if mode == numeric.FLOAT:
+                    evaluate(item['operation'], item['num1'], item.get('num2'))
+                else:
+                    numeric.calculate(item['operation'], item['num1'], item.get('num2'), mode)
+            except CalculationError:
+                errors += 1
+        elapsed = time.perf_counter() - started
+        results[mode] = {
+            'operations': iterations,
+            'errors': errors,
+            'microseconds_per_operation': round(elapsed / iterations * 1e6, 3) if iterations else None,
+        }
+    return results
+
+
+def _timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def serialization_benchmark(user_ids, rows, repeat=5):
+    """
+    Сериализация и рендеринг страницы из rows вычислений тремя путями:
+    model_serializer — CalculationSerializer с вложенным пользователем,
+    list_serializer — CalculationListSerializer с пофилдовым обходом
+    DRF, fast — CalculationRowListSerializer и CalculationJSONRenderer
+    (так сейчас отдаются списки истории). Время — лучшее из repeat
+    прогонов; для быстрого пути дополнительно размер после сжатия.
+    """
+    calculations = sharding.scatter(Calculation.objects.filter(user_id__in=user_ids).order_by('-created_at'))
+    instances = list(calculations[:rows])
+    users = User.objects.in_bulk({calculation.user_id for calculation in instances})
+    for calculation in instances:
+        calculation.user = users[calculation.user_id]
+    values = attach_usernames(CalculationListSerializer.project(calculations)[:rows])
+
+    paths = {
+        'model_serializer': lambda: JSONRenderer().render(
+            CalculationSerializer(instances, many=True).data
+        ),
+        'list_serializer': lambda: JSONRenderer().render(
+            ListSerializer(values, child=CalculationListSerializer()).data
+        ),
+        'fast': lambda: CalculationJSONRenderer().render(
+            CalculationListSerializer(values, many=True).data
+        ),
+    }
+    results = {}
+    for name, function in paths.items():
+        elapsed, body = _timed(function, repeat)
+        results[name] = {
+            'rows': len(values),
+            'milliseconds': round(elapsed * 1000, 3),
+            'bytes': len(body),
+        }
+
+    config = compression.get_config()
+    body = paths['fast']()
+    results['compression'] = {}
+    for encoding in compression.supported_encodings():
+        elapsed, compressed = _timed(lambda: compression.compress(body, encoding, config), repeat)
+        results['compression'][encoding] = {
+            'milliseconds': round(elapsed * 1000, 3),
+            'bytes': len(compressed),
+            'saved_percent': round((1 - len(compressed) / len(body)) * 100, 1) if body else None,
+        }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'database_profile': getattr(settings, 'DATABASE_PROFILE', None),
+    }
@@ -0,0 +1,94 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ResultCache:
+    """
+    Кэш результатов вычислений поверх Django cache framework.
+
+    Размер и вытеснение (LRU + TTL) задаются настройками выбранного
+    бэкенда: LocMemCache в тестах и разработке, общий бэкенд (Redis,
+    Memcached) в продакшене. Счётчики попаданий ведутся в процессе.
+    """
+
+    def __init__(self, alias, timeout=None, key_prefix='calc'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, operation, num1, num2):
+        return f"{self.key_prefix}:{operation}:{num1!r}:{num2!r}"
+
+    def _count(self, result):
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def _timeout_kwargs(self):
+        return {} if self.timeout is None else {'timeout': self.timeout}
+
+    def get(self, operation, num1, num2):
+        return self._count(self.backend.get(self.make_key(operation, num1, num2)))
+
+    def set(self, operation, num1, num2, result):
+        self.backend.set(self.make_key(operation, num1, num2), result, **self._timeout_kwargs())
+
+    async def aget(self, operation, num1, num2):
+        return self._count(await self.backend.aget(self.make_key(operation, num1, num2)))
+
+    async def aset(self, operation, num1, num2, result):
+        await self.backend.aset(self.make_key(operation, num1, num2), result, **self._timeout_kwargs())
+
+    def clear(self):
+        self.backend.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': self.alias,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+
+    config = getattr(settings, 'CALCULATOR_RESULT_CACHE', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    config.get('ALIAS', 'default'),
+                    timeout=config.get('TIMEOUT'),
+                    key_prefix=config.get('KEY_PREFIX', 'calc')
+                )
+    return _result_cache
@@ -0,0 +1,115 @@
+"""
+Сжатие ответов по Accept-Encoding.
+
+Поддерживаются gzip и, если установлен пакет brotli, br; при равных
+q-значениях предпочитается br. Сжимаются только текстовые типы из
+CONTENT_TYPES: ответы меньше MIN_SIZE байт, уже сжатые ответы и
+асинхронные потоки (Server-Sent Events) отдаются как есть. Потоковые
+выгрузки сжимаются по мере генерации.
+"""
+import gzip
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_COMPRESSION', {})
+    return {
+        'enabled': config.get('ENABLED', True),
+        'min_size': config.get('MIN_SIZE', 1024),
+        'gzip_level': config.get('GZIP_LEVEL', 6),
+        'brotli_quality': config.get('BROTLI_QUALITY', 4),
+        'content_types': tuple(config.get('CONTENT_TYPES', (
+            'application/json', 'text/csv', 'text/html', 'text/plain',
+            'text/css', 'text/javascript', 'application/javascript',
+        ))),
+    }
+
+
+def supported_encodings():
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def negotiate(accept_encoding, encodings=None):
+    """
+    Выбирает кодировку из заголовка Accept-Encoding с учётом q и *.
+    Возвращает None, если подходящей нет.
+    """
+    encodings = encodings or supported_encodings()
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        # encodings упорядочены по предпочтению, поэтому при равных q
+        # остаётся первая.
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, config):
+    if encoding == BROTLI:
+        return brotli.compress(data, quality=config['brotli_quality'])
+    return gzip.compress(data, compresslevel=config['gzip_level'], mtime=0)
+
+
+def compress_stream(chunks, encoding, config):
+    if encoding == BROTLI:
+        compressor = brotli.Compressor(quality=config['brotli_quality'])
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(config['gzip_level'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress(data, encoding):
+    if encoding == BROTLI:
+        return brotli.decompress(data)
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    return data
+
+
+def compressible(response, config):
+    if response.has_header('Content-Encoding') or response.status_code == 206:
+        return False
+    if getattr(response, 'is_async', False):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    if not content_type.startswith(config['content_types']):
+        return False
+    return response.streaming or len(response.content) >= config['min_size']
@@ -0,0 +1,75 @@
+"""
+Условные GET для истории и статистики.
+
+Валидатор строится из счётчика изменений истории (stats.get_version),
+поэтому проверка If-None-Match / If-Modified-Since стоит одного запроса
+по уникальному ключу, а при совпадении 304 возвращается без запроса
+списка и сериализации.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import stats
+from .writebehind import flush_for_read
+
+
+def make_etag(request, version, *extra):
+    """
+    ETag зависит от версии истории и от представления: пути с query
+    string (фильтры, курсор, поля), Accept и пользователя.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), request.user.pk, *extra):
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return f'"{version}-{digest.hexdigest()}"'
+
+
+def check(request, user_id=stats.ALL_USERS, extra=()):
+    """
+    Возвращает (response, validators): response — 304, если у клиента
+    актуальная версия, иначе None; validators передаются в finalize.
+    Отложенные записи сбрасываются до чтения версии (режим flush_on_read),
+    иначе новое вычисление не изменило бы валидатор.
+    """
+    flush_for_read()
+    version, updated_at = stats.get_version(user_id)
+    etag = make_etag(request, version, *extra)
+    last_modified = updated_at.timestamp() if updated_at is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        finalize(response, (etag, last_modified))
+    return response, (etag, last_modified)
+
+
+def finalize(response, validators):
+    etag, last_modified = validators
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
+
+class ConditionalListMixin:
+    """
+    Отвечает 304 на повторный запрос списка, если история не менялась.
+    get_version_user_id() задаёт, чей счётчик изменений используется.
+    """
+
+    def get_version_user_id(self):
+        return self.request.user.pk
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('last'):
+            # Окно ?last= сдвигается со временем и без записей в историю,
+            # поэтому версия истории его не описывает: отвечаем без валидаторов.
+            return finalize(super().list(request, *args, **kwargs), (None, None))
+        not_modified, validators = check(request, self.get_version_user_id())
+        if not_modified is not None:
+            return not_modified
+        return finalize(super().list(request, *args, **kwargs), validators)
@@ -0,0 +1,180 @@
+import math
+
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+RESULT_PRECISION = 10
+
+OPERATION_SYMBOLS = {
+    'add': '+',
+    'subtract': '-',
+    'multiply': '*',
+    'divide': '/',
+    'power': '^',
+    'sqrt': '√',
+}
+
+UNARY_OPERATIONS = {'sqrt'}
+
+
+class CalculationError(ValueError):
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.message = message
+        self.field = field
+
+
+DIVISION_BY_ZERO = 'Деление на ноль невозможно'
+NEGATIVE_SQRT = 'Квадратный корень из отрицательного числа'
+INVALID_OPERATION = 'Неверная операция'
+OUT_OF_RANGE = 'Результат вне допустимого диапазона'
+
+
+def evaluate(operation, num1, num2=None):
+    if operation == 'add':
+        result = num1 + num2
+    elif operation == 'subtract':
+        result = num1 - num2
+    elif operation == 'multiply':
+        result = num1 * num2
+    elif operation == 'divide':
+        if num2 == 0:
+            raise CalculationError(DIVISION_BY_ZERO, 'num2')
+        result = num1 / num2
+    elif operation == 'power':
+        try:
+            result = math.pow(num1, num2)
+        except (OverflowError, ValueError):
+            raise CalculationError(OUT_OF_RANGE)
+    elif operation == 'sqrt':
+        if num1 < 0:
+            raise CalculationError(NEGATIVE_SQRT, 'num1')
+        result = math.sqrt(num1)
+    else:
+        raise CalculationError(INVALID_OPERATION, 'operation')
+
+    if not math.isfinite(result):
+        raise CalculationError(OUT_OF_RANGE)
+    return round(result, RESULT_PRECISION)
+
+
+ERROR_CODES = {
+    DIVISION_BY_ZERO: 1,
+    NEGATIVE_SQRT: 2,
+    OUT_OF_RANGE: 3,
+}
+ERROR_MESSAGES = {code: message for message, code in ERROR_CODES.items()}
+
+
+def _vector_kernel(operation, a, b):
+    codes = np.zeros(a.shape, dtype=np.uint8)
+
+    with np.errstate(all='ignore'):
+        if operation == 'add':
+            result = a + b
+        elif operation == 'subtract':
+            result = a - b
+        elif operation == 'multiply':
+            result = a * b
+        elif operation == 'divide':
+            zero = b == 0
+            codes[zero] = ERROR_CODES[DIVISION_BY_ZERO]
+            result = a / np.where(zero, 1.0, b)
+        elif operation == 'power':
+            result = np.power(a, b)
+        else:
+            negative = a < 0
+            codes[negative] = ERROR_CODES[NEGATIVE_SQRT]
+            result = np.sqrt(np.where(negative, 0.0, a))
+
+    codes[(codes == 0) & ~np.isfinite(result)] = ERROR_CODES[OUT_OF_RANGE]
+    return result, codes
+
+
+def _evaluate_vector(operation, num1, num2):
+    if operation not in OPERATION_SYMBOLS:
+        return [None] * len(num1), [INVALID_OPERATION] * len(num1)
+
+    a = np.asarray(num1, dtype=np.float64)
+    b = np.asarray(num2, dtype=np.float64) if operation not in UNARY_OPERATIONS else None
+    result, codes = _vector_kernel(operation, a, b)
+    values = [round(value, RESULT_PRECISION) for value in result.tolist()]
+    return values, [ERROR_MESSAGES.get(code) for code in codes.tolist()]
+
+
+def evaluate_array(operation, num1, num2=None):
+    """
+    Вычисляет одну операцию над массивами операндов целиком.
+
+    num2 может быть массивом той же длины или одним числом. Возвращает
+    (results, codes): results — float64 с NaN на месте ошибок, codes —
+    uint8 с кодами из ERROR_CODES (0 — успех). Проверки те же, что у
+    evaluate, но применяются масками. Без NumPy считает поэлементно
+    через evaluate и возвращает списки.
+    """
+    if operation not in OPERATION_SYMBOLS:
+        raise CalculationError(INVALID_OPERATION, 'operation')
+    unary = operation in UNARY_OPERATIONS
+
+    if np is None:
+        if unary:
+            num2 = [None] * len(num1)
+        elif not hasattr(num2, '__len__'):
+            num2 = [num2] * len(num1)
+        results, codes = [], []
+        for a, b in zip(num1, num2):
+            try:
+                results.append(evaluate(operation, a, b))
+                codes.append(0)
+            except CalculationError as e:
+                results.append(math.nan)
+                codes.append(ERROR_CODES[e.message])
+        return results, codes
+
+    a = np.asarray(num1, dtype=np.float64)
+    b = None if unary else np.broadcast_to(np.asarray(num2, dtype=np.float64), a.shape)
+    result, codes = _vector_kernel(operation, a, b)
+    # У чисел от 2**52 дробной части нет, а np.round умножает на 10**10
+    # и переполнился бы на больших значениях.
+    fractional = np.abs(result) < 2 ** 52
+    result[fractional] = np.round(result[fractional], RESULT_PRECISION)
+    result[codes != 0] = np.nan
+    return result, codes
+
+
+def evaluate_batch(items):
+    """
+    Вычисляет список кортежей (operation, num1, num2).
+
+    Возвращает список пар (result, error) в исходном порядке. Операции
+    группируются по типу; крупные группы считаются векторно через NumPy.
+    """
+    threshold = getattr(settings, 'CALCULATOR_VECTORIZE_THRESHOLD', 64)
+    outcomes = [None] * len(items)
+
+    groups = {}
+    for index, (operation, num1, num2) in enumerate(items):
+        groups.setdefault(operation, []).append(index)
+
+    for operation, indexes in groups.items():
+        if np is not None and len(indexes) >= threshold:
+            num1 = [items[i][1] for i in indexes]
+            num2 = [items[i][2] for i in indexes]
+            values, errors = _evaluate_vector(operation, num1, num2)
+            for i, value, error in zip(indexes, values, errors):
+                outcomes[i] = (None, error) if error else (value, None)
+            continue
+
+        for i in indexes:
+            operation, num1, num2 = items[i]
+            try:
+                outcomes[i] = (evaluate(operation, num1, num2), None)
+            except CalculationError as e:
+                outcomes[i] = (None, e.message)
+
+    return outcomes
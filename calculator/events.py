@@ -0,0 +1,228 @@
+"""
+События истории вычислений для Server-Sent Events.
+
+Брокер живёт в процессе: публикация идёт из кода записи (любой поток)
+после коммита транзакции, подписчики — асинхронные SSE-ответы в цикле
+событий ASGI-сервера. Каждый подписчик получает события своего канала:
+id пользователя или stats.ALL_USERS для администраторов. Если клиент
+не успевает читать и его очередь переполнена, вместо пропущенных
+событий он получает одно событие reset и должен перезагрузить список.
+
+Брокер не разделяется между процессами: при нескольких воркерах
+клиент видит только изменения, сделанные в его процессе.
+"""
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+
+from . import stats
+
+
+CREATED = 'created'
+DELETED = 'deleted'
+RESET = 'reset'
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_EVENTS', {})
+    return {
+        'enabled': config.get('ENABLED', True),
+        'queue_size': config.get('QUEUE_SIZE', 1000),
+        'heartbeat': config.get('HEARTBEAT_SECONDS', 15),
+        'max_ids': config.get('MAX_DELETED_IDS', 1000),
+        'retry_ms': config.get('RETRY_MS', 3000),
+    }
+
+
+def stream_supported(request):
+    """
+    Бесконечный поток держит соединение открытым: под WSGI Django
+    вычитывает асинхронный итератор целиком и занимает поток навсегда,
+    поэтому SSE отдаётся только запросам, пришедшим через ASGI.
+    """
+    return get_config()['enabled'] and isinstance(request, ASGIRequest)
+
+
+class Subscription:
+    def __init__(self, broker, channel, loop, queue_size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def _put(self, event):
+        # Выполняется в цикле событий подписчика.
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': RESET})
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Цикл событий уже закрыт.
+            self.broker.unsubscribe(self)
+
+    async def get(self, timeout):
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        if event['type'] == RESET:
+            self.overflowed = False
+        return event
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, queue_size=1000):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def has_subscribers(self, channels=None):
+        """Дешёвая проверка без блокировки: публикаторы пропускают работу, если слушать некому."""
+        if channels is None:
+            return bool(self._subscribers)
+        return any(channel in self._subscribers for channel in channels)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        if not subscribers:
+            return
+        event = {**event, 'id': next(self._ids)}
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = EventBroker(get_config()['queue_size'])
+    return _broker
+
+
+def _channels(user_ids):
+    # id может прийти строкой из параметров запроса.
+    return {*(int(user_id) for user_id in user_ids), stats.ALL_USERS}
+
+
+def _rows(calculations):
+    from django.contrib.auth.models import User
+
+    from .models import Calculation
+
+    cached = {}
+    missing = set()
+    for calculation in calculations:
+        if Calculation.user.is_cached(calculation):
+            cached[calculation.user_id] = calculation.user.username
+        else:
+            missing.add(calculation.user_id)
+    if missing and get_broker().has_subscribers([stats.ALL_USERS]):
+        cached.update(User.objects.filter(pk__in=missing).values_list('id', 'username'))
+
+    return [
+        {
+            'id': calculation.id,
+            'user_id': calculation.user_id,
+            'username': cached.get(calculation.user_id),
+            'num1': calculation.num1,
+            'num2': calculation.num2,
+            'operation': calculation.operation,
+            'result': calculation.result,
+            'expression': calculation.expression,
+            'created_at': calculation.created_at,
+            'mode': calculation.mode,
+            'result_exact': calculation.result_exact,
+        }
+        for calculation in calculations
+    ]
+
+
+def _publish_created(calculations):
+    from .serializers import CalculationListSerializer
+
+    broker = get_broker()
+    if not broker.has_subscribers(_channels({c.user_id for c in calculations})):
+        return
+    data = CalculationListSerializer(_rows(calculations), many=True).data
+    by_user = defaultdict(list)
+    for item in data:
+        by_user[item['user']].append(item)
+    for user_id, items in by_user.items():
+        broker.publish(user_id, {'type': CREATED, 'calculations': items})
+    broker.publish(stats.ALL_USERS, {'type': CREATED, 'calculations': list(data)})
+
+
+def _publish_deleted(rows):
+    broker = get_broker()
+    max_ids = get_config()['max_ids']
+    by_user = defaultdict(list)
+    for pk, user_id in rows:
+        by_user[user_id].append(pk)
+
+    def event(ids):
+        return {'type': DELETED, 'ids': ids} if len(ids) <= max_ids else {'type': RESET}
+
+    for user_id, ids in by_user.items():
+        broker.publish(user_id, event(ids))
+    broker.publish(stats.ALL_USERS, event([pk for pk, _ in rows]))
+
+
+def calculations_created(calculations, using='default'):
+    """Публикует созданные вычисления после коммита транзакции."""
+    calculations = [calculation for calculation in calculations if calculation.pk is not None]
+    if calculations and get_broker().has_subscribers():
+        transaction.on_commit(lambda: _publish_created(calculations), using=using)
+
+
+def calculations_deleted(rows, using='default'):
+    """rows — пары (id, user_id) удалённых строк."""
+    rows = list(rows)
+    if rows and get_broker().has_subscribers():
+        transaction.on_commit(lambda: _publish_deleted(rows), using=using)
+
+
+def deleted_rows(queryset):
+    """
+    Пары (id, user_id) строк queryset для calculations_deleted. Лишний
+    запрос выполняется, только если есть подписчики.
+    """
+    if not get_broker().has_subscribers():
+        return []
+    return list(queryset.order_by().values_list('id', 'user_id'))
@@ -0,0 +1,74 @@
+import csv
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .serializers import CalculationListSerializer, attach_usernames
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).isoformat()
+    return value
+
+
+def _rows(queryset, fields):
+    chunk_size = getattr(settings, 'CALCULATOR_EXPORT_CHUNK_SIZE', 2000)
+    display = CalculationListSerializer.OPERATION_DISPLAY
+    columns = [CalculationListSerializer.COLUMNS[name] for name in fields]
+
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _values(chunk, fields, columns, display)
+            chunk = []
+    yield from _values(chunk, fields, columns, display)
+
+
+def _values(chunk, fields, columns, display):
+    for row in attach_usernames(chunk) if 'username' in fields else chunk:
+        values = []
+        for name, column in zip(fields, columns):
+            value = row[column]
+            if name == 'operation_display':
+                value = display.get(value, value)
+            values.append(_export_value(value))
+        yield values
+
+
+def stream_csv(queryset, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for values in _rows(queryset, fields):
+        yield writer.writerow(values)
+
+
+def stream_ndjson(queryset, fields):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for values in _rows(queryset, fields):
+        yield encoder.encode(dict(zip(fields, values))) + '\n'
+
+
+def export_response(queryset, fields, export_format, filename):
+    streams = {'csv': stream_csv, 'ndjson': stream_ndjson}
+    response = StreamingHttpResponse(
+        streams[export_format](queryset, fields),
+        content_type=EXPORT_FORMATS[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
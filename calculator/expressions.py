@@ -0,0 +1,333 @@
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+
+from .engine import CalculationError, OUT_OF_RANGE, RESULT_PRECISION
+
+
+class ExpressionError(CalculationError):
+    def __init__(self, message):
+        super().__init__(message, 'expression')
+
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op>\*\*|[-+*/^()√])
+    )
+""", re.VERBOSE)
+
+BINARY_OPERATORS = {
+    # оператор: (приоритет, правоассоциативный)
+    '+': (1, False),
+    '-': (1, False),
+    '*': (2, False),
+    '/': (2, False),
+    '^': (4, True),
+}
+UNARY_PRECEDENCE = 3
+
+CONSTANTS = {
+    'pi': math.pi,
+    'e': math.e,
+}
+
+
+def _sqrt(value):
+    if value < 0:
+        raise ExpressionError('Квадратный корень из отрицательного числа')
+    return math.sqrt(value)
+
+
+def _divide(left, right):
+    if right == 0:
+        raise ExpressionError('Деление на ноль невозможно')
+    return left / right
+
+
+def _power(left, right):
+    try:
+        return math.pow(left, right)
+    except (OverflowError, ValueError):
+        raise ExpressionError(OUT_OF_RANGE)
+
+
+FUNCTIONS = {
+    'sqrt': _sqrt,
+    'abs': abs,
+}
+
+BINARY_FUNCTIONS = {
+    '+': lambda left, right: left + right,
+    '-': lambda left, right: left - right,
+    '*': lambda left, right: left * right,
+    '/': _divide,
+    '^': _power,
+}
+
+
+def tokenize(source):
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = TOKEN_RE.match(source, position)
+        if not match:
+            raise ExpressionError(f'Недопустимый символ в позиции {position + 1}')
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'op' and value == '**':
+            value = '^'
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Node:
+    precedence = 5
+
+    def compile(self):
+        raise NotImplementedError
+
+    def normalize(self):
+        raise NotImplementedError
+
+
+class Number(Node):
+    def __init__(self, value):
+        self.value = value
+
+    def compile(self):
+        value = self.value
+        return lambda ctx: value
+
+    def normalize(self):
+        if self.value.is_integer() and abs(self.value) < 1e16:
+            return str(int(self.value))
+        return repr(self.value)
+
+
+class Constant(Number):
+    def __init__(self, name):
+        super().__init__(CONSTANTS[name])
+        self.name = name
+
+    def normalize(self):
+        return self.name
+
+
+class Call(Node):
+    def __init__(self, name, argument):
+        self.name = name
+        self.argument = argument
+
+    def compile(self):
+        function = FUNCTIONS[self.name]
+        argument = self.argument.compile()
+
+        def call(ctx):
+            ctx.tick()
+            return function(argument(ctx))
+        return call
+
+    def normalize(self):
+        return f"{self.name}({self.argument.normalize()})"
+
+
+class Unary(Node):
+    precedence = UNARY_PRECEDENCE
+
+    def __init__(self, operator, operand):
+        self.operator = operator
+        self.operand = operand
+
+    def compile(self):
+        operand = self.operand.compile()
+        if self.operator == '+':
+            return operand
+        return lambda ctx: -operand(ctx)
+
+    def normalize(self):
+        operand = self.operand.normalize()
+        if self.operand.precedence < self.precedence:
+            operand = f"({operand})"
+        return f"{self.operator}{operand}"
+
+
+class Binary(Node):
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+        self.precedence, self.right_assoc = BINARY_OPERATORS[operator]
+
+    def compile(self):
+        function = BINARY_FUNCTIONS[self.operator]
+        left = self.left.compile()
+        right = self.right.compile()
+
+        def binary(ctx):
+            ctx.tick()
+            return function(left(ctx), right(ctx))
+        return binary
+
+    def normalize(self):
+        left = self.left.normalize()
+        right = self.right.normalize()
+        if self.left.precedence < self.precedence or (
+            self.right_assoc and self.left.precedence == self.precedence
+        ):
+            left = f"({left})"
+        if self.right.precedence < self.precedence or (
+            not self.right_assoc and self.right.precedence == self.precedence
+        ):
+            right = f"({right})"
+        return f"{left} {self.operator} {right}"
+
+
+class Parser:
+    def __init__(self, tokens, max_depth):
+        self.tokens = tokens
+        self.position = 0
+        self.max_depth = max_depth
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value):
+        kind, token = self.advance()
+        if token != value:
+            raise ExpressionError(f"Ожидался символ '{value}'")
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError('Пустое выражение')
+        node = self.parse_expression(0, 0)
+        if self.position != len(self.tokens):
+            raise ExpressionError(f"Неожиданный символ '{self.peek()[1]}'")
+        return node
+
+    def parse_expression(self, min_precedence, depth):
+        if depth > self.max_depth:
+            raise ExpressionError('Превышена допустимая глубина вложенности')
+
+        left = self.parse_unary(depth)
+        while True:
+            kind, token = self.peek()
+            if kind != 'op' or token not in BINARY_OPERATORS:
+                return left
+            precedence, right_assoc = BINARY_OPERATORS[token]
+            if precedence < min_precedence:
+                return left
+            self.advance()
+            next_precedence = precedence if right_assoc else precedence + 1
+            right = self.parse_expression(next_precedence, depth + 1)
+            left = Binary(token, left, right)
+
+    def parse_unary(self, depth):
+        kind, token = self.peek()
+        if kind == 'op' and token in ('+', '-'):
+            self.advance()
+            return Unary(token, self.parse_expression(UNARY_PRECEDENCE, depth + 1))
+        return self.parse_primary(depth)
+
+    def parse_primary(self, depth):
+        kind, token = self.advance()
+        if kind == 'number':
+            return Number(float(token))
+        if kind == 'name':
+            if token in CONSTANTS:
+                return Constant(token)
+            if token not in FUNCTIONS:
+                raise ExpressionError(f"Неизвестная функция '{token}'")
+            self.expect('(')
+            argument = self.parse_expression(0, depth + 1)
+            self.expect(')')
+            return Call(token, argument)
+        if token == '√':
+            return Call('sqrt', self.parse_expression(UNARY_PRECEDENCE, depth + 1))
+        if token == '(':
+            node = self.parse_expression(0, depth + 1)
+            self.expect(')')
+            return node
+        if token is None:
+            raise ExpressionError('Неожиданный конец выражения')
+        raise ExpressionError(f"Неожиданный символ '{token}'")
+
+
+class EvaluationContext:
+    CHECK_INTERVAL = 64
+
+    def __init__(self, time_limit):
+        self.deadline = time.perf_counter() + time_limit
+        self.steps = 0
+
+    def tick(self):
+        self.steps += 1
+        if self.steps % self.CHECK_INTERVAL == 0 and time.perf_counter() > self.deadline:
+            raise ExpressionError('Превышено время вычисления выражения')
+
+
+class CompiledExpression:
+    def __init__(self, source, tree):
+        self.source = source
+        self.normalized = tree.normalize()
+        self._evaluate = tree.compile()
+
+    def evaluate(self, time_limit=None):
+        if time_limit is None:
+            time_limit = _config('TIME_LIMIT', 0.05)
+        try:
+            result = self._evaluate(EvaluationContext(time_limit))
+        except OverflowError:
+            raise ExpressionError(OUT_OF_RANGE)
+        if not math.isfinite(result):
+            raise ExpressionError(OUT_OF_RANGE)
+        return round(result, RESULT_PRECISION)
+
+
+def _config(name, default):
+    return getattr(settings, 'CALCULATOR_EXPRESSIONS', {}).get(name, default)
+
+
+def parse(source):
+    if len(source) > _config('MAX_LENGTH', 200):
+        raise ExpressionError('Выражение слишком длинное')
+    tree = Parser(tokenize(source), _config('MAX_DEPTH', 32)).parse()
+    return CompiledExpression(source, tree)
+
+
+_compile_cached = None
+_compile_lock = threading.Lock()
+
+
+def compile_expression(source):
+    """
+    Разбирает выражение с кэшированием: горячие выражения не проходят
+    токенизацию и разбор повторно. Ошибки разбора не кэшируются.
+    """
+    global _compile_cached
+
+    if not isinstance(source, str):
+        raise ExpressionError('Выражение должно быть строкой')
+    if _compile_cached is None:
+        with _compile_lock:
+            if _compile_cached is None:
+                _compile_cached = lru_cache(maxsize=_config('CACHE_SIZE', 1024))(parse)
+    return _compile_cached(source.strip())
+
+
+def cache_info():
+    return _compile_cached.cache_info() if _compile_cached else None
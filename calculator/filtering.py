@@ -0,0 +1,116 @@
+import re
+import zoneinfo
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+
+DATETIME_FORMATS = (
+    ('%Y-%m-%d', timedelta(days=1)),
+    ('%Y-%m-%dT%H', timedelta(hours=1)),
+    ('%Y-%m-%dT%H:%M', timedelta(minutes=1)),
+    ('%Y-%m-%dT%H:%M:%S', timedelta(seconds=1)),
+)
+WINDOW_RE = re.compile(r'^(\d+)\s*([mhdw])$')
+WINDOW_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def get_timezone(params):
+    name = params.get('tz', None)
+    if name:
+        try:
+            return zoneinfo.ZoneInfo(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            pass
+    return timezone.get_current_timezone()
+
+
+def parse_period(value, tz):
+    """
+    Разбирает дату, час, минуту или секунду («2024-05-01», «2024-05-01T14»,
+    «2024-05-01 14:30») в часовом поясе пользователя. Возвращает
+    полуинтервал [start, end) этого периода в aware-datetime (UTC) или
+    None. Граница, выходящая за пределы datetime (0001-01-01 восточнее
+    UTC, конец 9999-12-31), заменяется на None — интервал не ограничен.
+    """
+    value = value.strip().replace(' ', 'T')
+    for fmt, length in DATETIME_FORMATS:
+        try:
+            start = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return _to_utc(start, tz), _to_utc(start, tz, length)
+    return None
+
+
+def _to_utc(value, tz, offset=timedelta()):
+    try:
+        return timezone.make_aware(value + offset, tz).astimezone(dt_timezone.utc)
+    except OverflowError:
+        return None
+
+
+def parse_window(value):
+    match = WINDOW_RE.match(value.strip().lower())
+    if not match:
+        return None
+    try:
+        return timedelta(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+    except OverflowError:
+        return timedelta.max
+
+
+def filter_history(queryset, params):
+    """
+    Фильтры истории вычислений. Границы дат переводятся в полуинтервал по
+    created_at (created_at >= начало, created_at < конец периода), без
+    приведения колонки к дате, поэтому запрос остаётся диапазонным
+    сканированием по индексу (user, created_at).
+    """
+    operation = params.get('operation', None)
+    date_from = params.get('date_from', None)
+    date_to = params.get('date_to', None)
+    last = params.get('last', None)
+    
+    if operation:
+        queryset = queryset.filter(operation=operation)
+    
+    if date_from or date_to:
+        tz = get_timezone(params)
+        
+        if date_from:
+            period = parse_period(date_from, tz)
+            if period and period[0]:
+                queryset = queryset.filter(created_at__gte=period[0])
+        
+        if date_to:
+            period = parse_period(date_to, tz)
+            if period and period[1]:
+                queryset = queryset.filter(created_at__lt=period[1])
+    
+    if last:
+        window = parse_window(last)
+        if window:
+            try:
+                queryset = queryset.filter(created_at__gte=timezone.now() - window)
+            except OverflowError:
+                # Окно длиннее допустимого диапазона дат — вся история.
+                pass
+    
+    for field in ('result', 'num1', 'num2'):
+        minimum = params.get(f'{field}_min', None)
+        maximum = params.get(f'{field}_max', None)
+        
+        if minimum:
+            try:
+                queryset = queryset.filter(**{f'{field}__gte': float(minimum)})
+            except ValueError:
+                pass
+        
+        if maximum:
+            try:
+                queryset = queryset.filter(**{f'{field}__lte': float(maximum)})
+            except ValueError:
+                pass
+    
+    return queryset
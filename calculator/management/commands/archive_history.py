@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from calculator import retention, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит вычисления, вышедшие за пределы CALCULATOR_RETENTION, '
+        'в архив и сжимает базу данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database',
+                            help='Шард истории; по умолчанию обрабатываются все шарды')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать строки, подлежащие архивации')
+        parser.add_argument('--no-compact', action='store_true',
+                            help='Не выполнять VACUUM/ANALYZE после архивации')
+
+    def handle(self, *args, **options):
+        aliases = [options['database']] if options['database'] else sharding.databases()
+        if options['dry_run']:
+            rows = sum(retention.apply_retention(using=using, dry_run=True) for using in aliases)
+            self.stdout.write(f'К архивации: {rows} вычислений')
+            return
+
+        rows = sum(
+            retention.apply_retention(
+                using=using,
+                compact_database=False if options['no_compact'] else None
+            )
+            for using in aliases
+        )
+        self.stdout.write(self.style.SUCCESS(f'В архив перенесено {rows} вычислений'))
@@ -0,0 +1,190 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест REST API калькулятора: засевает историю, '
+        'гоняет конкурентных клиентов и пишет результаты в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help='Сколько вычислений должно быть в истории (от 1k до 10M)')
+        parser.add_argument('--users', type=int, default=10,
+                            help='Между сколькими пользователями распределить историю')
+        parser.add_argument('--clients', type=int, default=4,
+                            help='Число конкурентных клиентов')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждый эндпоинт')
+        parser.add_argument('--endpoints', default=','.join(benchmark.DEFAULT_ENDPOINTS),
+                            help='Список эндпоинтов через запятую')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--skip-seed', action='store_true',
+                            help='Не досоздавать историю, использовать уже засеянную')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Удалить пользователей bench_* и их историю после прогона')
+        parser.add_argument('--engine-iterations', type=int, default=20000,
+                            help='Операций на режим в микробенчмарке движка (0 — пропустить)')
+        parser.add_argument('--serialization-rows', type=int, default=1000,
+                            help='Строк в микробенчмарке сериализации списков (0 — пропустить)')
+        parser.add_argument('--accept-encoding', default='br, gzip',
+                            help='Заголовок Accept-Encoding запросов (пустая строка — без сжатия)')
+        parser.add_argument('--profiles',
+                            help='Сравнить профили БД (CALCULATOR_DB_PROFILE) через запятую, '
+                                 'каждый прогон — в отдельном процессе')
+        parser.add_argument('--shards',
+                            help='Сравнить число шардов истории (CALCULATOR_SHARDS) через запятую, '
+                                 'например 1,2,4; базы шардов мигрируются перед прогоном')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(benchmark.ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Неизвестные эндпоинты: {', '.join(sorted(unknown))}")
+        if options['users'] < 1 or options['clients'] < 1:
+            raise CommandError('--users и --clients должны быть положительными')
+        if options['profiles'] and options['shards']:
+            raise CommandError('--profiles и --shards нельзя использовать вместе')
+        if options['profiles']:
+            return self.compare(endpoints, options, 'CALCULATOR_DB_PROFILE', options['profiles'], 'profiles')
+        if options['shards']:
+            return self.compare(endpoints, options, 'CALCULATOR_SHARDS', options['shards'], 'shards')
+
+        if options['skip_seed']:
+            user_ids = list(benchmark.bench_users().values_list('id', flat=True)[:options['users']])
+            if not user_ids:
+                raise CommandError('Нет засеянных пользователей, запустите без --skip-seed')
+        else:
+            self.stdout.write(f"Засев: {options['rows']} вычислений, {options['users']} пользователей")
+            started = time.perf_counter()
+            user_ids = benchmark.seed(
+                options['rows'], options['users'], seed=options['seed'], stdout=self.stdout
+            )
+            self.stdout.write(f'Засев завершён за {time.perf_counter() - started:.1f} с')
+
+        results = {
+            'environment': benchmark.environment(),
+            'parameters': {
+                name: options[name] for name in ('rows', 'users', 'clients', 'requests', 'seed')
+            },
+            'endpoints': {},
+        }
+
+        for name in endpoints:
+            summary = benchmark.run_endpoint(
+                benchmark.ENDPOINTS[name], user_ids,
+                clients=options['clients'], requests=options['requests'], seed=options['seed'],
+                accept_encoding=options['accept_encoding']
+            )
+            results['endpoints'][name] = summary
+            latency = summary['latency_ms']
+            size = summary['response_bytes']
+            self.stdout.write(
+                f"{name:20} {summary['requests_per_second']:>9} rps  "
+                f"p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms  "
+                f"queries={summary['queries_per_request']['mean']}  errors={summary['errors']}  "
+                f"bytes={size['mean']}/{size['mean_uncompressed']}"
+            )
+
+        if options['engine_iterations'] > 0:
+            results['engine'] = benchmark.engine_benchmark(options['engine_iterations'], seed=options['seed'])
+            for mode, summary in results['engine'].items():
+                self.stdout.write(
+                    f"engine {mode:13} {summary['microseconds_per_operation']:>9} мкс/операцию  "
+                    f"errors={summary['errors']}"
+                )
+
+        if options['serialization_rows'] > 0:
+            results['serialization'] = benchmark.serialization_benchmark(user_ids, options['serialization_rows'])
+            for name, summary in results['serialization'].items():
+                if name == 'compression':
+                    continue
+                self.stdout.write(
+                    f"serialize {name:16} {summary['milliseconds']:>9} мс на {summary['rows']} строк  "
+                    f"{summary['bytes']} байт"
+                )
+            for encoding, summary in results['serialization']['compression'].items():
+                self.stdout.write(
+                    f"compress {encoding:17} {summary['milliseconds']:>9} мс  "
+                    f"{summary['bytes']} байт (-{summary['saved_percent']}%)"
+                )
+
+        if options['cleanup']:
+            benchmark.cleanup()
+
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+        else:
+            self.stdout.write(report)
+
+    def compare(self, endpoints, options, variable, values, key):
+        """
+        Прогоняет бенчмарк в отдельном процессе для каждого значения
+        переменной окружения variable и собирает отчёты в results[key].
+        """
+        values = [value.strip() for value in values.split(',') if value.strip()]
+        results = {
+            'environment': benchmark.environment(),
+            'parameters': {
+                name: options[name] for name in ('rows', 'users', 'clients', 'requests', 'seed')
+            },
+            key: {},
+        }
+
+        for value in values:
+            self.stdout.write(f'{variable}={value}')
+            env = {**os.environ, variable: value}
+            if variable == 'CALCULATOR_SHARDS':
+                self.migrate_shards(env, int(value))
+            with tempfile.TemporaryDirectory() as directory:
+                output = os.path.join(directory, 'profile.json')
+                command = [
+                    sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark',
+                    '--rows', str(options['rows']), '--users', str(options['users']),
+                    '--clients', str(options['clients']), '--requests', str(options['requests']),
+                    '--endpoints', ','.join(endpoints), '--seed', str(options['seed']),
+                    '--output', output,
+                ]
+                if options['skip_seed']:
+                    command.append('--skip-seed')
+                completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise CommandError(f'Прогон {variable}={value} завершился ошибкой:\n{completed.stderr}')
+                self.stdout.write(completed.stdout.split('Результаты записаны')[0].rstrip())
+                with open(output, encoding='utf-8') as f:
+                    results[key][value] = json.load(f)
+
+        if options['cleanup']:
+            benchmark.cleanup()
+
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+        else:
+            self.stdout.write(report)
+
+    def migrate_shards(self, env, count):
+        for index in range(1, count):
+            completed = subprocess.run(
+                [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'migrate',
+                 '--database', f'shard{index}', '--verbosity', '0'],
+                env=env, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                raise CommandError(f'Не удалось мигрировать shard{index}:\n{completed.stderr}')
@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator import sharding
+from calculator.models import Calculation
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит историю пользователей между шардами: отдельных '
+        'пользователей в указанный шард или всех — в шарды по умолчанию'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='Имя или id пользователя (можно повторять)')
+        parser.add_argument('--to', help='Шард назначения для --user')
+        parser.add_argument('--all', action='store_true',
+                            help='Вернуть всех пользователей в шарды по умолчанию '
+                                 '(после изменения CALCULATOR_SHARDING)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--wait', type=float,
+                            help='Пауза перед досылкой строк, по умолчанию ASSIGNMENT_TTL')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, кто и куда будет перенесён')
+
+    def handle(self, *args, **options):
+        aliases = sharding.databases()
+        if options['user'] and options['all']:
+            raise CommandError('Укажите либо --user, либо --all')
+
+        if options['user']:
+            if options['to'] not in aliases:
+                raise CommandError(f"--to должен быть одним из шардов: {', '.join(aliases)}")
+            moves = [(user, options['to']) for user in self.resolve_users(options['user'])]
+        elif options['all']:
+            moves = [
+                (user, sharding.home_database(user.pk, aliases))
+                for user in User.objects.order_by('pk')
+            ]
+        else:
+            raise CommandError('Укажите --user ... --to ... или --all')
+
+        moves = [(user, target) for user, target in moves if sharding.database_for_user(user.pk) != target]
+        if not moves:
+            self.stdout.write('Переносить нечего')
+            return
+
+        for user, target in moves:
+            source = sharding.database_for_user(user.pk)
+            rows = Calculation.objects.for_user(user.pk).count()
+            self.stdout.write(f'{user.username}: {source} → {target}, {rows} вычислений')
+            if options['dry_run']:
+                continue
+            moved = sharding.move_user(
+                user.pk, target,
+                batch_size=options['batch_size'],
+                wait=options['wait'],
+                progress=lambda done: self.stdout.write(f'  перенесено {done}')
+            )
+            self.stdout.write(self.style.SUCCESS(f'  готово: {moved} вычислений'))
+
+    def resolve_users(self, values):
+        users = []
+        for value in values:
+            lookup = {'pk': int(value)} if value.isdigit() else {'username': value}
+            user = User.objects.filter(**lookup).first()
+            if user is None:
+                raise CommandError(f'Пользователь {value} не найден')
+            users.append(user)
+        return users
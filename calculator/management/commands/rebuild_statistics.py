@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from calculator import stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегированную статистику вычислений с нуля'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        rows = stats.rebuild(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересчитана: {rows} агрегатов'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator import replication
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует SQLite-базы истории в их реплики (имитация репликации '
+        'для локальной проверки чтения с реплик)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Повторять раз в указанное число секунд до прерывания')
+
+    def handle(self, *args, **options):
+        if not replication.get_config()['replicas']:
+            raise CommandError('Реплики не настроены (CALCULATOR_REPLICAS)')
+
+        interval = options['interval']
+        while True:
+            synced = replication.sync_all()
+            self.stdout.write(f'Обновлено реплик: {synced}')
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,309 @@
+"""
+Метрики запросов: латентность по эндпоинтам, разбивка времени по фазам
+(аутентификация, запросы к БД, рендеринг, остальной код приложения),
+число и время SQL-запросов, размер ответов.
+
+Счётчики ведутся в отдельном наборе на каждый поток без блокировок на
+горячем пути; при выдаче метрик наборы суммируются. Латентность
+измеряется у каждого запроса, разбивка по фазам — у доли запросов
+SAMPLE_RATE.
+"""
+import random
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('auth', 'db', 'render', 'app')
+UNMATCHED = 'unmatched'
+
+_current = ContextVar('calculator_request_timings', default=None)
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_METRICS', {})
+    return {
+        'enabled': config.get('ENABLED', True),
+        'sample_rate': config.get('SAMPLE_RATE', 1.0),
+        'buckets': tuple(config.get('BUCKETS', DEFAULT_BUCKETS)),
+    }
+
+
+class RequestTimings:
+    """
+    Разбивка времени одного сэмплированного запроса. Фазы не
+    пересекаются: время вложенной фазы (например, SQL внутри
+    аутентификации) вычитается из внешней.
+    """
+    __slots__ = ('phases', 'queries', 'active')
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.active = None
+
+    def begin(self, name):
+        token = (name, self.active, time.perf_counter())
+        self.active = name
+        return token
+
+    def end(self, token):
+        name, outer, started = token
+        elapsed = time.perf_counter() - started
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+        if outer is not None:
+            self.phases[outer] = self.phases.get(outer, 0.0) - elapsed
+        self.active = outer
+
+
+def current_timings():
+    return _current.get()
+
+
+class phase:
+    """Контекстный менеджер фазы; вне сэмплированного запроса ничего не делает."""
+
+    __slots__ = ('name', 'timings', 'token')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.token = self.timings.begin(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.end(self.token)
+
+
+def db_timer(execute, sql, params, many, context):
+    """
+    execute_wrapper, который устанавливается на каждое соединение
+    (см. install_db_timer) и учитывает запросы сэмплированного запроса.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    timings.queries += 1
+    token = timings.begin('db')
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.end(token)
+
+
+def install_db_timer(sender, connection, **kwargs):
+    if db_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_timer)
+
+
+class EndpointStats:
+    __slots__ = (
+        'statuses', 'buckets', 'duration_sum', 'duration_count',
+        'sampled', 'phases', 'queries', 'response_bytes', 'sized',
+    )
+
+    def __init__(self, bucket_count):
+        self.statuses = {}
+        self.buckets = [0] * bucket_count
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self.sampled = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.response_bytes = 0
+        self.sized = 0
+
+    def merge(self, other):
+        for code, count in other.statuses.items():
+            self.statuses[code] = self.statuses.get(code, 0) + count
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.duration_sum += other.duration_sum
+        self.duration_count += other.duration_count
+        self.sampled += other.sampled
+        for name, value in other.phases.items():
+            self.phases[name] += value
+        self.queries += other.queries
+        self.response_bytes += other.response_bytes
+        self.sized += other.sized
+
+
+class MetricsRegistry:
+    """
+    Счётчики по эндпоинтам. Каждый поток пишет в свой шард без
+    блокировок; шарды завершившихся потоков (поток на запрос, фоновые
+    задания) сливаются в общий итог, чтобы их число не росло.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_finished()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _merge_into(self, target, shard):
+        for key, stats in list(shard.items()):
+            if key not in target:
+                target[key] = EndpointStats(len(self.buckets))
+            target[key].merge(stats)
+
+    def _retire_finished(self):
+        """Вызывается под _shards_lock."""
+        alive = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                alive.append((thread_ref, shard))
+            else:
+                self._merge_into(self._retired, shard)
+        self._shards = alive
+
+    def record(self, endpoint, method, status_code, duration, size=None, timings=None):
+        shard = self._shard()
+        key = (endpoint, method)
+        stats = shard.get(key)
+        if stats is None:
+            stats = shard[key] = EndpointStats(len(self.buckets))
+
+        stats.statuses[status_code] = stats.statuses.get(status_code, 0) + 1
+        stats.duration_sum += duration
+        stats.duration_count += 1
+        for index, bound in enumerate(self.buckets):
+            if duration <= bound:
+                stats.buckets[index] += 1
+                break
+        if size is not None:
+            stats.response_bytes += size
+            stats.sized += 1
+        if timings is not None:
+            stats.sampled += 1
+            stats.queries += timings.queries
+            accounted = 0.0
+            for name, value in timings.phases.items():
+                stats.phases[name] += value
+                accounted += value
+            stats.phases['app'] += max(duration - accounted, 0.0)
+
+    def collect(self):
+        with self._shards_lock:
+            self._retire_finished()
+            shards = [shard for _, shard in self._shards]
+            merged = {}
+            self._merge_into(merged, self._retired)
+        for shard in shards:
+            self._merge_into(merged, shard)
+        return merged
+
+    def reset(self):
+        with self._shards_lock:
+            self._retired.clear()
+            for _, shard in self._shards:
+                shard.clear()
+
+    def render(self):
+        return render_prometheus(self.collect(), self.buckets)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render_prometheus(collected, buckets):
+    """Текстовый формат экспозиции Prometheus 0.0.4."""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    items = sorted(collected.items())
+
+    family('calculator_requests_total', 'counter', 'Число обработанных запросов.')
+    for (endpoint, method), stats in items:
+        for code, count in sorted(stats.statuses.items()):
+            lines.append(f'calculator_requests_total{_labels(endpoint=endpoint, method=method, status=code)} {count}')
+
+    family('calculator_request_duration_seconds', 'histogram', 'Время обработки запроса.')
+    for (endpoint, method), stats in items:
+        cumulative = 0
+        for bound, count in zip(buckets, stats.buckets):
+            cumulative += count
+            labels = _labels(endpoint=endpoint, method=method, le=repr(float(bound)))
+            lines.append(f'calculator_request_duration_seconds_bucket{labels} {cumulative}')
+        labels = _labels(endpoint=endpoint, method=method, le='+Inf')
+        lines.append(f'calculator_request_duration_seconds_bucket{labels} {stats.duration_count}')
+        labels = _labels(endpoint=endpoint, method=method)
+        lines.append(f'calculator_request_duration_seconds_sum{labels} {stats.duration_sum!r}')
+        lines.append(f'calculator_request_duration_seconds_count{labels} {stats.duration_count}')
+
+    family('calculator_sampled_requests_total', 'counter', 'Запросы с разбивкой времени по фазам.')
+    for (endpoint, method), stats in items:
+        lines.append(f'calculator_sampled_requests_total{_labels(endpoint=endpoint, method=method)} {stats.sampled}')
+
+    family('calculator_request_phase_seconds_total', 'counter', 'Суммарное время сэмплированных запросов по фазам.')
+    for (endpoint, method), stats in items:
+        for name in PHASES:
+            labels = _labels(endpoint=endpoint, method=method, phase=name)
+            lines.append(f'calculator_request_phase_seconds_total{labels} {stats.phases[name]!r}')
+
+    family('calculator_db_queries_total', 'counter', 'SQL-запросы сэмплированных запросов.')
+    for (endpoint, method), stats in items:
+        lines.append(f'calculator_db_queries_total{_labels(endpoint=endpoint, method=method)} {stats.queries}')
+
+    family('calculator_response_size_bytes', 'summary', 'Размер тела ответа (без потоковых ответов).')
+    for (endpoint, method), stats in items:
+        labels = _labels(endpoint=endpoint, method=method)
+        lines.append(f'calculator_response_size_bytes_sum{labels} {stats.response_bytes}')
+        lines.append(f'calculator_response_size_bytes_count{labels} {stats.sized}')
+
+    return '\n'.join(lines) + '\n'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(get_config()['buckets'])
+    return _registry
+
+
+def start_request(sample_rate):
+    """
+    Начинает разбивку времени запроса с вероятностью sample_rate.
+    Возвращает (timings, token) для finish_request или (None, None).
+    """
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        return None, None
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish_request(token):
+    if token is not None:
+        _current.reset(token)
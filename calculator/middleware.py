@@ -0,0 +1,274 @@
+import cProfile
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import compression, metrics, profiling, replication
+from .authentication import StatelessJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """
+    Собирает метрики запросов в calculator.metrics. Должен стоять первым
+    в MIDDLEWARE, чтобы учитывать время остальных middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = metrics.get_config()
+        self.enabled = config['enabled']
+        self.sample_rate = config['sample_rate']
+        self.registry = metrics.get_registry()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        timings, token = metrics.start_request(self.sample_rate)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, response, time.perf_counter() - started, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        timings, token = metrics.start_request(self.sample_rate)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, response, time.perf_counter() - started, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        timings = metrics.current_timings()
+        if timings is not None:
+            render = timings.begin('render')
+            response.add_post_render_callback(lambda rendered: timings.end(render))
+        return response
+
+    def record(self, request, response, duration, timings):
+        match = request.resolver_match
+        size = None if response.streaming else len(response.content)
+        self.registry.record(
+            match.view_name if match is not None else metrics.UNMATCHED,
+            request.method,
+            response.status_code,
+            duration,
+            size=size,
+            timings=timings
+        )
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы gzip или brotli по Accept-Encoding, см.
+    calculator.compression. Должен стоять сразу после MetricsMiddleware,
+    чтобы сжимать уже окончательное тело ответа.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = compression.get_config()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if not self.config['enabled'] or not compression.compressible(response, self.config):
+            return response
+
+        # Тело зависит от Accept-Encoding, даже если этот клиент сжатия не просил.
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compression.compress_stream(
+                response.streaming_content, encoding, self.config
+            )
+            del response.headers['Content-Length']
+        else:
+            compressed = compression.compress(response.content, encoding, self.config)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # Сжатое представление побайтно отличается от исходного.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Открывает для запроса контекст чтения с реплик, см.
+    calculator.replication. Без настроенных реплик ничего не делает.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = replication.get_config()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.config['replicas']:
+            return self.get_response(request)
+
+        token = replication.start_request(request, self.config)
+        try:
+            return self.get_response(request)
+        finally:
+            replication.finish_request(token)
+
+    async def __acall__(self, request):
+        if not self.config['replicas']:
+            return await self.get_response(request)
+
+        token = replication.start_request(request, self.config)
+        try:
+            return await self.get_response(request)
+        finally:
+            replication.finish_request(token)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует запросы по запросу администратора или автоматически
+    для медленных запросов, см. calculator.profiling. Должен стоять
+    после AuthenticationMiddleware. Асинхронные запросы не профилируются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = profiling.get_config()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if not self.config['enabled']:
+            return self.get_response(request)
+
+        manual = self.manual_requested(request)
+        if not manual and not self.slow_candidate(request):
+            return self.get_response(request)
+
+        capture, token = profiling.start_capture(self.config['max_sql'])
+        profiler = samples = None
+        if manual:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # В процессе уже работает другой профилировщик.
+                profiler = None
+        if profiler is None:
+            sampler = profiling.get_sampler()
+            thread_id = threading.get_ident()
+            samples = sampler.add(thread_id)
+
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            else:
+                sampler.remove(thread_id)
+            profiling.finish_capture(token)
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        if manual or duration_ms >= self.config['slow_threshold_ms']:
+            if profiler is not None:
+                profile = profiling.cprofile_summary(profiler, self.config['top_functions'])
+            else:
+                profile = profiling.sampling_summary(samples, sampler.interval)
+            profile_id = self.store(request, response, duration_ms, manual, capture, profile)
+            if manual and profile_id is not None:
+                response['X-Calculator-Profile-Id'] = profile_id
+        return response
+
+    def manual_requested(self, request):
+        flag = request.GET.get(self.config['param']) or request.headers.get(self.config['header'])
+        if flag not in ('1', 'true', 'True'):
+            return False
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        try:
+            authenticated = StatelessJWTAuthentication().authenticate(request)
+        except (AuthenticationFailed, InvalidToken):
+            return False
+        return authenticated is not None and authenticated[0].is_staff
+
+    def slow_candidate(self, request):
+        if self.config['slow_threshold_ms'] is None:
+            return False
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return False
+        return match.url_name in self.config['auto_url_names']
+
+    def store(self, request, response, duration_ms, manual, capture, profile):
+        user = getattr(request, 'user', None)
+        match = request.resolver_match
+        try:
+            return profiling.save({
+                'trigger': profiling.MANUAL if manual else profiling.SLOW,
+                'method': request.method,
+                'path': request.get_full_path(),
+                'view': match.view_name if match is not None else None,
+                'user': user.username if user is not None and user.is_authenticated else None,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 3),
+                'sql': capture.sql,
+                'sql_dropped': capture.sql_dropped,
+                'profile': profile,
+            }, self.config)
+        except OSError:
+            logger.exception('Не удалось сохранить профиль запроса %s', request.path)
+            return None
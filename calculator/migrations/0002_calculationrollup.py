@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 20:31
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def build_rollups(apps, schema_editor):
+    from calculator.stats import expand_grains, rollup_key
+
+    Calculation = apps.get_model('calculator', 'Calculation')
+    CalculationRollup = apps.get_model('calculator', 'CalculationRollup')
+    db_alias = schema_editor.connection.alias
+
+    rows = (
+        Calculation.objects.using(db_alias)
+        .order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('user_id', 'operation', 'day')
+        .annotate(count=Count('id'))
+        .values_list('user_id', 'operation', 'day', 'count')
+    )
+    CalculationRollup.objects.using(db_alias).bulk_create([
+        CalculationRollup(
+            key=rollup_key(user_id, operation, day),
+            user_id=user_id,
+            operation=operation,
+            day=day,
+            count=count
+        )
+        for (user_id, operation, day), count in expand_grains(rows).items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('user_id', models.BigIntegerField(default=0)),
+                ('operation', models.CharField(blank=True, default='', max_length=20)),
+                ('day', models.DateField(blank=True, null=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'day'], name='calculator__user_id_e10eb2_idx'), models.Index(fields=['operation', 'day', 'count'], name='calculator__operati_52b45a_idx')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
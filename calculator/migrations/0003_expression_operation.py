@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0002_calculationrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='calculation',
+            name='expression',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='calculation',
+            name='num1',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='calculation',
+            name='operation',
+            field=models.CharField(choices=[('add', 'Сложение'), ('subtract', 'Вычитание'), ('multiply', 'Умножение'), ('divide', 'Деление'), ('power', 'Возведение в степень'), ('sqrt', 'Квадратный корень'), ('expression', 'Выражение')], max_length=20),
+        ),
+    ]
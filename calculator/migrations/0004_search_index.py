@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 20:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    from calculator.search import create_index
+
+    Calculation = apps.get_model('calculator', 'Calculation')
+    create_index(
+        schema_editor,
+        Calculation._meta.db_table,
+        Calculation._meta.get_field('user').related_model._meta.db_table
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    from calculator.search import drop_index
+
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0003_expression_operation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(fields=['user', 'result'], name='calculator__user_id_a43eed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(fields=['result'], name='calculator__result_3ef12b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(fields=['num1'], name='calculator__num1_37a4a3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(fields=['num2'], name='calculator__num2_c2258a_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
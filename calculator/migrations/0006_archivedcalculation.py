@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 20:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0005_purgejob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCalculation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('num1', models.FloatField(blank=True, null=True)),
+                ('num2', models.FloatField(blank=True, null=True)),
+                ('operation', models.CharField(choices=[('add', 'Сложение'), ('subtract', 'Вычитание'), ('multiply', 'Умножение'), ('divide', 'Деление'), ('power', 'Возведение в степень'), ('sqrt', 'Квадратный корень'), ('expression', 'Выражение')], max_length=20)),
+                ('result', models.FloatField()),
+                ('expression', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_calculations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='calculator__user_id_085a3f_idx'), models.Index(fields=['created_at'], name='calculator__created_f3d7e3_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 20:47
+
+from django.db import migrations, models
+
+from calculator.search import create_index_operation, drop_index_operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0006_archivedcalculation'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_index_operation, create_index_operation),
+        migrations.AddField(
+            model_name='archivedcalculation',
+            name='mode',
+            field=models.CharField(choices=[('float', 'Float'), ('decimal', 'Decimal'), ('fraction', 'Дробь')], default='float', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='archivedcalculation',
+            name='num1_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='archivedcalculation',
+            name='num2_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='archivedcalculation',
+            name='result_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='mode',
+            field=models.CharField(choices=[('float', 'Float'), ('decimal', 'Decimal'), ('fraction', 'Дробь')], default='float', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='num1_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='num2_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='result_exact',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(create_index_operation, drop_index_operation),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 21:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+from calculator.search import create_index_operation, drop_index_operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0008_historyversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(unique=True)),
+                ('database', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(drop_index_operation, create_index_operation),
+        migrations.AlterField(
+            model_name='archivedcalculation',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_calculations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='calculation',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='calculation',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='calculations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_index_operation, drop_index_operation),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-18 22:40
+
+from django.db import migrations
+from django.db.models import Max, Sum
+
+
+# Общие итоги больше не хранятся: статистика и общий счётчик изменений
+# складываются при чтении из строк пользователей.
+ALL_USERS = 0
+
+
+def drop_global_rows(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for name in ('CalculationRollup', 'HistoryVersion'):
+        apps.get_model('calculator', name).objects.using(db_alias).filter(user_id=ALL_USERS).delete()
+
+
+def restore_global_rows(apps, schema_editor):
+    CalculationRollup = apps.get_model('calculator', 'CalculationRollup')
+    HistoryVersion = apps.get_model('calculator', 'HistoryVersion')
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        CalculationRollup.objects.using(db_alias)
+        .exclude(user_id=ALL_USERS)
+        .values('operation', 'day')
+        .annotate(total=Sum('count'))
+        .values_list('operation', 'day', 'total')
+    )
+    CalculationRollup.objects.using(db_alias).bulk_create([
+        CalculationRollup(
+            key=f"{ALL_USERS}:{operation}:{day.isoformat() if day else ''}",
+            user_id=ALL_USERS,
+            operation=operation,
+            day=day,
+            count=total
+        )
+        for operation, day, total in totals
+    ])
+
+    version = HistoryVersion.objects.using(db_alias).aggregate(version=Sum('version'), updated_at=Max('updated_at'))
+    if version['version'] is not None:
+        HistoryVersion.objects.using(db_alias).create(user_id=ALL_USERS, **version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0009_sharding'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_global_rows, restore_global_rows),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 6.0 on 2026-10-18 22:55
+
+from django.db import OperationalError, migrations
+
+
+# Миграции 0004, 0007 и 0009 строили FTS5-индекс функциями из
+# calculator.search. Эта миграция пересобирает его SQL, встроенным в неё
+# саму, чтобы дальнейшая история не зависела от кода приложения. SQLite
+# пересоздаёт таблицу при изменении её полей и теряет триггеры, поэтому
+# следующие миграции, меняющие Calculation, копируют этот SQL, снимают
+# индекс до изменений и строят заново после.
+FTS_TABLE = 'calculator_calculation_fts'
+
+CREATE_INDEX = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"expression, operation, username, "
+    f"tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    f"INSERT INTO {FTS_TABLE}(rowid, expression, operation, username) "
+    f"SELECT c.id, c.expression, c.operation, u.username "
+    f"FROM calculator_calculation c JOIN auth_user u ON u.id = c.user_id",
+    f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON calculator_calculation BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, expression, operation, username) "
+    f"VALUES (new.id, new.expression, new.operation, "
+    f"(SELECT username FROM auth_user WHERE id = new.user_id)); END",
+    f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON calculator_calculation BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+    f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF expression, operation, user_id "
+    f"ON calculator_calculation BEGIN "
+    f"UPDATE {FTS_TABLE} SET expression = new.expression, operation = new.operation, "
+    f"username = (SELECT username FROM auth_user WHERE id = new.user_id) "
+    f"WHERE rowid = new.id; END",
+    f"CREATE TRIGGER {FTS_TABLE}_username AFTER UPDATE OF username ON auth_user BEGIN "
+    f"UPDATE {FTS_TABLE} SET username = new.username WHERE rowid IN "
+    f"(SELECT id FROM calculator_calculation WHERE user_id = new.id); END",
+]
+
+DROP_INDEX = [
+    *(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}" for suffix in ('insert', 'delete', 'update', 'username')),
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_index(apps, schema_editor):
+    """FTS5-индекс истории; на других СУБД и без FTS5 не создаётся."""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"CREATE VIRTUAL TABLE temp.{FTS_TABLE}_probe USING fts5(probe)")
+            cursor.execute(f"DROP TABLE temp.{FTS_TABLE}_probe")
+        except OperationalError:
+            return
+    for statement in CREATE_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_INDEX:
+        schema_editor.execute(statement)
+
+
+def rebuild_index(apps, schema_editor):
+    drop_index(apps, schema_editor)
+    create_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0010_drop_global_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_index, rebuild_index),
+    ]
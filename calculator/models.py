@@ -1,6 +1,83 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 import json
+import uuid
+from .engine import OPERATION_SYMBOLS
+from . import events, numeric, sharding, stats
+
+
+class CalculationQuerySet(models.QuerySet):
+    def for_user(self, user_id):
+        """Вычисления пользователя в его шарде, см. calculator.sharding."""
+        return sharding.for_user(self, user_id)
+    
+    def create(self, **kwargs):
+        if self._db is None and sharding.enabled():
+            user_id = kwargs['user'].pk if 'user' in kwargs else kwargs.get('user_id')
+            if user_id is not None:
+                return self.using(sharding.database_for_user(user_id)).create(**kwargs)
+        return super().create(**kwargs)
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is None and sharding.enabled():
+            # Без явной базы строки раскладываются по шардам пользователей,
+            # каждая группа пишется в своей транзакции.
+            objs = list(objs)
+            groups = {}
+            for obj in objs:
+                groups.setdefault(sharding.database_for_user(obj.user_id), []).append(obj)
+            for using, group in groups.items():
+                self.using(using).bulk_create(group, *args, **kwargs)
+            return objs
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            stats.record_created(objs, using=self.db)
+            events.calculations_created(objs, using=self.db)
+        return objs
+    
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            stats.record_deleted(self)
+            events.calculations_deleted(events.deleted_rows(self), using=self.db)
+            return super().delete()
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+    
+    def delete_in_batches(self, batch_size=5000, progress=None, before_delete=None):
+        """
+        Удаляет строки пачками по batch_size простыми DELETE ... WHERE id IN,
+        без коллектора Django: в памяти держатся только id одной пачки, а
+        каждая пачка коммитится отдельно, чтобы не блокировать запись
+        надолго. before_delete(chunk) вызывается в той же транзакции перед
+        удалением пачки, progress(deleted) — после её коммита.
+        
+        Удаляются только строки, существовавшие при вызове: id ограничен
+        максимальным на этот момент, поэтому вычисления, записанные во
+        время долгой очистки, остаются.
+        """
+        last_id = self.aggregate(last_id=models.Max('pk'))['last_id']
+        if last_id is None:
+            return 0
+        ids = self.filter(pk__lte=last_id).order_by('pk').values_list('pk', flat=True)
+        deleted = 0
+        while True:
+            batch = list(ids[:batch_size])
+            if not batch:
+                return deleted
+            chunk = self.model.objects.using(self.db).filter(pk__in=batch)
+            with transaction.atomic(using=self.db):
+                if before_delete is not None:
+                    before_delete(chunk)
+                stats.record_deleted(chunk)
+                events.calculations_deleted(events.deleted_rows(chunk), using=self.db)
+                deleted += chunk._raw_delete(self.db)
+            if progress is not None:
+                progress(deleted)
+    
+    delete_in_batches.alters_data = True
+    delete_in_batches.queryset_only = True
 
 class Calculation(models.Model):
     OPERATION_CHOICES = [
@@ -10,40 +87,202 @@ class Calculation(models.Model):
         ('divide', 'Деление'),
         ('power', 'Возведение в степень'),
         ('sqrt', 'Квадратный корень'),
+        ('expression', 'Выражение'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calculations')
-    num1 = models.FloatField()
+    # Пользователи живут в default, а история может лежать в другом шарде,
+    # поэтому ограничение внешнего ключа в БД не создаётся.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calculations', db_constraint=False)
+    num1 = models.FloatField(null=True, blank=True)
     num2 = models.FloatField(null=True, blank=True)
     operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
     result = models.FloatField()
-    expression = models.CharField(max_length=100)
-    created_at = models.DateTimeField(auto_now_add=True)
+    expression = models.CharField(max_length=255)
+    mode = models.CharField(max_length=10, choices=numeric.MODE_CHOICES, default=numeric.FLOAT)
+    num1_exact = models.TextField(blank=True, default='')
+    num2_exact = models.TextField(blank=True, default='')
+    result_exact = models.TextField(blank=True, default='')
+    # Не auto_now_add: при переносе между шардами время создания сохраняется.
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    objects = CalculationQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['user', 'result']),
+            models.Index(fields=['result']),
+            models.Index(fields=['num1']),
+            models.Index(fields=['num2']),
         ]
     
     def __str__(self):
         return f"{self.user.username}: {self.expression} = {self.result}"
     
-    def save(self, *args, **kwargs):
-        operation_symbols = {
-            'add': '+',
-            'subtract': '-',
-            'multiply': '*',
-            'divide': '/',
-            'power': '^',
-            'sqrt': '√'
-        }
-        
-        symbol = operation_symbols.get(self.operation, '?')
+    def build_expression(self):
+        if self.operation == 'expression':
+            return self.expression
+        if self.num1 is None and self.expression:
+            # Сводная запись массивного вычисления: операндов нет,
+            # выражение задано при создании.
+            return self.expression
+        symbol = OPERATION_SYMBOLS.get(self.operation, '?')
+        num1 = self.num1_exact or self.num1
+        num2 = self.num2_exact or self.num2
         if self.operation == 'sqrt':
-            self.expression = f"{symbol}({self.num1})"
+            self.expression = f"{symbol}({num1})"
         else:
-            self.expression = f"{self.num1} {symbol} {self.num2}"
-        
-        super().save(*args, **kwargs)
\ No newline at end of file
+            self.expression = f"{num1} {symbol} {num2}"
+        max_length = self._meta.get_field('expression').max_length
+        if len(self.expression) > max_length:
+            self.expression = self.expression[:max_length - 1] + '…'
+        return self.expression
+    
+    def save(self, *args, **kwargs):
+        self.build_expression()
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using):
+            adding = self._state.adding
+            previous = None
+            if not adding:
+                previous = (
+                    Calculation.objects.using(using).filter(pk=self.pk)
+                    .values_list('user_id', 'operation', 'created_at').first()
+                )
+            super().save(*args, **kwargs)
+            if adding:
+                stats.record_created([self], using=self._state.db)
+                events.calculations_created([self], using=self._state.db)
+                return
+            deltas = {}
+            if previous is not None:
+                # Смена операции или даты переносит запись между срезами
+                # агрегатов: общие срезы взаимно гасятся в expand_grains.
+                user_id, operation, created_at = previous
+                deltas = stats.expand_grains([
+                    (user_id, operation, timezone.localdate(created_at), -1),
+                    (self.user_id, self.operation, timezone.localdate(self.created_at), 1),
+                ])
+            stats.apply_deltas(deltas, using=self._state.db, touched=[self.user_id])
+    
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using):
+            stats.apply_deltas(
+                stats.expand_grains([
+                    (self.user_id, self.operation, timezone.localdate(self.created_at), 1)
+                ]),
+                sign=-1,
+                using=using
+            )
+            events.calculations_deleted([(self.pk, self.user_id)], using=using)
+            return super().delete(*args, **kwargs)
+
+
+class CalculationRollup(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    user_id = models.BigIntegerField(default=stats.ALL_USERS)
+    operation = models.CharField(max_length=20, blank=True, default=stats.ALL_OPERATIONS)
+    day = models.DateField(null=True, blank=True)
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'day']),
+            models.Index(fields=['operation', 'day', 'count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} = {self.count}"
+
+
+class HistoryVersion(models.Model):
+    """
+    Счётчик изменений истории пользователя. Увеличивается вместе с
+    агрегатами и служит валидатором для условных GET; общий счётчик —
+    сумма счётчиков пользователей (см. stats.get_version).
+    """
+    user_id = models.BigIntegerField(unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.user_id}: v{self.version}"
+
+
+class ArchivedCalculation(models.Model):
+    """
+    Вычисления, вынесенные из основной истории политикой хранения.
+    id совпадает с id исходной записи.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_calculations', db_constraint=False)
+    num1 = models.FloatField(null=True, blank=True)
+    num2 = models.FloatField(null=True, blank=True)
+    operation = models.CharField(max_length=20, choices=Calculation.OPERATION_CHOICES)
+    result = models.FloatField()
+    expression = models.CharField(max_length=255)
+    mode = models.CharField(max_length=10, choices=numeric.MODE_CHOICES, default=numeric.FLOAT)
+    num1_exact = models.TextField(blank=True, default='')
+    num2_exact = models.TextField(blank=True, default='')
+    result_exact = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.expression} = {self.result}"
+
+
+class PurgeJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершено'),
+        (FAILED, 'Ошибка'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='purge_jobs')
+    target_user_id = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total = models.BigIntegerField(default=0)
+    deleted = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.id}: {self.deleted}/{self.total} ({self.status})"
+    
+    def calculations(self):
+        """Удаляемые вычисления: по одному queryset на каждый затронутый шард."""
+        if self.target_user_id is not None:
+            return [Calculation.objects.for_user(self.target_user_id)]
+        return [Calculation.objects.using(using).all() for using in sharding.databases()]
+
+
+class ShardAssignment(models.Model):
+    """
+    Явное размещение истории пользователя в шарде, заданное командой
+    rebalance_shards. Пользователи без записи живут в шарде по умолчанию
+    (см. calculator.sharding.home_database). Хранится в default.
+    """
+    user_id = models.BigIntegerField(unique=True)
+    database = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id} → {self.database}"
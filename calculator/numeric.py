@@ -0,0 +1,228 @@
+"""
+Точные режимы вычислений: Decimal с настраиваемой точностью и Fraction.
+
+Режим float обслуживается engine.evaluate и сюда не попадает: этот
+модуль используется только когда клиент явно выбрал другой режим,
+поэтому пропускная способность float-пути не меняется.
+"""
+import decimal
+import math
+import sys
+from fractions import Fraction
+
+from django.conf import settings
+
+from .engine import (
+    DIVISION_BY_ZERO, INVALID_OPERATION, NEGATIVE_SQRT, OUT_OF_RANGE, UNARY_OPERATIONS,
+    CalculationError
+)
+
+
+FLOAT = 'float'
+DECIMAL = 'decimal'
+FRACTION = 'fraction'
+MODES = (FLOAT, DECIMAL, FRACTION)
+MODE_CHOICES = [
+    (FLOAT, 'Float'),
+    (DECIMAL, 'Decimal'),
+    (FRACTION, 'Дробь'),
+]
+
+INVALID_NUMBER = 'Некорректный ввод чисел'
+INVALID_MODE = 'Неизвестный режим вычислений'
+INVALID_PRECISION = 'Некорректная точность'
+INEXACT = 'Результат не выражается точной дробью'
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_NUMERIC', {})
+    return {
+        'default_mode': config.get('DEFAULT_MODE', FLOAT),
+        'decimal_precision': config.get('DECIMAL_PRECISION', 50),
+        'max_precision': config.get('MAX_PRECISION', 1000),
+        'max_digits': config.get('MAX_DIGITS', 1000),
+    }
+
+
+def resolve_mode(value):
+    mode = value or get_config()['default_mode']
+    if mode not in MODES:
+        raise CalculationError(INVALID_MODE, 'mode')
+    return mode
+
+
+def resolve_precision(value):
+    config = get_config()
+    if value in (None, ''):
+        return config['decimal_precision']
+    try:
+        precision = int(value)
+    except (TypeError, ValueError):
+        raise CalculationError(INVALID_PRECISION, 'precision')
+    if not 1 <= precision <= config['max_precision']:
+        raise CalculationError(INVALID_PRECISION, 'precision')
+    return precision
+
+
+def _check_size(value, max_digits):
+    if isinstance(value, Fraction):
+        digits = max(len(str(abs(value.numerator))), len(str(value.denominator)))
+    else:
+        digits = len(value.as_tuple().digits) if value.is_finite() else max_digits + 1
+    if digits > max_digits:
+        raise CalculationError(OUT_OF_RANGE)
+    return value
+
+
+def parse_operand(value, mode, field):
+    """
+    Разбирает операнд без потери точности. Числа лучше передавать
+    строками ("0.1", "1/3"): JSON-числа уже приходят как float.
+    """
+    max_digits = get_config()['max_digits']
+    text = str(value).strip()
+    if not text or len(text) > max_digits:
+        raise CalculationError(INVALID_NUMBER, field)
+
+    if mode == FRACTION:
+        # Показатель проверяется через Decimal до построения дроби,
+        # чтобы "1e1000000" не превращался в миллион цифр.
+        numerator, _, denominator = text.partition('/')
+        for part in filter(None, (numerator, denominator)):
+            try:
+                adjusted = decimal.Decimal(part).adjusted()
+            except (decimal.InvalidOperation, ValueError):
+                raise CalculationError(INVALID_NUMBER, field)
+            if abs(adjusted) > max_digits:
+                raise CalculationError(OUT_OF_RANGE, field)
+        try:
+            return Fraction(text)
+        except (ValueError, ZeroDivisionError):
+            raise CalculationError(INVALID_NUMBER, field)
+
+    try:
+        number = decimal.Decimal(text)
+    except decimal.InvalidOperation:
+        raise CalculationError(INVALID_NUMBER, field)
+    if not number.is_finite():
+        raise CalculationError(INVALID_NUMBER, field)
+    return number
+
+
+def _evaluate_decimal(operation, num1, num2):
+    if operation == 'add':
+        return num1 + num2
+    if operation == 'subtract':
+        return num1 - num2
+    if operation == 'multiply':
+        return num1 * num2
+    if operation == 'divide':
+        if num2 == 0:
+            raise CalculationError(DIVISION_BY_ZERO, 'num2')
+        return num1 / num2
+    if operation == 'power':
+        return num1 ** num2
+    if operation == 'sqrt':
+        if num1 < 0:
+            raise CalculationError(NEGATIVE_SQRT, 'num1')
+        return num1.sqrt()
+    raise CalculationError(INVALID_OPERATION, 'operation')
+
+
+def _exact_sqrt(value):
+    if value < 0:
+        raise CalculationError(NEGATIVE_SQRT, 'num1')
+    numerator, denominator = math.isqrt(value.numerator), math.isqrt(value.denominator)
+    if numerator * numerator != value.numerator or denominator * denominator != value.denominator:
+        raise CalculationError(INEXACT, 'num1')
+    return Fraction(numerator, denominator)
+
+
+def _evaluate_fraction(operation, num1, num2, max_digits):
+    if operation == 'add':
+        return num1 + num2
+    if operation == 'subtract':
+        return num1 - num2
+    if operation == 'multiply':
+        return num1 * num2
+    if operation == 'divide':
+        if num2 == 0:
+            raise CalculationError(DIVISION_BY_ZERO, 'num2')
+        return num1 / num2
+    if operation == 'power':
+        if num2.denominator != 1:
+            raise CalculationError(INEXACT, 'num2')
+        if num1 == 0 and num2 < 0:
+            raise CalculationError(DIVISION_BY_ZERO, 'num2')
+        # Оценка размера результата до возведения в степень.
+        bits = max(num1.numerator.bit_length(), num1.denominator.bit_length())
+        if bits > 1 and abs(num2.numerator) * (bits - 1) > max_digits * 4:
+            raise CalculationError(OUT_OF_RANGE)
+        return num1 ** num2.numerator
+    if operation == 'sqrt':
+        return _exact_sqrt(num1)
+    raise CalculationError(INVALID_OPERATION, 'operation')
+
+
+def evaluate(operation, num1, num2, mode, precision=None):
+    """
+    Вычисляет операцию над Decimal или Fraction и возвращает точный
+    результат того же типа.
+    """
+    config = get_config()
+    if mode == FRACTION:
+        result = _evaluate_fraction(operation, num1, num2, config['max_digits'])
+        return _check_size(result, config['max_digits'])
+
+    context = decimal.Context(
+        prec=precision or config['decimal_precision'],
+        traps=[decimal.InvalidOperation, decimal.DivisionByZero, decimal.Overflow]
+    )
+    try:
+        with decimal.localcontext(context):
+            result = _evaluate_decimal(operation, num1, num2)
+            result = +result
+    except (decimal.Overflow, decimal.InvalidOperation, decimal.DivisionByZero):
+        raise CalculationError(OUT_OF_RANGE)
+    return _check_size(result, config['max_digits'])
+
+
+def to_text(value):
+    if isinstance(value, Fraction):
+        return str(value)
+    value = value.normalize(decimal.Context(prec=max(1, len(value.as_tuple().digits))))
+    return format(value, 'f') if abs(value.adjusted()) < 30 else str(value)
+
+
+def approximate(value):
+    """
+    Приближение для float-колонок (сортировка, диапазонные фильтры,
+    статистика). Значения вне диапазона double насыщаются до ±max.
+    """
+    try:
+        number = float(value)
+    except OverflowError:
+        number = math.inf if value > 0 else -math.inf
+    if math.isinf(number):
+        return math.copysign(sys.float_info.max, number)
+    return number
+
+
+def calculate(operation, raw_num1, raw_num2, mode, precision=None):
+    """
+    Разбирает операнды и вычисляет результат в точном режиме. Возвращает
+    поля Calculation: приближения во float-колонках и точные значения
+    в текстовых.
+    """
+    num1 = parse_operand(raw_num1, mode, 'num1')
+    num2 = None if operation in UNARY_OPERATIONS else parse_operand(raw_num2, mode, 'num2')
+    result = evaluate(operation, num1, num2, mode, precision)
+    return {
+        'mode': mode,
+        'num1': approximate(num1),
+        'num2': None if num2 is None else approximate(num2),
+        'result': approximate(result),
+        'num1_exact': to_text(num1),
+        'num2_exact': '' if num2 is None else to_text(num2),
+        'result_exact': to_text(result),
+    }
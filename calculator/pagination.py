@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CalculationCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация по created_at: каждая страница — это диапазонный
+    проход по индексам (user, created_at) / (created_at) без OFFSET.
+    """
+    ordering = '-created_at'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    position_aliases = {'user__username': 'username'}
+
+    def _get_position_from_instance(self, instance, ordering):
+        field_name = ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            return str(instance[self.position_aliases.get(field_name, field_name)])
+
+        attr = instance
+        for part in field_name.split('__'):
+            attr = getattr(attr, part)
+        return str(attr)
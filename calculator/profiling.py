@@ -0,0 +1,257 @@
+"""
+Профилирование отдельных запросов.
+
+Администратор включает его для своего запроса параметром ?profile=1
+или заголовком X-Calculator-Profile: 1 — тогда запрос выполняется под
+cProfile. Если задан SLOW_THRESHOLD_MS, запросы к эндпоинтам из
+AUTO_URL_NAMES профилируются статистически (снимки стека раз в
+SAMPLE_INTERVAL_MS из фонового потока), и профиль сохраняется, только
+если запрос оказался медленнее порога. В обоих режимах пишутся
+SQL-запросы с временем выполнения.
+
+Профили хранятся JSON-файлами в DIRECTORY; после записи старые файлы
+сверх MAX_PROFILES удаляются.
+"""
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+
+MANUAL = 'manual'
+SLOW = 'slow'
+PROFILE_ID_RE = re.compile(r'^[0-9]{20}-[0-9a-f]{8}$')
+
+_current = ContextVar('calculator_profile_capture', default=None)
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_PROFILING', {})
+    return {
+        'enabled': config.get('ENABLED', True),
+        'directory': Path(config.get('DIRECTORY', Path(settings.BASE_DIR) / 'profiles')),
+        'max_profiles': config.get('MAX_PROFILES', 50),
+        'param': config.get('PARAM', 'profile'),
+        'header': config.get('HEADER', 'X-Calculator-Profile'),
+        'slow_threshold_ms': config.get('SLOW_THRESHOLD_MS'),
+        'auto_url_names': tuple(config.get('AUTO_URL_NAMES', ('calculations-list', 'admin-calculations'))),
+        'sample_interval_ms': config.get('SAMPLE_INTERVAL_MS', 5),
+        'max_sql': config.get('MAX_SQL', 500),
+        'top_functions': config.get('TOP_FUNCTIONS', 50),
+    }
+
+
+class Capture:
+    """SQL-запросы одного профилируемого запроса."""
+
+    __slots__ = ('sql', 'sql_dropped', 'max_sql')
+
+    def __init__(self, max_sql):
+        self.sql = []
+        self.sql_dropped = 0
+        self.max_sql = max_sql
+
+
+def sql_recorder(execute, sql, params, many, context):
+    capture = _current.get()
+    if capture is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if len(capture.sql) < capture.max_sql:
+            capture.sql.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'many': many,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+        else:
+            capture.sql_dropped += 1
+
+
+def install_sql_recorder(sender, connection, **kwargs):
+    if sql_recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_recorder)
+
+
+def start_capture(max_sql):
+    capture = Capture(max_sql)
+    return capture, _current.set(capture)
+
+
+def finish_capture(token):
+    _current.reset(token)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse_stack(frame, max_depth=64):
+    names = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Общий для процесса поток, который раз в interval секунд снимает
+    стеки зарегистрированных потоков через sys._current_frames().
+    Пока профилируемых запросов нет, поток спит.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='calculator-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return samples
+
+    def remove(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(get_config()['sample_interval_ms'] / 1000)
+    return _sampler
+
+
+def cprofile_summary(profiler, limit):
+    text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text).sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(limit)
+
+    functions = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        functions.append({
+            'function': f"{filename}:{line}({name})",
+            'ncalls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        })
+    functions.sort(key=lambda item: item['cumtime_ms'], reverse=True)
+    return {'kind': 'cprofile', 'functions': functions[:limit], 'text': text.getvalue()}
+
+
+def sampling_summary(samples, interval):
+    return {
+        'kind': 'sampling',
+        'interval_ms': interval * 1000,
+        'samples': sum(samples.values()),
+        'stacks': dict(samples.most_common()),
+    }
+
+
+_write_lock = threading.Lock()
+
+
+def save(record, config=None):
+    """
+    Записывает профиль атомарно (через временный файл) и удаляет самые
+    старые сверх MAX_PROFILES. Возвращает id профиля.
+    """
+    config = config or get_config()
+    directory = config['directory']
+    profile_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    record = {'id': profile_id, 'created_at': timezone.now().isoformat(), **record}
+
+    with _write_lock:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{profile_id}.json"
+        temporary = directory / f".{profile_id}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, default=str)
+        os.replace(temporary, path)
+
+        existing = sorted(directory.glob('*.json'))
+        for old in existing[:max(len(existing) - config['max_profiles'], 0)]:
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def profile_path(profile_id, config=None):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = (config or get_config())['directory'] / f"{profile_id}.json"
+    return path if path.exists() else None
+
+
+LIST_FIELDS = ('id', 'created_at', 'trigger', 'method', 'path', 'view', 'user', 'status', 'duration_ms', 'sql_count')
+
+
+def list_profiles(config=None):
+    config = config or get_config()
+    directory = config['directory']
+    if not directory.exists():
+        return []
+
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+            size = os.path.getsize(path)
+        except (OSError, ValueError):
+            # Файл мог быть вытеснен из буфера во время чтения.
+            continue
+        record['sql_count'] = len(record.get('sql', []))
+        item = {name: record.get(name) for name in LIST_FIELDS}
+        item['kind'] = record.get('profile', {}).get('kind')
+        item['size'] = size
+        profiles.append(item)
+    return profiles
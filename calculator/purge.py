@@ -0,0 +1,77 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_PURGE', {})
+    return {
+        'batch_size': config.get('BATCH_SIZE', 5000),
+        'background_threshold': config.get('BACKGROUND_THRESHOLD', 50000),
+    }
+
+
+def run(job_id):
+    """
+    Выполняет задание очистки истории: удаляет строки пачками и после
+    каждой пачки сохраняет прогресс в PurgeJob.
+    """
+    from .models import PurgeJob
+
+    job = PurgeJob.objects.get(pk=job_id)
+    PurgeJob.objects.filter(pk=job.pk).update(status=PurgeJob.RUNNING)
+
+    deleted = 0
+
+    def progress(done):
+        PurgeJob.objects.filter(pk=job.pk).update(deleted=deleted + done)
+
+    try:
+        for queryset in job.calculations():
+            deleted += queryset.delete_in_batches(
+                batch_size=get_config()['batch_size'], progress=progress
+            )
+    except Exception as e:
+        logger.exception('Очистка истории %s прервана', job.pk)
+        PurgeJob.objects.filter(pk=job.pk).update(
+            status=PurgeJob.FAILED, error=str(e), finished_at=timezone.now()
+        )
+        return
+
+    PurgeJob.objects.filter(pk=job.pk).update(
+        status=PurgeJob.DONE, deleted=deleted, finished_at=timezone.now()
+    )
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run(job_id)
+    finally:
+        connections.close_all()
+
+
+def start(job):
+    thread = threading.Thread(
+        target=_run_in_thread, args=(job.pk,), name=f'calculation-purge-{job.pk}', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def job_payload(job):
+    return {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'total': job.total,
+        'deleted': job.deleted,
+        'progress': round(job.deleted / job.total, 4) if job.total else 1.0,
+        'error': job.error,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,261 @@
+"""
+Чтение истории с реплик.
+
+У каждой базы истории (default и шардов) могут быть реплики:
+CALCULATOR_REPLICATION['REPLICAS'] = {'default': ['default_replica1'], ...}.
+Запросы только на чтение (GET/HEAD) читают списки, статистику и
+валидаторы условных GET с реплики. Чтение идёт с primary, если:
+
+- запрос изменяет данные (POST, PUT, PATCH, DELETE);
+- пользователь запроса недавно что-то записал — после записи он
+  закрепляется за primary на PIN_SECONDS, чтобы сразу видеть свои
+  изменения несмотря на отставание реплики;
+- код выполняется вне запроса (команды, фоновые потоки).
+
+Закрепления хранятся в кэше CACHE; при нескольких процессах это должен
+быть общий кэш (Redis, Memcached), иначе закрепление видно только в
+процессе, где была запись.
+
+Маршрутизация явная: чтения, которым подходит реплика, проходят через
+for_read()/read_alias(), поэтому запись через тот же queryset никогда
+не попадёт на реплику.
+
+Для локальной проверки SQLite-реплика — копия файла primary, которую
+ReplicaSync обновляет раз в SIMULATED_LAG_SECONDS через backup API;
+это и есть имитация отставания репликации. Поток запускают только
+точки входа сервера (wsgi.py, asgi.py), а не каждый процесс Django.
+"""
+import logging
+import random
+import sqlite3
+import threading
+from contextlib import closing
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_KEY = 'calculator-replica-pin:{}'
+
+_current = ContextVar('calculator_replica_request', default=None)
+
+
+def is_mirror(replica, primary):
+    """
+    replica — не отдельная копия, а второе подключение к базе primary
+    (тестовое зеркало TEST['MIRROR']). Читать с такой реплики незачем, а
+    внутри транзакции TestCase она не видит строк теста.
+    """
+    if replica == primary or replica not in connections.settings:
+        return False
+    return connections[replica].settings_dict['NAME'] == connections[primary].settings_dict['NAME']
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_REPLICATION', {})
+    replicas = {}
+    for primary, aliases in config.get('REPLICAS', {}).items():
+        aliases = [alias for alias in aliases if not is_mirror(alias, primary)]
+        if aliases:
+            replicas[primary] = aliases
+    return {
+        'replicas': replicas,
+        'pin_seconds': config.get('PIN_SECONDS', 5),
+        'cache': config.get('CACHE', 'default'),
+        'simulated_lag': config.get('SIMULATED_LAG_SECONDS'),
+    }
+
+
+def replica_aliases():
+    return {alias for aliases in get_config()['replicas'].values() for alias in aliases}
+
+
+def primary_for(alias):
+    """primary, копией которого является alias (или сам alias)."""
+    for primary, aliases in get_config()['replicas'].items():
+        if alias in aliases:
+            return primary
+    return alias
+
+
+def pin(user_ids, config=None):
+    """
+    Закрепляет пользователей за primary на PIN_SECONDS. Оставшиеся
+    чтения текущего запроса тоже идут в primary: запрос видит то, что
+    сам записал.
+    """
+    config = config or get_config()
+    if not config['replicas']:
+        return
+    use_primary()
+    if not config['pin_seconds']:
+        return
+    # 0 — общий счётчик stats.ALL_USERS, его не закрепляем.
+    keys = {PIN_KEY.format(int(user_id)): True for user_id in user_ids if int(user_id)}
+    if keys:
+        caches[config['cache']].set_many(keys, timeout=config['pin_seconds'])
+
+
+def is_pinned(user_id, config=None):
+    config = config or get_config()
+    return bool(caches[config['cache']].get(PIN_KEY.format(int(user_id))))
+
+
+class ReadState:
+    """
+    Разрешено ли текущему запросу читать с реплик. Решение принимается
+    при первом чтении, когда DRF уже аутентифицировал пользователя
+    (он же выставляет request.user исходному HttpRequest).
+    """
+
+    __slots__ = ('request', 'config', '_allowed')
+
+    def __init__(self, request, config):
+        self.request = request
+        self.config = config
+        self._allowed = None
+
+    @property
+    def allowed(self):
+        if self._allowed is None:
+            self._allowed = self.decide()
+        return self._allowed
+
+    def decide(self):
+        if self.request.method not in SAFE_METHODS:
+            return False
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return True
+        return not is_pinned(user.pk, self.config)
+
+    def force_primary(self):
+        self._allowed = False
+
+
+def start_request(request, config):
+    return _current.set(ReadState(request, config))
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def use_primary():
+    """Оставшиеся чтения текущего запроса идут в primary."""
+    state = _current.get()
+    if state is not None:
+        state.force_primary()
+
+
+def read_alias(alias):
+    """База для чтения, которое может идти с реплики alias."""
+    state = _current.get()
+    if state is None:
+        return alias
+    replicas = state.config['replicas'].get(alias)
+    if not replicas or not state.allowed:
+        return alias
+    return replicas[0] if len(replicas) == 1 else random.choice(replicas)
+
+
+def for_read(queryset):
+    from .sharding import ScatterQuerySet
+
+    if isinstance(queryset, ScatterQuerySet):
+        return queryset.map(for_read)
+    alias = read_alias(queryset.db)
+    return queryset if alias == queryset.db else queryset.using(alias)
+
+
+class ReplicaRouter:
+    """Реплики — копии primary: в них не мигрируют и не пишут."""
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def sync_replica(primary, replica):
+    """
+    Копирует SQLite-базу primary в replica через backup API. Читатели
+    реплики видят либо старую, либо новую копию целиком.
+    """
+    source = str(connections[primary].settings_dict['NAME'])
+    target = str(connections[replica].settings_dict['NAME'])
+    if source == target:
+        # Тестовое зеркало (TEST['MIRROR']) — это та же база.
+        return False
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+    return True
+
+
+def sync_all():
+    """Обновляет SQLite-реплики, возвращает число обновлённых."""
+    synced = 0
+    for primary, replicas in get_config()['replicas'].items():
+        if connections[primary].vendor != 'sqlite':
+            continue
+        for replica in replicas:
+            synced += sync_replica(primary, replica)
+    return synced
+
+
+class ReplicaSync:
+    """
+    Имитация асинхронной репликации для SQLite: фоновый поток сразу и
+    затем раз в interval секунд копирует primary в реплики.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='calculator-replica-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                sync_all()
+            except Exception:
+                logger.exception('Не удалось обновить реплики')
+            if self._stop.wait(self.interval):
+                return
+
+
+_sync = None
+_sync_lock = threading.Lock()
+
+
+def start_simulation():
+    global _sync
+
+    config = get_config()
+    interval = config['simulated_lag']
+    if not interval or not config['replicas']:
+        return None
+
+    with _sync_lock:
+        if _sync is None:
+            _sync = ReplicaSync(interval)
+            _sync.start()
+    return _sync
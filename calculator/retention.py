@@ -0,0 +1,212 @@
+import logging
+import operator
+import threading
+from datetime import timedelta
+from functools import reduce
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding, stats
+
+logger = logging.getLogger(__name__)
+
+
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'num1', 'num2', 'operation', 'result', 'expression',
+    'mode', 'num1_exact', 'num2_exact', 'result_exact', 'created_at',
+)
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_RETENTION', {})
+    return {
+        'default': config.get('DEFAULT', {}),
+        'users': config.get('USERS', {}),
+        'batch_size': config.get('BATCH_SIZE', 5000),
+        'compact': config.get('COMPACT', True),
+        'interval': config.get('SCHEDULE_INTERVAL'),
+    }
+
+
+def get_policies(config):
+    """
+    Возвращает (default_policy, {user_id: policy}). Политика — словарь
+    с MAX_AGE_DAYS и/или MAX_ROWS; политика пользователя из USERS
+    (ключ — имя пользователя) целиком заменяет общую. Пользователи
+    читаются из default при любом шарде истории.
+    """
+    usernames = config['users']
+    user_ids = dict(
+        User.objects.using(sharding.USERS_DATABASE).filter(username__in=usernames).values_list('username', 'id')
+    )
+    return config['default'], {
+        user_ids[username]: policy
+        for username, policy in usernames.items()
+        if username in user_ids
+    }
+
+
+def _newest_rows_cutoff(queryset, max_rows):
+    boundary = queryset.order_by('-created_at', '-id').values('created_at', 'id')[max_rows:max_rows + 1]
+    boundary = list(boundary)
+    if not boundary:
+        return None
+    created_at, pk = boundary[0]['created_at'], boundary[0]['id']
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=pk)
+
+
+def expired_querysets(default_policy, user_policies, using='default', now=None):
+    """
+    Строит querysets строк, вышедших за пределы политик. Все условия —
+    диапазоны по (user, created_at), кандидаты на превышение MAX_ROWS
+    берутся из счётчиков CalculationRollup без подсчёта строк.
+    """
+    from .models import Calculation, CalculationRollup
+
+    now = now or timezone.now()
+    calculations = Calculation.objects.using(using)
+    querysets = []
+
+    max_age = default_policy.get('MAX_AGE_DAYS')
+    if max_age is not None:
+        querysets.append(
+            calculations.exclude(user_id__in=list(user_policies))
+            .filter(created_at__lt=now - timedelta(days=max_age))
+        )
+
+    for user_id, policy in user_policies.items():
+        if policy.get('MAX_AGE_DAYS') is not None:
+            querysets.append(calculations.filter(
+                user_id=user_id, created_at__lt=now - timedelta(days=policy['MAX_AGE_DAYS'])
+            ))
+
+    row_limits = {
+        user_id: policy['MAX_ROWS']
+        for user_id, policy in user_policies.items()
+        if policy.get('MAX_ROWS') is not None
+    }
+    if default_policy.get('MAX_ROWS') is not None:
+        oversized = (
+            CalculationRollup.objects.using(using)
+            .filter(operation=stats.ALL_OPERATIONS, day__isnull=True, count__gt=default_policy['MAX_ROWS'])
+            .exclude(user_id=stats.ALL_USERS)
+            .exclude(user_id__in=list(user_policies))
+            .values_list('user_id', flat=True)
+        )
+        row_limits.update({user_id: default_policy['MAX_ROWS'] for user_id in oversized})
+
+    for user_id, max_rows in row_limits.items():
+        user_calculations = calculations.filter(user_id=user_id)
+        cutoff = _newest_rows_cutoff(user_calculations, max_rows)
+        if cutoff is not None:
+            querysets.append(user_calculations.filter(cutoff))
+
+    return querysets
+
+
+def archive(queryset, batch_size=5000):
+    """
+    Переносит строки queryset в ArchivedCalculation: каждая пачка
+    копируется и удаляется из истории в одной транзакции.
+    """
+    from .models import ArchivedCalculation
+
+    def copy_to_archive(chunk):
+        ArchivedCalculation.objects.using(chunk.db).bulk_create(
+            [ArchivedCalculation(**row) for row in chunk.values(*ARCHIVE_FIELDS)],
+            ignore_conflicts=True
+        )
+
+    return queryset.delete_in_batches(batch_size=batch_size, before_delete=copy_to_archive)
+
+
+def compact(using='default'):
+    """
+    Освобождает место и обновляет статистику планировщика после
+    архивации. VACUUM есть только у SQLite, на других СУБД выполняется
+    только ANALYZE.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('ANALYZE')
+            cursor.execute('VACUUM')
+        else:
+            cursor.execute('ANALYZE')
+
+
+def apply_retention(using='default', dry_run=False, compact_database=None, now=None):
+    config = get_config()
+    default_policy, user_policies = get_policies(config)
+    querysets = expired_querysets(default_policy, user_policies, using=using, now=now)
+
+    if dry_run:
+        return reduce(operator.or_, querysets).count() if querysets else 0
+
+    archived = sum(archive(queryset, batch_size=config['batch_size']) for queryset in querysets)
+    if compact_database is None:
+        compact_database = config['compact']
+    if archived and compact_database:
+        compact(using)
+    return archived
+
+
+class RetentionScheduler:
+    """
+    Периодически применяет политики хранения в фоновом потоке процесса
+    ко всем шардам истории (или только к using, если он задан).
+    """
+
+    def __init__(self, interval, using=None):
+        self.interval = interval
+        self.using = using
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='calculation-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            close_old_connections()
+            for using in [self.using] if self.using else sharding.databases():
+                try:
+                    archived = apply_retention(using=using)
+                except Exception:
+                    logger.exception('Не удалось применить политики хранения истории в %s', using)
+                else:
+                    if archived:
+                        logger.info('В архив перенесено %d вычислений из %s', archived, using)
+        connections.close_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    global _scheduler
+
+    interval = get_config()['interval']
+    if not interval:
+        return None
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RetentionScheduler(interval)
+            _scheduler.start()
+    return _scheduler
@@ -0,0 +1,146 @@
+import re
+
+from django.db import OperationalError, connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+
+FTS_TABLE = 'calculator_calculation_fts'
+FTS_COLUMNS = {
+    'expression': 'expression',
+    'operation': 'operation',
+    'user__username': 'username',
+}
+# Индекс и триггеры создаются миграциями 0004, 0007 и 0009 через функции
+# ниже, а с 0011 — SQL, встроенным в сами миграции. Применённые миграции
+# не переписываются, поэтому эти функции менять нельзя: новое определение
+# индекса оформляется новой миграцией.
+FTS_TRIGGERS = tuple(f'{FTS_TABLE}_{suffix}' for suffix in ('insert', 'delete', 'update', 'username'))
+WORD_RE = re.compile(r'\w+')
+
+_available = {}
+
+
+def _statements(calculation_table, user_table):
+    row = (
+        f"SELECT c.id, c.expression, c.operation, u.username "
+        f"FROM {calculation_table} c JOIN {user_table} u ON u.id = c.user_id"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"expression, operation, username, "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+        f"INSERT INTO {FTS_TABLE}(rowid, expression, operation, username) {row}",
+        f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {calculation_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, expression, operation, username) "
+        f"VALUES (new.id, new.expression, new.operation, "
+        f"(SELECT username FROM {user_table} WHERE id = new.user_id)); END",
+        f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {calculation_table} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+        f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF expression, operation, user_id "
+        f"ON {calculation_table} BEGIN "
+        f"UPDATE {FTS_TABLE} SET expression = new.expression, operation = new.operation, "
+        f"username = (SELECT username FROM {user_table} WHERE id = new.user_id) "
+        f"WHERE rowid = new.id; END",
+        f"CREATE TRIGGER {FTS_TABLE}_username AFTER UPDATE OF username ON {user_table} BEGIN "
+        f"UPDATE {FTS_TABLE} SET username = new.username WHERE rowid IN "
+        f"(SELECT id FROM {calculation_table} WHERE user_id = new.id); END",
+    ]
+
+
+def create_index(schema_editor, calculation_table, user_table):
+    """
+    Создаёт FTS5-индекс истории и триггеры, которые поддерживают его при
+    любой вставке, удалении и изменении строк, включая bulk_create и
+    каскадное удаление. На других СУБД и без FTS5 ничего не делает.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"CREATE VIRTUAL TABLE temp.{FTS_TABLE}_probe USING fts5(probe)")
+            cursor.execute(f"DROP TABLE temp.{FTS_TABLE}_probe")
+        except OperationalError:
+            return
+    for statement in _statements(calculation_table, user_table):
+        schema_editor.execute(statement)
+    _available.pop(connection.alias, None)
+
+
+def drop_index(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    for suffix in ('insert', 'delete', 'update', 'username'):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _available.pop(connection.alias, None)
+
+
+def create_index_operation(apps, schema_editor):
+    """
+    RunPython-обёртки для миграций. SQLite пересоздаёт таблицу при
+    изменении её полей и теряет триггеры, поэтому миграции, меняющие
+    Calculation, снимают индекс до изменений и строят заново после.
+    """
+    Calculation = apps.get_model('calculator', 'Calculation')
+    create_index(
+        schema_editor,
+        Calculation._meta.db_table,
+        Calculation._meta.get_field('user').related_model._meta.db_table
+    )
+
+
+def drop_index_operation(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+def fts_available(alias):
+    if alias not in _available:
+        connection = connections[alias]
+        _available[alias] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _available[alias]
+
+
+def build_match(search_terms, columns):
+    """
+    Переводит поисковые слова в запрос FTS5: каждое слово становится
+    фразой из его токенов с префиксным поиском по последнему токену,
+    слова объединяются через AND. Возвращает None, если в запросе нет
+    ни одного токена (например, поиск по «+»).
+    """
+    phrases = []
+    for term in search_terms:
+        tokens = WORD_RE.findall(term)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '" *')
+    if not phrases:
+        return None
+    return '{%s} : (%s)' % (' '.join(columns), ' AND '.join(phrases))
+
+
+class CalculationSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter для истории вычислений. На SQLite с FTS5 поиск идёт по
+    индексу calculator_calculation_fts без LIKE-сканирования и JOIN с
+    пользователями; на остальных СУБД работает стандартный icontains.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        columns = [FTS_COLUMNS.get(field) for field in search_fields]
+        match = build_match(search_terms, columns) if all(columns) else None
+        if match is None or not fts_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+        ))
@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import F
 from .models import Calculation
-from rest_framework_simplejwt.tokens import RefreshToken
+from . import numeric, replication, sharding
+from .authentication import CalculatorRefreshToken
+from .engine import CalculationError, evaluate
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,7 +30,7 @@ class UserSerializerWithToken(UserSerializer):
         fields = UserSerializer.Meta.fields + ['token']
     
     def get_token(self, obj):
-        refresh = RefreshToken.for_user(obj)
+        refresh = CalculatorRefreshToken.for_user(obj)
         return {
             'refresh': str(refresh),
             'access': str(refresh.access_token),
@@ -40,14 +44,27 @@ class CalculationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Calculation
         fields = ['id', 'user', 'username', 'num1', 'num2', 'operation', 
-                  'operation_display', 'result', 'expression', 'created_at']
-        read_only_fields = ['user', 'result', 'expression', 'created_at']
+                  'operation_display', 'result', 'expression', 'mode',
+                  'num1_exact', 'num2_exact', 'result_exact', 'created_at']
+        read_only_fields = ['user', 'result', 'expression', 'mode',
+                            'num1_exact', 'num2_exact', 'result_exact', 'created_at']
     
     def validate(self, data):
-        operation = data.get('operation')
-        num2 = data.get('num2')
+        # При частичном обновлении недостающие поля берутся из записи.
+        current = {
+            name: getattr(self.instance, name)
+            for name in ('operation', 'num1', 'num2') if self.instance is not None
+        }
+        operation = data.get('operation', current.get('operation'))
+        num2 = data.get('num2', current.get('num2'))
+        num1 = data.get('num1', current.get('num1'))
+        
+        if self.instance is not None and 'expression' in (operation, self.instance.operation):
+            if any(data.get(name, current[name]) != current[name] for name in current):
+                raise serializers.ValidationError(
+                    {"operation": "Вычисление выражения нельзя изменить"})
         
-        if operation != 'sqrt' and num2 is None:
+        if operation not in ('sqrt', 'expression') and num2 is None:
             raise serializers.ValidationError(
                 {"num2": "Это поле обязательно для данной операции"})
         
@@ -55,8 +72,197 @@ class CalculationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {"num2": "Деление на ноль невозможно"})
         
-        if operation == 'sqrt' and data.get('num1', 0) < 0:
+        if operation == 'sqrt' and (num1 or 0) < 0:
             raise serializers.ValidationError(
                 {"num1": "Квадратный корень из отрицательного числа невозможен"})
         
-        return data
\ No newline at end of file
+        return data
+    
+    def update(self, instance, validated_data):
+        changed = {
+            name: value for name, value in validated_data.items()
+            if name in ('operation', 'num1', 'num2') and getattr(instance, name) != value
+        }
+        if changed and instance.operation != 'expression':
+            validated_data.update(self.recalculate(instance, changed))
+        return super().update(instance, validated_data)
+    
+    def recalculate(self, instance, changed):
+        """Пересчитывает результат после смены операции или операндов."""
+        operation = changed.get('operation', instance.operation)
+        num1 = changed.get('num1', instance.num1)
+        num2 = None if operation == 'sqrt' else changed.get('num2', instance.num2)
+        try:
+            if instance.mode == numeric.FLOAT:
+                return {'num2': num2, 'result': evaluate(operation, num1, num2)}
+            # Точные операнды сохраняются, пока их не заменили.
+            return numeric.calculate(
+                operation,
+                changed['num1'] if 'num1' in changed else instance.num1_exact,
+                changed['num2'] if 'num2' in changed else (instance.num2_exact or num2),
+                instance.mode
+            )
+        except CalculationError as e:
+            raise serializers.ValidationError({e.field or 'non_field_errors': e.message})
+
+_created_at_field = serializers.DateTimeField()
+
+
+def calculation_payload(calculation, user=None):
+    """
+    То же представление, что и CalculationSerializer(calculation).data,
+    но без построения сериализатора на каждый запрос калькулятора.
+    Если автор уже известен (request.user), он передаётся явно, чтобы
+    не загружать его из БД.
+    """
+    if user is None:
+        user = calculation.user
+    return {
+        'id': calculation.id,
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'is_staff': user.is_staff,
+        },
+        'username': user.username,
+        'num1': calculation.num1,
+        'num2': calculation.num2,
+        'operation': calculation.operation,
+        'operation_display': calculation.get_operation_display(),
+        'result': calculation.result,
+        'expression': calculation.expression,
+        'mode': calculation.mode,
+        'num1_exact': calculation.num1_exact,
+        'num2_exact': calculation.num2_exact,
+        'result_exact': calculation.result_exact,
+        'created_at': _created_at_field.to_representation(calculation.created_at),
+    }
+
+
+def attach_usernames(rows):
+    """
+    Дополняет строки из шардов именами пользователей: пользователи
+    хранятся только в default, поэтому project() не делает JOIN с ними
+    в других шардах, а имена подгружаются одним запросом на пачку.
+    """
+    rows = list(rows)
+    missing = {row['user_id'] for row in rows if 'username' not in row}
+    if missing:
+        usernames = dict(User.objects.filter(pk__in=missing).values_list('id', 'username'))
+        for row in rows:
+            if 'username' not in row:
+                row['username'] = usernames.get(row['user_id'])
+    return rows
+
+
+class CalculationRowListSerializer(serializers.ListSerializer):
+    """
+    Списки истории без пофилдового обхода DRF: для каждого поля один
+    раз выбирается колонка строки и преобразование, затем строки
+    собираются в словари напрямую. Значения из values() уже имеют
+    нужные типы, поэтому преобразуется только created_at.
+    """
+    
+    def get_plan(self):
+        child = self.child
+        plan = []
+        for name, field in child.fields.items():
+            if name == 'operation_display':
+                plan.append((name, 'operation', child.OPERATION_DISPLAY))
+            elif isinstance(field, serializers.DateTimeField):
+                plan.append((name, child.COLUMNS[name], field.to_representation))
+            else:
+                plan.append((name, child.COLUMNS[name], None))
+        return plan
+    
+    def to_representation(self, data):
+        rows = data.all() if isinstance(data, models.manager.BaseManager) else data
+        plan = self.get_plan()
+        if any(name == 'username' for name, _, _ in plan):
+            rows = attach_usernames(rows)
+        result = []
+        append = result.append
+        for row in rows:
+            item = {}
+            for name, column, convert in plan:
+                value = row[column]
+                if value is None or convert is None:
+                    item[name] = value
+                elif isinstance(convert, dict):
+                    item[name] = convert.get(value, value)
+                else:
+                    item[name] = convert(value)
+            append(item)
+        return result
+
+
+class CalculationListSerializer(serializers.Serializer):
+    """
+    Плоское представление для списков истории. Работает со строками
+    Calculation.objects.values(...) и не требует загрузки пользователя.
+    """
+    COLUMNS = {
+        'id': 'id',
+        'user': 'user_id',
+        'username': 'username',
+        'num1': 'num1',
+        'num2': 'num2',
+        'operation': 'operation',
+        'operation_display': 'operation',
+        'result': 'result',
+        'expression': 'expression',
+        'created_at': 'created_at',
+        'mode': 'mode',
+        'result_exact': 'result_exact',
+    }
+    OPERATION_DISPLAY = dict(Calculation.OPERATION_CHOICES)
+    
+    id = serializers.IntegerField(read_only=True)
+    user = serializers.IntegerField(source='user_id', read_only=True)
+    username = serializers.CharField(read_only=True)
+    num1 = serializers.FloatField(read_only=True)
+    num2 = serializers.FloatField(read_only=True, allow_null=True)
+    operation = serializers.CharField(read_only=True)
+    operation_display = serializers.SerializerMethodField()
+    result = serializers.FloatField(read_only=True)
+    expression = serializers.CharField(read_only=True)
+    created_at = serializers.DateTimeField(read_only=True)
+    mode = serializers.CharField(read_only=True)
+    result_exact = serializers.CharField(read_only=True)
+    
+    class Meta:
+        list_serializer_class = CalculationRowListSerializer
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+    
+    @classmethod
+    def parse_fields(cls, value):
+        if not value:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip() in cls.COLUMNS]
+        return fields or None
+    
+    @classmethod
+    def project(cls, queryset, fields=None, extra_columns=()):
+        if isinstance(queryset, sharding.ScatterQuerySet):
+            return queryset.map(lambda shard: cls.project(shard, fields, extra_columns))
+        columns = {cls.COLUMNS[name] for name in (fields or cls.COLUMNS)}
+        columns.update(extra_columns)
+        expressions = {}
+        if 'username' in columns:
+            columns.discard('username')
+            # Реплика default — полная копия, пользователи в ней тоже есть.
+            if replication.primary_for(queryset.db) == sharding.USERS_DATABASE:
+                expressions['username'] = F('user__username')
+            else:
+                # Имя дополняется из default, см. attach_usernames.
+                columns.add('user_id')
+        return queryset.values(*sorted(columns), **expressions)
+    
+    def get_operation_display(self, obj):
+        return self.OPERATION_DISPLAY.get(obj['operation'], obj['operation'])
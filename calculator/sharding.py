@@ -0,0 +1,376 @@
+"""
+Шардирование истории вычислений по пользователям.
+
+История пользователя (Calculation, ArchivedCalculation и их агрегаты
+CalculationRollup, HistoryVersion) целиком живёт в одной из баз
+CALCULATOR_SHARDING['DATABASES']: по умолчанию в databases[user_id % N],
+либо в базе, явно назначенной командой rebalance_shards (таблица
+ShardAssignment в default). Пользователи, сессии, задания очистки и
+остальные модели остаются в default.
+
+Каждый шард получает свой диапазон id вычислений шириной ID_BLOCK
+(шард с индексом k выдаёт id начиная с k * ID_BLOCK), поэтому id
+уникальны между шардами и по id можно найти шард записи.
+
+Запись и чтение одного пользователя идут в его шард; выборки по всем
+пользователям (админ-список, общая статистика) опрашивают все шарды и
+сливают упорядоченные результаты (ScatterQuerySet).
+
+Назначения кэшируются в процессе на ASSIGNMENT_TTL секунд, поэтому
+после переноса другие процессы пишут в новый шард не сразу; команда
+rebalance_shards учитывает это и досылает строки, записанные за это
+время в старый шард.
+"""
+import heapq
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+USERS_DATABASE = DEFAULT_DB_ALIAS
+SHARDED_MODELS = ('calculation', 'archivedcalculation', 'calculationrollup', 'historyversion')
+
+
+def get_config():
+    config = getattr(settings, 'CALCULATOR_SHARDING', {})
+    return {
+        'databases': list(config.get('DATABASES', [DEFAULT_DB_ALIAS])),
+        'id_block': config.get('ID_BLOCK', 2 ** 40),
+        'assignment_ttl': config.get('ASSIGNMENT_TTL', 5),
+    }
+
+
+def databases():
+    return get_config()['databases']
+
+
+def enabled():
+    return len(databases()) > 1
+
+
+class AssignmentCache:
+    """Назначения пользователей шардам из ShardAssignment с TTL."""
+
+    def __init__(self):
+        self._assignments = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, ttl):
+        assignments = self._assignments
+        if assignments is None or time.monotonic() - self._loaded_at >= ttl:
+            assignments = self.load()
+        return assignments.get(user_id)
+
+    def load(self):
+        from .models import ShardAssignment
+
+        assignments = dict(
+            ShardAssignment.objects.using(USERS_DATABASE).values_list('user_id', 'database')
+        )
+        with self._lock:
+            self._assignments = assignments
+            self._loaded_at = time.monotonic()
+        return assignments
+
+    def clear(self):
+        with self._lock:
+            self._assignments = None
+
+
+assignments = AssignmentCache()
+
+
+def home_database(user_id, aliases=None):
+    """Шард пользователя по умолчанию, без учёта назначений."""
+    aliases = aliases or databases()
+    return aliases[int(user_id) % len(aliases)]
+
+
+def database_for_user(user_id):
+    config = get_config()
+    aliases = config['databases']
+    if len(aliases) == 1:
+        return aliases[0]
+    # id может прийти строкой из параметров запроса.
+    user_id = int(user_id)
+    assigned = assignments.get(user_id, config['assignment_ttl'])
+    if assigned in aliases:
+        return assigned
+    return home_database(user_id, aliases)
+
+
+async def adatabase_for_user(user_id):
+    if not enabled():
+        return databases()[0]
+    return await sync_to_async(database_for_user)(user_id)
+
+
+def databases_for_id(pk):
+    """
+    Шарды, где может лежать вычисление с данным id: сначала шард его
+    диапазона, затем остальные (на случай строк, записанных до
+    резервирования диапазонов).
+    """
+    config = get_config()
+    aliases = config['databases']
+    index = int(pk) // config['id_block']
+    if 0 <= index < len(aliases):
+        return [aliases[index], *(alias for alias in aliases if alias != aliases[index])]
+    return aliases
+
+
+def for_user(queryset, user_id):
+    return queryset.using(database_for_user(user_id)).filter(user_id=user_id)
+
+
+def scatter(queryset):
+    """
+    queryset по всем шардам. Без шардирования возвращается как есть,
+    иначе — ScatterQuerySet из копий queryset для каждого шарда.
+    """
+    aliases = databases()
+    if len(aliases) == 1:
+        return queryset.using(aliases[0])
+    return ScatterQuerySet([queryset.using(alias) for alias in aliases])
+
+
+def reserve_id_range(using):
+    """
+    Сдвигает счётчик id вычислений шарда к началу его диапазона.
+    Вызывается после migrate и flush; поддерживаются SQLite и PostgreSQL.
+    """
+    from .models import Calculation
+
+    aliases = databases()
+    if using not in aliases:
+        return
+    start = aliases.index(using) * get_config()['id_block']
+    if not start:
+        return
+
+    connection = connections[using]
+    table = Calculation._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+            elif row[0] < start:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))",
+                [table, start]
+            )
+
+
+def reserve_id_ranges(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'calculator':
+        reserve_id_range(using)
+
+
+class ShardRouter:
+    """
+    Маршрутизирует модели истории в шард пользователя по подсказке
+    instance; без подсказки выбирается default, поэтому запросы по
+    конкретному пользователю явно указывают шард через for_user().
+    Остальные модели всегда в default. Схема мигрируется во все базы.
+    """
+
+    def _route(self, model, **hints):
+        if model._meta.app_label != 'calculator' or model._meta.model_name not in SHARDED_MODELS:
+            return USERS_DATABASE
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if isinstance(instance, model) and instance._state.db is not None:
+            return instance._state.db
+        if model._meta.model_name not in ('calculation', 'archivedcalculation'):
+            return None
+        # Экземпляр вычисления или пользователь (user.calculations).
+        user_id = instance.pk if instance._meta.label_lower == 'auth.user' else getattr(instance, 'user_id', None)
+        return database_for_user(user_id) if user_id is not None else None
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def _sort_value(row, field):
+    if isinstance(row, dict):
+        return row[ScatterQuerySet.COLUMN_ALIASES.get(field, field)]
+    for part in field.split('__'):
+        row = getattr(row, part)
+    return row
+
+
+class _SortKey:
+    """Ключ сортировки строки по полям ordering с учётом направления и NULL."""
+
+    __slots__ = ('values', 'directions')
+
+    def __init__(self, row, ordering):
+        self.values = [_sort_value(row, field.lstrip('-')) for field in ordering]
+        self.directions = [field.startswith('-') for field in ordering]
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values, other.values, self.directions):
+            if value == other_value:
+                continue
+            # NULL меньше любого значения, как в SQLite и при NULLS FIRST.
+            if value is None:
+                less = True
+            elif other_value is None:
+                less = False
+            else:
+                less = value < other_value
+            return less != descending
+        return False
+
+
+class ScatterQuerySet:
+    """
+    Чтение из нескольких шардов с общим порядком. Поддерживает то, что
+    нужно фильтрам, курсорной пагинации и выгрузке: filter, exclude,
+    order_by, values, срезы, count и iterator. Срез [a:b] запрашивает
+    первые b строк каждого шарда и сливает их; поэтому глубокие OFFSET
+    дороги, но курсорная пагинация использует только небольшие.
+    """
+    COLUMN_ALIASES = {'user__username': 'username'}
+
+    def __init__(self, querysets):
+        self.querysets = list(querysets)
+        self.model = self.querysets[0].model
+
+    def map(self, function):
+        return ScatterQuerySet([function(queryset) for queryset in self.querysets])
+
+    def _delegate(self, method, *args, **kwargs):
+        return self.map(lambda queryset: getattr(queryset, method)(*args, **kwargs))
+
+    def filter(self, *args, **kwargs):
+        return self._delegate('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._delegate('exclude', *args, **kwargs)
+
+    def order_by(self, *fields):
+        return self._delegate('order_by', *fields)
+
+    def values(self, *fields, **expressions):
+        return self._delegate('values', *fields, **expressions)
+
+    def all(self):
+        return self._delegate('all')
+
+    def distinct(self, *fields):
+        return self._delegate('distinct', *fields)
+
+    @property
+    def ordering(self):
+        query = self.querysets[0].query
+        ordering = list(query.order_by) or list(self.model._meta.ordering)
+        return [field for field in ordering if isinstance(field, str)]
+
+    @property
+    def db(self):
+        return self.querysets[0].db
+
+    def _merge(self, iterables):
+        ordering = self.ordering
+        if not ordering:
+            return (row for iterable in iterables for row in iterable)
+        return heapq.merge(*iterables, key=lambda row: _SortKey(row, ordering))
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        if key.stop is None or key.step is not None:
+            raise ValueError('ScatterQuerySet поддерживает только срезы с концом и без шага')
+        start = key.start or 0
+        merged = self._merge([list(queryset[:key.stop]) for queryset in self.querysets])
+        return list(merged)[start:key.stop]
+
+    def __iter__(self):
+        return iter(self.iterator())
+
+    def iterator(self, chunk_size=None):
+        return self._merge([queryset.iterator(chunk_size=chunk_size) for queryset in self.querysets])
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets)
+
+
+def move_user(user_id, target, batch_size=1000, wait=None, progress=None):
+    """
+    Переносит историю пользователя в шард target: копирует вычисления
+    и архив пачками (новые id из диапазона target, created_at
+    сохраняется), назначает target в ShardAssignment, ждёт ASSIGNMENT_TTL,
+    чтобы все процессы увидели назначение, досылает записанное за это
+    время и удаляет строки в исходном шарде. Агрегаты и события
+    обновляются обычными путями bulk_create/delete. Возвращает число
+    перенесённых вычислений.
+    """
+    from .models import ArchivedCalculation, Calculation, ShardAssignment
+
+    user_id = int(user_id)
+    source = database_for_user(user_id)
+    if source == target:
+        return 0
+    if wait is None:
+        wait = get_config()['assignment_ttl']
+
+    fields = [
+        field.attname for field in Calculation._meta.concrete_fields
+        if not field.primary_key
+    ]
+    moved = 0
+    last_id = 0
+
+    def copy_new():
+        nonlocal moved, last_id
+        while True:
+            rows = list(
+                Calculation.objects.using(source)
+                .filter(user_id=user_id, id__gt=last_id)
+                .order_by('id')
+                .values('id', *fields)[:batch_size]
+            )
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            Calculation.objects.using(target).bulk_create([
+                Calculation(**{name: row[name] for name in fields}) for row in rows
+            ])
+            moved += len(rows)
+            if progress is not None:
+                progress(moved)
+
+    copy_new()
+    archived = ArchivedCalculation.objects.using(source).filter(user_id=user_id)
+    ArchivedCalculation.objects.using(target).bulk_create(
+        list(archived), batch_size=batch_size, ignore_conflicts=True
+    )
+
+    ShardAssignment.objects.using(USERS_DATABASE).update_or_create(
+        user_id=user_id, defaults={'database': target}
+    )
+    assignments.clear()
+    if wait:
+        time.sleep(wait)
+    copy_new()
+
+    Calculation.objects.using(source).filter(user_id=user_id).delete_in_batches(batch_size=batch_size)
+    archived.delete()
+    return moved
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import events, sharding, stats
+
+
+@receiver(pre_delete, sender=User)
+def forget_user_statistics(sender, instance, using, **kwargs):
+    from .models import ArchivedCalculation, Calculation, ShardAssignment
+
+    calculations = Calculation.objects.using(using).filter(user_id=instance.pk)
+    stats.record_deleted(calculations)
+    events.calculations_deleted(events.deleted_rows(calculations), using=using)
+
+    # Каскад Django удаляет строки только в базе пользователя; история
+    # в другом шарде удаляется явно.
+    shard = sharding.database_for_user(instance.pk)
+    if shard != using:
+        Calculation.objects.using(shard).filter(user_id=instance.pk).delete_in_batches()
+        ArchivedCalculation.objects.using(shard).filter(user_id=instance.pk).delete()
+    ShardAssignment.objects.using(using).filter(user_id=instance.pk).delete()
@@ -0,0 +1,338 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import replication, sharding
+
+
+ALL_USERS = 0
+ALL_OPERATIONS = ''
+
+# СУБД с INSERT ... ON CONFLICT DO UPDATE: срезы одной записи
+# применяются одним запросом.
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+UPSERT_BATCH_SIZE = 500
+
+
+def rollup_key(user_id, operation, day):
+    return f"{user_id}:{operation}:{day.isoformat() if day else ''}"
+
+
+def expand_grains(rows):
+    """
+    Раскладывает строки (user_id, operation, day, count) по срезам
+    агрегатов пользователя: операция, день и итог. Общие итоги
+    (ALL_USERS) не хранятся — их складывает из срезов пользователей
+    чтение статистики, поэтому записи разных пользователей не
+    сериализуются на общих строках.
+    """
+    deltas = Counter()
+    for user_id, operation, day, count in rows:
+        for grain in (
+            (user_id, operation, None),
+            (user_id, ALL_OPERATIONS, day),
+            (user_id, ALL_OPERATIONS, None),
+        ):
+            deltas[grain] += count
+    return deltas
+
+
+def _upsert(using, model, columns, rows, conflict, increment, replace=()):
+    """
+    Вставляет строки rows пачками по одному INSERT ... ON CONFLICT DO
+    UPDATE: у существующих строк к колонке increment прибавляется
+    вставляемое значение, колонки replace перезаписываются.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    updates = ', '.join([
+        f'{quote(increment)} = {table}.{quote(increment)} + excluded.{quote(increment)}',
+        *(f'{quote(column)} = excluded.{quote(column)}' for column in replace),
+    ])
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(map(quote, columns))}) "
+                f"VALUES {', '.join([row_sql] * len(batch))} "
+                f"ON CONFLICT ({quote(conflict)}) DO UPDATE SET {updates}",
+                [value for row in batch for value in row]
+            )
+
+
+def apply_deltas(deltas, sign=1, using='default', touched=()):
+    """
+    Прибавляет deltas к агрегатам и увеличивает счётчики изменений
+    затронутых пользователей; touched — пользователи, чья история
+    изменилась без сдвига агрегатов.
+    """
+    from .models import CalculationRollup
+
+    deltas = {grain: sign * count for grain, count in deltas.items() if count}
+    connection = connections[using]
+    if connection.vendor in UPSERT_VENDORS:
+        if deltas:
+            _upsert(using, CalculationRollup, ('key', 'user_id', 'operation', 'day', 'count'), [
+                (rollup_key(user_id, operation, day), user_id, operation,
+                 connection.ops.adapt_datefield_value(day), delta)
+                for (user_id, operation, day), delta in deltas.items()
+            ], conflict='key', increment='count')
+    else:
+        rollups = CalculationRollup.objects.using(using)
+        for (user_id, operation, day), delta in deltas.items():
+            key = rollup_key(user_id, operation, day)
+            if rollups.filter(key=key).update(count=F('count') + delta):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    rollups.create(key=key, user_id=user_id, operation=operation, day=day, count=delta)
+            except IntegrityError:
+                rollups.filter(key=key).update(count=F('count') + delta)
+
+    bump_versions({user_id for user_id, _, _ in deltas} | set(touched), using=using)
+
+
+def bump_versions(user_ids, using='default'):
+    """
+    Увеличивает счётчики изменений истории пользователей. Вызывается при
+    каждом изменении агрегатов, поэтому здесь же пользователи
+    закрепляются за primary (см. calculator.replication). Общий счётчик
+    не хранится: get_version складывает счётчики пользователей.
+    """
+    from .models import HistoryVersion
+
+    # id может прийти строкой из параметров запроса.
+    user_ids = {int(user_id) for user_id in user_ids} - {ALL_USERS}
+    if not user_ids:
+        return
+    replication.pin(user_ids)
+    connection = connections[using]
+    now = timezone.now()
+    if connection.vendor in UPSERT_VENDORS:
+        _upsert(using, HistoryVersion, ('user_id', 'version', 'updated_at'), [
+            (user_id, 1, connection.ops.adapt_datetimefield_value(now)) for user_id in sorted(user_ids)
+        ], conflict='user_id', increment='version', replace=('updated_at',))
+        return
+    versions = HistoryVersion.objects.using(using)
+    for user_id in sorted(user_ids):
+        if versions.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                versions.create(user_id=user_id, version=1, updated_at=now)
+        except IntegrityError:
+            versions.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now)
+
+
+def get_version(user_id=ALL_USERS, using=None):
+    """
+    Возвращает (version, updated_at); для истории без изменений — (0, None).
+    Счётчик пользователя читается из его шарда. Общий счётчик (ALL_USERS)
+    — сумма счётчиков всех пользователей во всех шардах (строки
+    счётчиков не удаляются и только растут, значит, растёт и сумма) с
+    последним временем изменения. В запросах на чтение счётчики читаются
+    с реплик, как и сама история.
+    """
+    from .models import HistoryVersion
+
+    if using is not None:
+        aliases = [using]
+    elif user_id != ALL_USERS:
+        aliases = [sharding.database_for_user(user_id)]
+    else:
+        aliases = sharding.databases()
+
+    version, updated_at = 0, None
+    for alias in aliases:
+        versions = HistoryVersion.objects.using(replication.read_alias(alias))
+        if user_id == ALL_USERS:
+            totals = versions.exclude(user_id=ALL_USERS).aggregate(
+                version=Sum('version'), updated_at=Max('updated_at')
+            )
+            row = (totals['version'], totals['updated_at']) if totals['version'] is not None else None
+        else:
+            row = versions.filter(user_id=user_id).values_list('version', 'updated_at').first()
+        if row is not None:
+            version += row[0]
+            updated_at = row[1] if updated_at is None else max(updated_at, row[1])
+    return version, updated_at
+
+
+def record_created(calculations, using='default'):
+    rows = Counter(
+        (calc.user_id, calc.operation, timezone.localdate(calc.created_at))
+        for calc in calculations
+    )
+    apply_deltas(
+        expand_grains((*grain, count) for grain, count in rows.items()),
+        using=using
+    )
+
+
+def aggregate_rows(queryset):
+    rows = (
+        queryset.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('user_id', 'operation', 'day')
+        .annotate(count=Count('id'))
+        .values_list('user_id', 'operation', 'day', 'count')
+    )
+    return expand_grains(rows)
+
+
+def record_deleted(queryset):
+    apply_deltas(aggregate_rows(queryset), sign=-1, using=queryset.db)
+
+
+def rebuild(using='default'):
+    from .models import Calculation, CalculationRollup
+
+    deltas = aggregate_rows(Calculation.objects.using(using).all())
+    with transaction.atomic(using=using):
+        CalculationRollup.objects.using(using).all().delete()
+        CalculationRollup.objects.using(using).bulk_create(
+            [
+                CalculationRollup(
+                    key=rollup_key(user_id, operation, day),
+                    user_id=user_id,
+                    operation=operation,
+                    day=day,
+                    count=count
+                )
+                for (user_id, operation, day), count in deltas.items()
+                if count
+            ],
+            batch_size=getattr(settings, 'CALCULATOR_BULK_BATCH_SIZE', 500)
+        )
+    return len(deltas)
+
+
+def _rollup_rows(user_id, days, using):
+    """
+    Строки (operation, day, count) за последние days дней. Для ALL_USERS
+    срезы пользователей складываются при чтении.
+    """
+    from .models import CalculationRollup
+
+    days = days or getattr(settings, 'CALCULATOR_STATS_DAYS', 30)
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rollups = CalculationRollup.objects.using(using).exclude(day__lt=since)
+    if user_id != ALL_USERS:
+        return (
+            rollups.filter(user_id=user_id)
+            .order_by('day', 'operation')
+            .values_list('operation', 'day', 'count')
+        )
+    return (
+        rollups.exclude(user_id=ALL_USERS)
+        .values('operation', 'day')
+        .annotate(total=Sum('count'))
+        .order_by('day', 'operation')
+        .values_list('operation', 'day', 'total')
+    )
+
+
+def _top_user_rows(top_users, using):
+    from .models import CalculationRollup
+
+    return (
+        CalculationRollup.objects.using(using)
+        .filter(operation=ALL_OPERATIONS, day__isnull=True, count__gt=0)
+        .exclude(user_id=ALL_USERS)
+        .order_by('-count')
+        .values_list('user_id', 'count')
+    )
+
+
+def _usernames(user_ids):
+    from django.contrib.auth.models import User
+
+    return User.objects.filter(pk__in=user_ids).values_list('id', 'username')
+
+
+def _assemble(rows, top=None, usernames=None):
+    total = 0
+    by_operation = {}
+    by_day = []
+    for operation, day, count in rows:
+        if not count:
+            continue
+        if day is not None:
+            by_day.append({'day': day, 'count': count})
+        elif operation:
+            by_operation[operation] = count
+        else:
+            total = count
+
+    statistics = {
+        'total_calculations': total,
+        'by_operation': by_operation,
+        'by_day': by_day,
+    }
+
+    if top is not None:
+        usernames = dict(usernames)
+        statistics['by_user'] = [
+            {'user': uid, 'username': usernames.get(uid), 'count': count}
+            for uid, count in top
+        ]
+
+    return statistics
+
+
+def _merge_rollup_rows(shards):
+    """
+    Складывает общие агрегаты шардов. Пользователь целиком живёт в
+    одном шарде, поэтому его агрегаты не суммируются, а общий топ —
+    лучшие из топов шардов.
+    """
+    if len(shards) == 1:
+        return shards[0]
+    counts = Counter()
+    for rows in shards:
+        for operation, day, count in rows:
+            counts[operation, day] += count
+    return sorted(
+        ((operation, day, count) for (operation, day), count in counts.items()),
+        key=lambda row: (row[1] is not None, row[1] or '', row[0])
+    )
+
+
+def _merge_top(shards, top_users):
+    return sorted((row for rows in shards for row in rows), key=lambda row: -row[1])[:top_users]
+
+
+def get_statistics(user_id=ALL_USERS, days=None, top_users=None):
+    if user_id != ALL_USERS:
+        using = replication.read_alias(sharding.database_for_user(user_id))
+        return _assemble(list(_rollup_rows(user_id, days, using)))
+
+    top_users = top_users or getattr(settings, 'CALCULATOR_STATS_TOP_USERS', 10)
+    aliases = [replication.read_alias(alias) for alias in sharding.databases()]
+    rows = _merge_rollup_rows([list(_rollup_rows(ALL_USERS, days, alias)) for alias in aliases])
+    top = _merge_top([list(_top_user_rows(top_users, alias)[:top_users]) for alias in aliases], top_users)
+    return _assemble(rows, top, _usernames([uid for uid, _ in top]))
+
+
+async def aget_statistics(user_id=ALL_USERS, days=None, top_users=None):
+    if user_id != ALL_USERS:
+        using = replication.read_alias(await sharding.adatabase_for_user(user_id))
+        return _assemble([row async for row in _rollup_rows(user_id, days, using)])
+
+    top_users = top_users or getattr(settings, 'CALCULATOR_STATS_TOP_USERS', 10)
+    aliases = [replication.read_alias(alias) for alias in sharding.databases()]
+    rows = _merge_rollup_rows([
+        [row async for row in _rollup_rows(ALL_USERS, days, alias)] for alias in aliases
+    ])
+    top = _merge_top([
+        [row async for row in _top_user_rows(top_users, alias)[:top_users]] for alias in aliases
+    ], top_users)
+    usernames = [row async for row in _usernames([uid for uid, _ in top])]
+    return _assemble(rows, top, usernames)
@@ -1,3 +1,1687 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CalculatorRefreshToken
+from .cache import get_result_cache
+from .engine import evaluate, evaluate_array, evaluate_batch
+from .expressions import ExpressionError, cache_info, compile_expression
+from .filtering import filter_history
+from . import arrays, compression, engine, events, metrics, numeric, profiling, replication, retention, sharding, stats, writebehind
+from .models import ArchivedCalculation, Calculation, CalculationRollup, PurgeJob, ShardAssignment
+from .pagination import CalculationCursorPagination
+from .serializers import CalculationListSerializer, CalculationSerializer
+
+
+# default и шарды истории. Реплики в тестах — зеркала TEST['MIRROR'],
+# а зеркала в databases TestCase открыл бы отдельными транзакциями.
+# Исходные тесты истории закреплены за одной базой; их варианты для
+# настроенных шардов — в ShardAware*Tests.
+HISTORY_DATABASES = set(settings.CALCULATOR_SHARDING['DATABASES'])
+
+
+def all_calculations(**filters):
+    """Вычисления из всех шардов истории (см. calculator.sharding)."""
+    return sharding.scatter(Calculation.objects.filter(**filters))
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculateBatchViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_batch_returns_per_item_results_and_errors(self):
+        response = self.client.post(reverse('calculate-batch'), {'operations': [
+            {'num1': 2, 'num2': 3, 'operation': 'add'},
+            {'num1': 1, 'num2': 0, 'operation': 'divide'},
+            {'num1': 9, 'operation': 'sqrt'},
+            {'num1': 'x', 'num2': 1, 'operation': 'add'},
+            {'num1': 1, 'num2': 1, 'operation': 'modulo'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(results[0]['result'], 5)
+        self.assertEqual(results[0]['calculation']['expression'], '2.0 + 3.0')
+        self.assertIn('error', results[1])
+        self.assertEqual(results[2]['result'], 3)
+        self.assertIn('error', results[3])
+        self.assertIn('error', results[4])
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertEqual(response.data['failed'], 3)
+        self.assertEqual(Calculation.objects.filter(user=self.user).count(), 2)
+
+    def test_batch_rejects_empty_payload(self):
+        response = self.client.post(reverse('calculate-batch'), {'operations': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class EvaluateBatchTests(TestCase):
+    items = [
+        ('divide', 1.0, 0.0),
+        ('divide', 1.0, 4.0),
+        ('sqrt', -1.0, None),
+        ('sqrt', 16.0, None),
+        ('power', 10.0, 400.0),
+        ('power', 2.0, 10.0),
+    ]
+
+    @skipUnless(engine.np, 'нужен numpy')
+    def test_vectorized_matches_scalar(self):
+        with override_settings(CALCULATOR_VECTORIZE_THRESHOLD=1):
+            vectorized = evaluate_batch(self.items)
+        with override_settings(CALCULATOR_VECTORIZE_THRESHOLD=10 ** 9):
+            scalar = evaluate_batch(self.items)
+
+        self.assertEqual(vectorized, scalar)
+        self.assertEqual(scalar[1], (0.25, None))
+        self.assertEqual(scalar[5], (1024.0, None))
+        self.assertIsNone(scalar[0][0])
+        self.assertIsNone(scalar[4][0])
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculateArrayViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ksenia')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, payload):
+        return self.client.post(reverse('calculate-array'), payload, format='json')
+
+    def test_vector_matches_scalar_engine(self):
+        num1 = [1.0, 2.0, -4.0, 10.0, 0.1]
+        num2 = [0.0, 3.0, 2.0, 400.0, 0.2]
+        for operation in ('add', 'divide', 'power', 'sqrt'):
+            results, codes = evaluate_array(operation, num1, None if operation == 'sqrt' else num2)
+            for i, (a, b) in enumerate(zip(num1, num2)):
+                try:
+                    expected = evaluate(operation, a, None if operation == 'sqrt' else b)
+                except ValueError:
+                    self.assertNotEqual(codes[i], 0)
+                else:
+                    self.assertEqual((results[i], codes[i]), (expected, 0))
+
+    def test_json_summary_records_one_row(self):
+        response = self.post({'operation': 'divide', 'num1': [1, 4, 9], 'num2': [2, 0, 3]})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'], [0.5, None, 3.0])
+        self.assertEqual(data['errors'], {'1': 'Деление на ноль невозможно'})
+        self.assertEqual((data['succeeded'], data['failed']), (2, 1))
+        calculation = Calculation.objects.get(user=self.user)
+        self.assertEqual(calculation.result, 3.5)
+        self.assertEqual(calculation.expression, 'Σ(a / b) [2 из 3]')
+
+    def test_rows_history_and_scalar_num2(self):
+        response = self.post({'operation': 'multiply', 'num1': [1, 2, 3], 'num2': 2, 'history': 'rows'})
+
+        self.assertEqual(response.json()['results'], [2.0, 4.0, 6.0])
+        self.assertEqual(
+            sorted(Calculation.objects.filter(user=self.user).values_list('expression', flat=True)),
+            ['1.0 * 2.0', '2.0 * 2.0', '3.0 * 2.0']
+        )
+        self.assertEqual(self.post({'operation': 'add', 'num1': [1], 'num2': [1, 2]}).status_code, 400)
+        with override_settings(CALCULATOR_ARRAY={'MAX_SIZE': 2}):
+            self.assertEqual(self.post({'operation': 'sqrt', 'num1': [1, 2, 3]}).status_code, 400)
+
+    def test_binary_round_trip(self):
+        body = struct.pack('<4d', 16.0, -1.0, 0.0, 0.0)
+        response = self.client.post(
+            reverse('calculate-array') + '?operation=sqrt&history=none',
+            body, content_type='application/octet-stream', HTTP_ACCEPT='application/octet-stream'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertEqual(response['X-Calculator-Failed'], '1')
+        results = struct.unpack('<4d', response.content[:32])
+        self.assertEqual((results[0], results[2]), (4.0, 0.0))
+        self.assertNotEqual(results[1], results[1])
+        self.assertEqual(list(response.content[32:]), [0, 2, 0, 0])
+        self.assertFalse(Calculation.objects.filter(user=self.user).exists())
+
+
+class CalculateArrayFallbackTests(CalculateArrayViewTests):
+    """Те же проверки без NumPy: поэлементный путь через array('d')."""
+
+    def setUp(self):
+        super().setUp()
+        for module in (engine, arrays):
+            patcher = mock.patch.object(module, 'np', None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@skipUnless(engine.np, 'нужен numpy')
+class VectorKernelTests(TestCase):
+    def test_masks_mark_domain_errors_without_warnings(self):
+        np = engine.np
+        a = np.array([1.0, -4.0, 10.0, 9.0])
+        b = np.array([0.0, 2.0, 400.0, 3.0])
+        with np.errstate(all='raise'):
+            _, codes = engine._vector_kernel('divide', a, b)
+            self.assertEqual(codes.tolist(), [1, 0, 0, 0])
+            result, codes = engine._vector_kernel('sqrt', a, None)
+            self.assertEqual(codes.tolist(), [0, 2, 0, 0])
+            self.assertEqual(result[3], 3.0)
+            _, codes = engine._vector_kernel('power', a, b)
+            self.assertEqual(codes.tolist(), [0, 0, 3, 0])
+
+    def test_array_results_are_float64_with_nan_on_errors(self):
+        np = engine.np
+        results, codes = evaluate_array('divide', [1.0, 2.0], 0.5)
+        self.assertEqual((results.dtype, codes.dtype), (np.float64, np.uint8))
+        results, codes = evaluate_array('divide', [1.0, 1.0], [3.0, 0.0])
+        self.assertEqual(results[0], round(1 / 3, 10))
+        self.assertTrue(np.isnan(results[1]))
+        self.assertEqual(arrays.failures(codes), {1: 'Деление на ноль невозможно'})
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculationPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(5):
+            Calculation.objects.create(user=self.user, num1=i, num2=1, operation='add', result=i + 1)
+
+    def test_cursor_pages_cover_history_without_offset(self):
+        url = reverse('calculations-list') + '?page_size=2'
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            self.assertFalse(any('OFFSET' in q['sql'] for q in queries.captured_queries))
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Calculation.objects.filter(user=self.user).values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(CalculationCursorPagination, 'max_page_size', 3):
+            response = self.client.get(reverse('calculations-list') + '?page_size=100000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculationListQueryTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='root', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_history(self, users):
+        start = User.objects.count()
+        for i in range(start, start + users):
+            user = User.objects.create(username=f'user{i}')
+            Calculation.objects.create(user=user, num1=i, num2=2, operation='multiply', result=i * 2)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response
+
+    def test_admin_list_query_count_is_constant(self):
+        self.create_history(2)
+        small, _ = self.count_queries(reverse('admin-calculations'))
+        self.create_history(20)
+        large, response = self.count_queries(reverse('admin-calculations'))
+
+        self.assertEqual(small, large)
+        # Запрос списка и чтение версии истории для ETag.
+        self.assertEqual(large, 2)
+        row = response.data['results'][0]
+        self.assertIsInstance(row['user'], int)
+        self.assertTrue(row['username'].startswith('user'))
+
+    def test_fields_parameter_trims_columns(self):
+        self.create_history(1)
+        response = self.client.get(reverse('admin-calculations') + '?fields=id,result,bogus')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'result'})
+
+    def test_ordering_by_username_paginates(self):
+        self.create_history(3)
+        url = reverse('admin-calculations') + '?ordering=user__username&page_size=2&fields=username'
+        _, response = self.count_queries(url)
+        self.assertEqual([row['username'] for row in response.data['results']], ['user1', 'user2'])
+        _, response = self.count_queries(response.data['next'])
+        self.assertEqual([row['username'] for row in response.data['results']], ['user3'])
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculationExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='carol')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Calculation.objects.create(user=self.user, num1=4, operation='sqrt', result=2)
+        Calculation.objects.create(user=self.user, num1=1, num2=2, operation='add', result=3)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(
+            reverse('calculations-export') + '?operation=add&fields=expression,result'
+        )
+        self.assertEqual(self.read(response).splitlines(), ['expression,result', '1 + 2,3.0'])
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('calculations-export') + '?export_format=ndjson')
+        lines = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([line['operation'] for line in lines], ['add', 'sqrt'])
+        self.assertEqual(lines[0]['username'], 'carol')
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(reverse('calculations-export') + '?export_format=xml')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculationRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dave')
+        self.other = User.objects.create(username='erin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def snapshot(self):
+        return dict(CalculationRollup.objects.filter(count__gt=0).values_list('key', 'count'))
+
+    def assertRollupsConsistent(self):
+        incremental = self.snapshot()
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_rollups_follow_creates_and_deletes(self):
+        self.client.post(reverse('calculate'), {'num1': 2, 'num2': 3, 'operation': 'add'}, format='json')
+        self.client.post(reverse('calculate-batch'), {'operations': [
+            {'num1': 2, 'num2': 3, 'operation': 'power'},
+            {'num1': 4, 'operation': 'sqrt'},
+        ]}, format='json')
+        Calculation.objects.create(user=self.other, num1=1, num2=1, operation='add', result=2)
+        self.assertRollupsConsistent()
+
+        calculation = Calculation.objects.filter(user=self.user, operation='sqrt').get()
+        self.client.delete(reverse('calculation-detail', args=[calculation.pk]))
+        self.assertRollupsConsistent()
+
+        self.client.post(reverse('clear-history'), {}, format='json')
+        self.assertRollupsConsistent()
+
+        self.other.delete()
+        self.assertRollupsConsistent()
+        self.assertEqual(self.snapshot(), {})
+
+    def test_update_recalculates_and_moves_rollups(self):
+        calculation = Calculation.objects.create(user=self.user, num1=2, num2=3, operation='add', result=5)
+        url = reverse('calculation-detail', args=[calculation.pk])
+
+        response = self.client.patch(url, {'operation': 'multiply'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['result'], response.data['expression']), (6.0, '2.0 * 3.0'))
+        self.assertEqual(self.client.get(reverse('statistics')).data['by_operation'], {'multiply': 1})
+        self.assertRollupsConsistent()
+
+        response = self.client.patch(url, {'num2': 0, 'operation': 'divide'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.patch(url, {'operation': 'expression'}, format='json').status_code, 400)
+
+        calculation = Calculation(user=self.user, operation='add', **numeric.calculate('add', '1/3', '1/6', 'fraction'))
+        calculation.save()
+        response = self.client.patch(reverse('calculation-detail', args=[calculation.pk]), {'operation': 'multiply'}, format='json')
+        self.assertEqual(response.data['result_exact'], '1/18')
+
+    def test_single_write_touches_only_user_rows(self):
+        using = sharding.database_for_user(self.user.pk)
+        with CaptureQueriesContext(connections[using]) as queries:
+            calculation = Calculation.objects.create(user=self.user, num1=2, num2=3, operation='add', result=5)
+        rollup_writes = [query for query in queries if 'calculator_calculationrollup' in query['sql']]
+        version_writes = [query for query in queries if 'calculator_historyversion' in query['sql']]
+        self.assertEqual((len(rollup_writes), len(version_writes)), (1, 1))
+
+        calculation.operation = 'multiply'
+        calculation.result = 6
+        calculation.save()
+        calculation.delete()
+        self.assertFalse(CalculationRollup.objects.using(using).filter(user_id=stats.ALL_USERS).exists())
+        self.assertEqual(stats.get_version(self.user.pk)[0], 3)
+        Calculation.objects.create(user=self.other, num1=1, num2=1, operation='add', result=2)
+        self.assertEqual(stats.get_version()[0], 4)
+        self.assertRollupsConsistent()
+
+    def test_statistics_endpoint_serves_breakdowns(self):
+        self.client.post(reverse('calculate-batch'), {'operations': [
+            {'num1': 1, 'num2': 2, 'operation': 'add'},
+            {'num1': 1, 'num2': 2, 'operation': 'add'},
+            {'num1': 9, 'operation': 'sqrt'},
+        ]}, format='json')
+        Calculation.objects.create(user=self.other, num1=1, num2=1, operation='add', result=2)
+
+        response = self.client.get(reverse('statistics'))
+        self.assertEqual(response.data['total_calculations'], 3)
+        self.assertEqual(response.data['by_operation'], {'add': 2, 'sqrt': 1})
+        self.assertEqual(response.data['by_day'][-1]['count'], 3)
+        self.assertNotIn('by_user', response.data)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('statistics'))
+        self.assertEqual(response.data['total_calculations'], 4)
+        self.assertEqual(response.data['by_user'][0], {'user': self.user.id, 'username': 'dave', 'count': 3})
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='frank', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        get_result_cache().clear()
+
+    def test_repeated_calculation_hits_cache(self):
+        payload = {'num1': 2, 'num2': 10, 'operation': 'power'}
+        first = self.client.post(reverse('calculate'), payload, format='json')
+        with mock.patch('calculator.views.evaluate') as evaluate:
+            second = self.client.post(reverse('calculate'), payload, format='json')
+        evaluate.assert_not_called()
+
+        self.assertEqual(first.data['result'], 1024)
+        self.assertEqual(second.data['result'], 1024)
+        self.assertEqual(Calculation.objects.filter(user=self.user).count(), 2)
+
+        response = self.client.get(reverse('cache-statistics'))
+        self.assertEqual((response.data['hits'], response.data['misses']), (1, 1))
+
+    def test_payload_matches_serializer(self):
+        response = self.client.post(reverse('calculate'), {'num1': 9, 'operation': 'sqrt'}, format='json')
+        calculation = Calculation.objects.select_related('user').get(pk=response.data['calculation']['id'])
+        self.assertEqual(response.data['calculation'], CalculationSerializer(calculation).data)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ExpressionTests(TestCase):
+    def test_precedence_and_normalization(self):
+        cases = {
+            '(2+3)^4 / sqrt(7)': ('(2 + 3) ^ 4 / sqrt(7)', 236.2277956308),
+            '2^3^2': ('2 ^ 3 ^ 2', 512.0),
+            '-2**2': ('-2 ^ 2', -4.0),
+            '1-(2-3)': ('1 - (2 - 3)', 2.0),
+            '√16 * 2.5': ('sqrt(16) * 2.5', 10.0),
+        }
+        for source, (normalized, result) in cases.items():
+            compiled = compile_expression(source)
+            self.assertEqual(compiled.normalized, normalized)
+            self.assertEqual(compiled.evaluate(), result)
+
+    def test_invalid_expressions(self):
+        for source in ['', '2 +', '__import__("os")', '1/0', 'sqrt(-1)', '10^1000', '(' * 40 + '1' + ')' * 40]:
+            with self.assertRaises(ExpressionError, msg=source):
+                compile_expression(source).evaluate()
+
+    def test_time_limit(self):
+        with self.assertRaises(ExpressionError):
+            compile_expression('1' + '+1' * 80).evaluate(time_limit=-1)
+
+    def test_compiled_expressions_are_cached(self):
+        compile_expression('7 * 6')
+        hits = cache_info().hits
+        self.assertIs(compile_expression(' 7 * 6 '), compile_expression('7 * 6'))
+        self.assertEqual(cache_info().hits, hits + 2)
+
+    def test_expression_mode_endpoint(self):
+        user = User.objects.create(username='grace')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post(reverse('calculate'), {
+            'operation': 'expression', 'expression': '(1+2)*3'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['result'], 9)
+        self.assertEqual(response.data['calculation']['expression'], '(1 + 2) * 3')
+
+        response = client.post(reverse('calculate'), {
+            'operation': 'expression', 'expression': '1 +* 2'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CALCULATOR_WRITE_BEHIND={
+    'ENABLED': True,
+    'DURABILITY': 'flush_on_read',
+    'MAX_BATCH': 1000,
+    'FLUSH_INTERVAL': 3600,
+})
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='heidi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        buffer = writebehind.get_write_behind()
+        buffer.drain()
+        writebehind._buffer = None
+
+    def test_calculations_are_queued_until_flush(self):
+        response = self.client.post(reverse('calculate'), {'num1': 1, 'num2': 2, 'operation': 'add'}, format='json')
+        self.assertTrue(response.data['queued'])
+        self.assertIsNone(response.data['calculation']['id'])
+        self.assertEqual(response.data['calculation']['expression'], '1.0 + 2.0')
+        self.assertFalse(Calculation.objects.exists())
+
+        response = self.client.get(reverse('calculations-list'))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(len(writebehind.get_write_behind()), 0)
+
+    def test_queued_calculation_invalidates_validators(self):
+        url = reverse('calculations-list')
+        first = self.client.get(url)
+        self.client.post(reverse('calculate'), {'num1': 1, 'num2': 2, 'operation': 'add'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_drain_persists_pending_rows(self):
+        buffer = writebehind.get_write_behind()
+        for i in range(3):
+            buffer.enqueue(Calculation(user=self.user, num1=i, operation='sqrt', result=i ** 0.5))
+        self.assertEqual(buffer.drain(), 3)
+        self.assertEqual(Calculation.objects.count(), 3)
+        self.assertEqual(Calculation.objects.filter(expression='√(1)').count(), 1)
+
+    def test_failing_row_is_dead_lettered_after_max_attempts(self):
+        buffer = writebehind.get_write_behind()
+        buffer.enqueue(Calculation(user=self.user, num1=1, num2=1, operation='add', result=None))
+        buffer.enqueue(Calculation(user=self.user, num1=1, num2=2, operation='add', result=3))
+        with self.assertLogs('calculator.writebehind', 'ERROR'):
+            self.assertEqual(buffer.flush(), 1)
+            self.assertEqual(len(buffer), 1)
+            for _ in range(buffer.max_attempts - 1):
+                buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(len(buffer.dead_letters), 1)
+        self.assertEqual(Calculation.objects.count(), 1)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ivan')
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.client = AsyncClient()
+
+    async def test_calculate_list_and_statistics(self):
+        for i in range(3):
+            response = await self.client.post(
+                reverse('async-calculate'),
+                {'num1': i, 'num2': 2, 'operation': 'multiply'},
+                content_type='application/json',
+                headers=self.headers
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['result'], i * 2)
+
+        response = await self.client.get(reverse('async-calculations-list') + '?page_size=2', headers=self.headers)
+        page = response.json()
+        self.assertEqual([row['result'] for row in page['results']], [4.0, 2.0])
+
+        response = await self.client.get(page['next'], headers=self.headers)
+        page = response.json()
+        self.assertEqual([row['result'] for row in page['results']], [0.0])
+        self.assertIsNone(page['next'])
+
+        response = await self.client.get(reverse('async-statistics'), headers=self.headers)
+        self.assertEqual(response.json()['by_operation'], {'multiply': 3})
+
+    async def test_requires_authentication(self):
+        response = await AsyncClient().get(reverse('async-calculations-list'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_invalid_input(self):
+        response = await self.client.post(
+            reverse('async-calculate'),
+            {'num1': 1, 'num2': 0, 'operation': 'divide'},
+            content_type='application/json',
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CALCULATOR_WRITE_BEHIND={'ENABLED': True, 'MAX_PENDING': 1, 'FLUSH_INTERVAL': 60})
+    async def test_full_write_behind_queue_flushes_off_the_event_loop(self):
+        self.addCleanup(setattr, writebehind, '_buffer', None)
+        response = await self.client.post(
+            reverse('async-calculate'),
+            {'num1': 1, 'num2': 2, 'operation': 'add'},
+            content_type='application/json',
+            headers=self.headers
+        )
+        self.assertTrue(response.json()['queued'])
+        self.assertEqual(await Calculation.objects.acount(), 1)
+        writebehind.get_write_behind().drain()
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class EventStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='oleg')
+        self.other = User.objects.create(username='olesya')
+        self.admin = User.objects.create(username='oksana', is_staff=True)
+        self.client = AsyncClient()
+        broker = mock.patch.object(events, '_broker', events.EventBroker())
+        broker.start()
+        self.addCleanup(broker.stop)
+
+    def token(self, user):
+        return str(CalculatorRefreshToken.for_user(user).access_token)
+
+    async def open_stream(self, user, **params):
+        response = await self.client.get(reverse('events'), {'token': self.token(user), **params})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        first = await asyncio.wait_for(anext(stream), 1)
+        self.assertIn(b'event: ready', first)
+        return stream
+
+    async def next_event(self, stream):
+        chunk = (await asyncio.wait_for(anext(stream), 2)).decode()
+        lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        return lines['event'], json.loads(lines['data'])
+
+    async def test_user_stream_receives_own_creates_and_deletes(self):
+        stream = await self.open_stream(self.user)
+
+        await Calculation.objects.acreate(user=self.other, num1=1, num2=1, operation='add', result=2)
+        calculation = await Calculation.objects.acreate(user=self.user, num1=2, num2=3, operation='add', result=5)
+        event, data = await self.next_event(stream)
+        self.assertEqual(event, 'created')
+        self.assertEqual([(item['id'], item['expression']) for item in data['calculations']],
+                         [(calculation.pk, '2 + 3')])
+
+        await Calculation.objects.filter(user=self.user).adelete()
+        self.assertEqual(await self.next_event(stream), ('deleted', {'ids': [calculation.pk]}))
+        await stream.aclose()
+
+    async def test_admin_stream_sees_all_users(self):
+        response = await self.client.get(reverse('events'), {'token': self.token(self.user), 'scope': 'all'})
+        self.assertEqual(response.status_code, 403)
+
+        stream = await self.open_stream(self.admin, scope='all')
+        await Calculation.objects.abulk_create([
+            Calculation(user=self.user, num1=1, num2=1, operation='add', result=2),
+            Calculation(user=self.other, num1=2, num2=2, operation='add', result=4),
+        ])
+        event, data = await self.next_event(stream)
+        self.assertEqual(event, 'created')
+        self.assertEqual([item['username'] for item in data['calculations']], ['oleg', 'olesya'])
+        await stream.aclose()
+
+    async def test_slow_subscriber_gets_reset(self):
+        broker = events.EventBroker(queue_size=2)
+        subscription = broker.subscribe(self.user.pk)
+        for _ in range(3):
+            broker.publish(self.user.pk, {'type': events.DELETED, 'ids': [1]})
+        await asyncio.sleep(0)
+
+        self.assertEqual((await subscription.get(1))['type'], events.RESET)
+        subscription.close()
+        self.assertFalse(broker.has_subscribers())
+
+    def test_wsgi_handler_refuses_stream(self):
+        # Client() — WSGI-обработчик: бесконечный поток занял бы поток навсегда.
+        client = Client()
+        response = client.get(reverse('events'), {'token': self.token(self.user)})
+        self.assertEqual(response.status_code, 501)
+        self.assertNotIn('subscribeHistoryEvents({', client.get(reverse('history')).content.decode())
+
+    async def test_asgi_pages_subscribe_unless_disabled(self):
+        response = await self.client.get(reverse('history'))
+        self.assertIn('subscribeHistoryEvents({', response.content.decode())
+
+        with override_settings(CALCULATOR_EVENTS={'ENABLED': False}):
+            response = await self.client.get(reverse('history'))
+            self.assertNotIn('subscribeHistoryEvents({', response.content.decode())
+            response = await self.client.get(reverse('events'), {'token': self.token(self.user)})
+            self.assertEqual(response.status_code, 501)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class StatelessAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='olga', password='secret-pass', is_staff=True)
+
+    def test_stateless_login_creates_no_session(self):
+        from django.contrib.sessions.models import Session
+
+        response = self.client.post(
+            reverse('login'),
+            {'username': 'olga', 'password': 'secret-pass', 'stateless': True},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+
+        token = AccessToken(response.json()['token']['access'])
+        self.assertEqual((token['username'], token['is_staff']), ('olga', True))
+
+    def test_claims_token_skips_user_lookup(self):
+        client = APIClient()
+        legacy = f'Bearer {AccessToken.for_user(self.user)}'
+        stateless = f'Bearer {CalculatorRefreshToken.for_user(self.user).access_token}'
+        payload = {'num1': 2, 'num2': 3, 'operation': 'add'}
+
+        client.post(reverse('calculate'), payload, format='json', HTTP_AUTHORIZATION=legacy)
+        with CaptureQueriesContext(connection) as legacy_queries:
+            client.post(reverse('calculate'), payload, format='json', HTTP_AUTHORIZATION=legacy)
+        with CaptureQueriesContext(connection) as stateless_queries:
+            response = client.post(reverse('calculate'), payload, format='json', HTTP_AUTHORIZATION=stateless)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['calculation']['username'], 'olga')
+        self.assertEqual(len(stateless_queries), len(legacy_queries) - 1)
+        self.assertFalse(any('auth_user' in query['sql'] for query in stateless_queries))
+
+        response = client.get(reverse('admin-calculations'), HTTP_AUTHORIZATION=stateless)
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_restamps_claims_from_database(self):
+        refresh = str(CalculatorRefreshToken.for_user(self.user))
+        self.user.is_staff = False
+        self.user.save()
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(AccessToken(response.json()['access'])['is_staff'])
+        client = APIClient(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(client.get(reverse('admin-calculations')).status_code, 403)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_claims_user_owns_its_rows(self):
+        member = User.objects.create_user(username='oleg', password='secret-pass')
+        client = APIClient(HTTP_AUTHORIZATION=f'Bearer {CalculatorRefreshToken.for_user(member).access_token}')
+        calculation = Calculation.objects.create(user=member, num1=1, num2=2, operation='add', result=3)
+        job = PurgeJob.objects.create(requested_by=member, target_user_id=member.pk)
+
+        self.assertEqual(client.get(reverse('purge-job', args=[job.pk])).status_code, 200)
+        self.assertEqual(client.delete(reverse('calculation-detail', args=[calculation.pk])).status_code, 204)
+        self.assertFalse(Calculation.objects.exists())
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class CalculationSearchTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='root', is_staff=True)
+        self.anna = User.objects.create(username='anna')
+        self.boris = User.objects.create(username='boris')
+        Calculation.objects.create(user=self.anna, num1=2, num2=3, operation='add', result=5)
+        Calculation.objects.create(user=self.anna, num1=16, operation='sqrt', result=4)
+        Calculation.objects.create(user=self.boris, num1=7, num2=2, operation='multiply', result=14)
+        self.client = APIClient()
+
+    def search(self, url_name, user, **params):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['result'] for row in response.json()['results']), queries
+
+    def test_migrations_leave_fts_index_and_triggers(self):
+        from .search import FTS_TABLE, FTS_TRIGGERS
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE %s", [f'{FTS_TABLE}%'])
+            objects = set(cursor.fetchall())
+        self.assertIn(('table', FTS_TABLE), objects)
+        self.assertTrue({('trigger', name) for name in FTS_TRIGGERS} <= objects)
+
+    def test_search_uses_fts_index(self):
+        results, queries = self.search('calculations-list', self.anna, search='ad')
+        self.assertEqual(results, [5.0])
+        self.assertTrue(any('calculator_calculation_fts' in query['sql'] for query in queries))
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries))
+
+        self.assertEqual(self.search('calculations-list', self.anna, search='√(16')[0], [4.0])
+        self.assertEqual(self.search('admin-calculations', self.admin, search='bor')[0], [14.0])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.boris.username = 'vladimir'
+        self.boris.save()
+        self.assertEqual(self.search('admin-calculations', self.admin, search='vlad')[0], [14.0])
+
+        Calculation.objects.filter(user=self.boris).delete()
+        self.assertEqual(self.search('admin-calculations', self.admin, search='vlad')[0], [])
+
+    def test_fallback_without_index(self):
+        with mock.patch('calculator.search.fts_available', return_value=False):
+            results, queries = self.search('calculations-list', self.anna, search='add')
+        self.assertEqual(results, [5.0])
+        self.assertTrue(any('LIKE' in query['sql'] for query in queries))
+
+    def test_numeric_ranges(self):
+        self.assertEqual(self.search('admin-calculations', self.admin, result_min=4.5)[0], [5.0, 14.0])
+        self.assertEqual(self.search('admin-calculations', self.admin, num1_max=10, num2_min=2.5)[0], [5.0])
+        self.assertEqual(self.search('calculations-list', self.anna, result_max='x')[0], [4.0, 5.0])
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class DateRangeFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dmitry')
+        # 2024-05-01 23:30 по Москве = 20:30 UTC
+        moments = [
+            datetime(2024, 5, 1, 20, 30, tzinfo=dt_timezone.utc),
+            datetime(2024, 5, 1, 21, 10, tzinfo=dt_timezone.utc),
+            datetime(2024, 5, 2, 9, 0, tzinfo=dt_timezone.utc),
+        ]
+        for i, moment in enumerate(moments):
+            calculation = Calculation.objects.create(user=self.user, num1=i, num2=1, operation='add', result=i + 1)
+            Calculation.objects.filter(pk=calculation.pk).update(created_at=moment)
+
+    def results(self, **params):
+        queryset = filter_history(Calculation.objects.filter(user=self.user), params)
+        return sorted(queryset.values_list('result', flat=True))
+
+    def test_day_hour_and_minute_bounds_are_local(self):
+        self.assertEqual(self.results(date_from='2024-05-01', date_to='2024-05-01'), [1.0])
+        self.assertEqual(self.results(date_from='2024-05-02'), [2.0, 3.0])
+        self.assertEqual(self.results(date_from='2024-05-02T00', date_to='2024-05-02T00'), [2.0])
+        self.assertEqual(self.results(date_to='2024-05-01 23:30'), [1.0])
+        self.assertEqual(self.results(date_from='2024-05-01', date_to='2024-05-01', tz='UTC'), [1.0, 2.0])
+
+    def test_relative_window(self):
+        Calculation.objects.filter(result=3).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.results(last='24h'), [3.0])
+        self.assertEqual(self.results(last='1h'), [])
+        self.assertEqual(self.results(last='soon'), [1.0, 2.0, 3.0])
+
+    def test_out_of_range_bounds_are_unbounded(self):
+        self.assertEqual(self.results(date_to='9999-12-31', date_from='0001-01-01', tz='Asia/Tokyo'), [1.0, 2.0, 3.0])
+        self.assertEqual(self.results(last='99999999999999999999d'), [1.0, 2.0, 3.0])
+        self.assertEqual(self.results(last='999999999w'), [1.0, 2.0, 3.0])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('calculations-list'), {'date_to': '9999-12-31', 'last': '9' * 30 + 'd'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_range_uses_user_created_at_index(self):
+        queryset = filter_history(
+            Calculation.objects.filter(user=self.user),
+            {'date_from': '2024-05-01T12', 'date_to': '2024-05-02'}
+        )
+        plan = queryset.order_by('-created_at').explain()
+        self.assertIn('calculator__user_id_0cd1f7_idx', plan)
+        self.assertIn('created_at>', plan)
+        self.assertNotIn('django_datetime_cast_date', str(queryset.query))
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ClearHistoryTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='egor')
+        self.other = User.objects.create(username='fedor')
+        for user in (self.user, self.other):
+            Calculation.objects.bulk_create([
+                Calculation(user=user, num1=i, num2=1, operation='add', result=i + 1, expression=f'{i} + 1')
+                for i in range(12)
+            ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_rollups_match(self):
+        self.assertEqual(stats.get_statistics()['total_calculations'], Calculation.objects.count())
+
+    @override_settings(CALCULATOR_PURGE={'BATCH_SIZE': 5, 'BACKGROUND_THRESHOLD': 100})
+    def test_small_history_is_deleted_in_batches(self):
+        with mock.patch('django.db.models.deletion.Collector.collect') as collector:
+            response = self.client.post(reverse('clear-history'), {}, format='json')
+        collector.assert_not_called()
+        self.assertEqual(response.json()['deleted'], 12)
+        self.assertFalse(Calculation.objects.filter(user=self.user).exists())
+        self.assertEqual(Calculation.objects.filter(user=self.other).count(), 12)
+        self.assert_rollups_match()
+
+    def test_rows_written_during_purge_are_kept(self):
+        def write_during_purge(deleted):
+            Calculation.objects.create(user=self.user, num1=deleted, num2=1, operation='add', result=deleted + 1)
+
+        deleted = Calculation.objects.for_user(self.user.pk).delete_in_batches(batch_size=5, progress=write_during_purge)
+        self.assertEqual(deleted, 12)
+        self.assertEqual(Calculation.objects.filter(user=self.user).count(), 3)
+        self.assert_rollups_match()
+
+    @override_settings(CALCULATOR_PURGE={'BATCH_SIZE': 5, 'BACKGROUND_THRESHOLD': 10})
+    def test_large_purge_runs_in_background(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(reverse('clear-history'), {'all_users': True}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+
+        for _ in range(200):
+            job = self.client.get(response.json()['status_url']).json()
+            if job['status'] == PurgeJob.DONE:
+                break
+            time.sleep(0.01)
+        self.assertEqual((job['status'], job['total'], job['deleted']), (PurgeJob.DONE, 24, 24))
+        self.assertEqual(Calculation.objects.count(), 0)
+        self.assert_rollups_match()
+
+        stranger = APIClient()
+        stranger.force_authenticate(self.other)
+        self.assertEqual(stranger.get(reverse('purge-job', args=[job_id])).status_code, 404)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class RetentionTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='galina')
+        self.keeper = User.objects.create(username='hoarder')
+        now = timezone.now()
+        for user in (self.user, self.keeper):
+            for days in range(10):
+                calculation = Calculation.objects.create(user=user, num1=days, num2=1, operation='add', result=days + 1)
+                Calculation.objects.filter(pk=calculation.pk).update(created_at=now - timedelta(days=days, hours=1))
+
+    def remaining_ages(self, user):
+        return sorted(int(n) for n in Calculation.objects.filter(user=user).values_list('num1', flat=True))
+
+    @override_settings(CALCULATOR_RETENTION={
+        'DEFAULT': {'MAX_AGE_DAYS': 7, 'MAX_ROWS': 5},
+        'USERS': {'hoarder': {'MAX_AGE_DAYS': 3}},
+    })
+    def test_policies_move_rows_to_archive(self):
+        self.assertEqual(retention.apply_retention(dry_run=True), 5 + 7)
+
+        call_command('archive_history', stdout=mock.MagicMock())
+        self.assertEqual(self.remaining_ages(self.user), [0, 1, 2, 3, 4])
+        self.assertEqual(self.remaining_ages(self.keeper), [0, 1, 2])
+        self.assertEqual(ArchivedCalculation.objects.count(), 12)
+        self.assertEqual(stats.get_statistics()['total_calculations'], 8)
+        self.assertEqual(retention.apply_retention(), 0)
+
+        client = APIClient()
+        client.force_authenticate(self.keeper)
+        response = client.get(reverse('archived-calculations'), {'page_size': 3})
+        page = response.json()
+        self.assertEqual([row['num1'] for row in page['results']], [3.0, 4.0, 5.0])
+        self.assertEqual({row['username'] for row in page['results']}, {'hoarder'})
+        self.assertIsNotNone(page['next'])
+
+    @override_settings(CALCULATOR_RETENTION={'SCHEDULE_INTERVAL': 60})
+    def test_scheduler_is_started_only_by_server_entrypoints(self):
+        # Иначе архивацию и VACUUM запускали бы migrate, shell и тесты.
+        self.assertIsNone(retention._scheduler)
+        for module in ('web_calculator.wsgi', 'web_calculator.asgi'):
+            sys.modules.pop(module, None)
+            with mock.patch.object(retention, 'start_scheduler') as start, \
+                    mock.patch.object(replication, 'start_simulation'):
+                import_module(module)
+            start.assert_called_once_with()
+
+    def test_without_policies_nothing_is_archived(self):
+        self.assertEqual(retention.apply_retention(), 0)
+        self.assertEqual(Calculation.objects.count(), 20)
+
+
+class DatabaseProfileTests(TestCase):
+    def test_profiles(self):
+        from pathlib import Path
+        from web_calculator.database import database_config
+
+        profile, config = database_config(Path('/srv'), {})
+        self.assertEqual(profile, 'sqlite')
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL', config['OPTIONS']['init_command'])
+        self.assertIn('PRAGMA synchronous=NORMAL', config['OPTIONS']['init_command'])
+
+        _, config = database_config(Path('/srv'), {'CALCULATOR_DB_PROFILE': 'postgres', 'DB_POOL': '1'})
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 20)
+
+        with self.assertRaises(ValueError):
+            database_config(Path('/srv'), {'CALCULATOR_DB_PROFILE': 'oracle'})
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class NumericModeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='irina')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def calculate(self, **payload):
+        return self.client.post(reverse('calculate'), payload, format='json')
+
+    def test_decimal_mode_keeps_precision(self):
+        response = self.calculate(operation='add', num1='0.1', num2='0.2', mode='decimal')
+        self.assertEqual(response.json()['result_exact'], '0.3')
+
+        response = self.calculate(operation='divide', num1='1', num2='3', mode='decimal', precision=60)
+        self.assertEqual(response.json()['result_exact'], '0.' + '3' * 60)
+
+        response = self.calculate(operation='power', num1='10', num2='400', mode='decimal')
+        calculation = Calculation.objects.get(pk=response.json()['calculation']['id'])
+        self.assertEqual((calculation.mode, calculation.result_exact), ('decimal', '1E+400'))
+        self.assertEqual(calculation.expression, '10 ^ 400')
+
+    def test_fraction_mode_is_exact(self):
+        response = self.calculate(operation='add', num1='1/3', num2='1/6', mode='fraction')
+        self.assertEqual((response.json()['result_exact'], response.json()['result']), ('1/2', 0.5))
+        self.assertEqual(self.calculate(operation='sqrt', num1='9/16', mode='fraction').json()['result_exact'], '3/4')
+        self.assertEqual(self.calculate(operation='sqrt', num1='2', mode='fraction').status_code, 400)
+        self.assertEqual(self.calculate(operation='power', num1='2', num2='100000', mode='fraction').status_code, 400)
+
+    def test_float_overflow_and_unknown_mode(self):
+        response = self.calculate(operation='power', num1=10, num2=400)
+        self.assertEqual(response.json()['error'], 'Результат вне допустимого диапазона')
+        self.assertEqual(self.calculate(operation='add', num1=1, num2=2, mode='complex').status_code, 400)
+
+    def test_batch_accepts_modes(self):
+        response = self.client.post(reverse('calculate-batch'), [
+            {'operation': 'multiply', 'num1': '1/3', 'num2': '3', 'mode': 'fraction'},
+            {'operation': 'add', 'num1': 1, 'num2': 2},
+        ], format='json')
+        results = response.json()['results']
+        self.assertEqual(results[0]['calculation']['result_exact'], '1')
+        self.assertEqual(results[1]['calculation']['mode'], 'float')
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.get_registry().reset()
+        self.user = User.objects.create(username='leonid')
+        self.admin = User.objects.create(username='lidia', is_staff=True)
+        self.client = APIClient()
+
+    def test_records_latency_queries_and_phases(self):
+        token = CalculatorRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        for _ in range(3):
+            self.client.post(reverse('calculate'), {'num1': 2, 'num2': 3, 'operation': 'add'}, format='json')
+        self.client.get(reverse('calculations-list'))
+
+        collected = metrics.get_registry().collect()
+        calculate = collected[('calculate', 'POST')]
+        self.assertEqual((calculate.statuses, calculate.duration_count, calculate.sampled), ({200: 3}, 3, 3))
+        self.assertGreater(calculate.queries, 0)
+        self.assertGreater(calculate.phases['db'], 0)
+        self.assertGreater(calculate.phases['auth'], 0)
+        self.assertGreater(calculate.phases['render'], 0)
+        self.assertGreater(calculate.response_bytes, 0)
+        self.assertIn(('calculations-list', 'GET'), collected)
+
+    def test_finished_threads_are_folded_into_totals(self):
+        import threading
+
+        registry = metrics.MetricsRegistry()
+        for _ in range(5):
+            thread = threading.Thread(target=registry.record, args=('calculate', 'POST', 200, 0.01))
+            thread.start()
+            thread.join()
+        registry.record('calculate', 'POST', 200, 0.02)
+
+        self.assertEqual(registry.collect()[('calculate', 'POST')].duration_count, 6)
+        self.assertEqual(len(registry._shards), 1)
+        self.assertEqual(registry.collect()[('calculate', 'POST')].duration_count, 6)
+        registry.reset()
+        self.assertEqual(registry.collect(), {})
+
+    @override_settings(CALCULATOR_METRICS={'SAMPLE_RATE': 0})
+    def test_sampling_keeps_counts_without_breakdown(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('calculate'), {'num1': 1, 'num2': 0, 'operation': 'divide'}, format='json')
+
+        stats = metrics.get_registry().collect()[('calculate', 'POST')]
+        self.assertEqual((stats.statuses, stats.sampled, stats.queries), ({400: 1}, 0, 0))
+
+    def test_prometheus_endpoint_is_admin_only(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('calculate'), {'num1': 1, 'num2': 2, 'operation': 'add'}, format='json')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('calculator_requests_total{endpoint="calculate",method="POST",status="200"} 1', body)
+        self.assertIn('calculator_request_duration_seconds_bucket{endpoint="calculate",method="POST",le="+Inf"} 1', body)
+        self.assertIn('calculator_request_phase_seconds_total{endpoint="calculate",method="POST",phase="db"}', body)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.user = User.objects.create(username='maksim')
+        self.admin = User.objects.create(username='marina', is_staff=True)
+        Calculation.objects.create(user=self.user, num1=1, num2=2, operation='add', result=3)
+        self.client = APIClient()
+
+    def settings(self, **overrides):
+        return override_settings(CALCULATOR_PROFILING={'DIRECTORY': self.directory.name, **overrides})
+
+    def test_admin_can_profile_request_and_download(self):
+        token = CalculatorRefreshToken.for_user(self.admin).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with self.settings():
+            response = self.client.get(reverse('admin-calculations'), {'profile': 1})
+            profile_id = response['X-Calculator-Profile-Id']
+
+            listing = self.client.get(reverse('profiles')).json()['results']
+            self.assertEqual([item['id'] for item in listing], [profile_id])
+            self.assertEqual((listing[0]['trigger'], listing[0]['kind']), ('manual', 'cprofile'))
+            self.assertGreater(listing[0]['sql_count'], 0)
+
+            download = self.client.get(reverse('profile-download', args=[profile_id]))
+            record = json.loads(b''.join(download.streaming_content))
+            self.assertIn('calculator_calculation', ' '.join(item['sql'] for item in record['sql']))
+            self.assertTrue(record['profile']['functions'])
+            self.assertEqual(self.client.get(reverse('profile-download', args=['..secret'])).status_code, 404)
+
+    def test_non_admin_cannot_trigger_or_list(self):
+        self.client.force_authenticate(self.user)
+        with self.settings():
+            response = self.client.get(reverse('calculations-list'), HTTP_X_CALCULATOR_PROFILE='1')
+            self.assertNotIn('X-Calculator-Profile-Id', response)
+            self.assertEqual(self.client.get(reverse('profiles')).status_code, 403)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_slow_requests_are_sampled_into_bounded_buffer(self):
+        self.client.force_authenticate(self.user)
+        with self.settings(SLOW_THRESHOLD_MS=0, MAX_PROFILES=2):
+            for _ in range(3):
+                self.client.get(reverse('calculations-list'))
+            self.client.post(reverse('calculate'), {'num1': 1, 'num2': 2, 'operation': 'add'}, format='json')
+
+            profiles = profiling.list_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual({(item['trigger'], item['kind'], item['view']) for item in profiles},
+                         {('slow', 'sampling', 'calculations-list')})
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='nadia')
+        self.other = User.objects.create(username='nikita')
+        self.admin = User.objects.create(username='nina', is_staff=True)
+        self.calculation = Calculation.objects.create(user=self.user, num1=1, num2=2, operation='add', result=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_history_returns_304_without_list_query(self):
+        url = reverse('calculations-list')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.revalidate(url, first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertFalse(any('calculator_calculation' in query['sql'] for query in queries.captured_queries))
+
+        self.assertEqual(self.client.get(url, {'operation': 'add'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_create_update_and_delete_change_validators(self):
+        url = reverse('calculations-list')
+        response = self.client.get(url)
+
+        Calculation.objects.create(user=self.other, num1=1, num2=1, operation='add', result=2)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        self.client.post(reverse('calculate'), {'num1': 2, 'num2': 2, 'operation': 'add'}, format='json')
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+
+        self.calculation.result = 4
+        self.calculation.save()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+
+        self.client.delete(reverse('calculation-detail', args=[self.calculation.pk]))
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_statistics_and_admin_list(self):
+        statistics = self.client.get(reverse('statistics'))
+        self.assertEqual(self.revalidate(reverse('statistics'), statistics).status_code, 304)
+
+        self.client.force_authenticate(self.admin)
+        admin_url = reverse('admin-calculations')
+        response = self.client.get(admin_url)
+        self.assertEqual(self.revalidate(admin_url, response).status_code, 304)
+        Calculation.objects.create(user=self.other, num1=1, num2=1, operation='add', result=2)
+        self.assertEqual(self.revalidate(admin_url, response).status_code, 200)
+
+    def test_relative_window_is_not_answered_from_version(self):
+        url = reverse('calculations-list')
+        first = self.client.get(url, {'last': '1h'})
+        self.assertEqual(len(first.data['results']), 1)
+        self.assertNotIn('ETag', first)
+
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(url, {'last': '1h'}, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ListRenderingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Calculation.objects.bulk_create([
+            Calculation(user=self.user, num1=i, num2=2, operation='multiply',
+                        result=i * 2, expression=f'{i} × 2')
+            for i in range(60)
+        ])
+        Calculation.objects.create(user=self.user, num1=9, operation='sqrt', result=3, expression='√9')
+
+    def test_fast_list_serializer_matches_field_by_field_output(self):
+        from rest_framework.serializers import ListSerializer
+        
+        rows = list(CalculationListSerializer.project(Calculation.objects.order_by('id')))
+        for fields in (None, ['id', 'operation_display', 'created_at', 'num2']):
+            expected = ListSerializer(rows, child=CalculationListSerializer(fields=fields)).data
+            fast = CalculationListSerializer(rows, many=True, fields=fields).data
+            self.assertEqual(json.dumps(fast), json.dumps(expected))
+
+    def test_batch_response_keeps_nested_user(self):
+        response = self.client.post(
+            reverse('calculate-batch'),
+            {'operations': [{'operation': 'add', 'num1': 1, 'num2': 2}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        calculation = response.data['results'][0]['calculation']
+        self.assertEqual(calculation['user']['username'], 'alice')
+        self.assertEqual(calculation['operation_display'], 'Сложение')
+
+    def test_list_is_gzipped_when_accepted(self):
+        plain = self.client.get(reverse('calculations-list'))
+        response = self.client.get(reverse('calculations-list'), HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(json.loads(compression.decompress(response.content, 'gzip')), plain.json())
+        self.assertNotIn('Content-Encoding', plain)
+
+    def test_weak_etag_still_validates(self):
+        response = self.client.get(reverse('calculations-list'), HTTP_ACCEPT_ENCODING='gzip')
+        again = self.client.get(
+            reverse('calculations-list'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('calculations-list') + '?page_size=1&fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(response.content), compression.get_config()['min_size'])
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streaming_export_is_compressed(self):
+        response = self.client.get(reverse('calculations-export'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = compression.decompress(b''.join(response.streaming_content), 'gzip').decode()
+        self.assertEqual(len(body.strip().splitlines()), 62)
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate('gzip, deflate', ('br', 'gzip')), 'gzip')
+        self.assertEqual(compression.negotiate('gzip, br', ('br', 'gzip')), 'br')
+        self.assertEqual(compression.negotiate('gzip;q=1, br;q=0.5', ('br', 'gzip')), 'gzip')
+        self.assertEqual(compression.negotiate('*', ('br', 'gzip')), 'br')
+        self.assertEqual(compression.negotiate('*;q=0, identity', ('br', 'gzip')), None)
+        self.assertEqual(compression.negotiate('', ('gzip',)), None)
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ShardRoutingTests(TestCase):
+    def setUp(self):
+        sharding.assignments.clear()
+        self.addCleanup(sharding.assignments.clear)
+
+    @override_settings(CALCULATOR_SHARDING={'DATABASES': ['default', 'a', 'b'], 'ASSIGNMENT_TTL': 0, 'ID_BLOCK': 1000})
+    def test_users_map_to_home_shard_unless_assigned(self):
+        self.assertEqual(sharding.database_for_user(4), 'a')
+        self.assertEqual(sharding.database_for_user('6'), 'default')
+        ShardAssignment.objects.create(user_id=4, database='b')
+        self.assertEqual(sharding.database_for_user(4), 'b')
+        self.assertEqual(sharding.databases_for_id(2005), ['b', 'default', 'a'])
+
+    def test_single_database_skips_assignment_lookup(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.database_for_user(7), 'default')
+
+    def test_scatter_queryset_merges_ordered_rows(self):
+        first = User.objects.create(username='first')
+        second = User.objects.create(username='second')
+        now = timezone.now()
+        for i in range(6):
+            Calculation.objects.create(
+                user=first if i % 2 else second, num1=i, num2=1, operation='add',
+                result=i % 3, created_at=now - timedelta(minutes=i)
+            )
+        queryset = CalculationListSerializer.project(Calculation.objects.all())
+        scatter = sharding.ScatterQuerySet([queryset.filter(user=first), queryset.filter(user=second)])
+
+        for ordering in (['-created_at'], ['result', '-created_at']):
+            expected = [row['id'] for row in queryset.order_by(*ordering)]
+            merged = scatter.order_by(*ordering)
+            self.assertEqual([row['id'] for row in merged[1:4]], expected[1:4])
+            self.assertEqual([row['id'] for row in merged.iterator()], expected)
+        self.assertEqual(scatter.filter(result=0).count(), 2)
+
+
+@skipUnless(len(settings.CALCULATOR_SHARDING['DATABASES']) > 1, 'нужно несколько шардов: CALCULATOR_SHARDS=3')
+class ShardedHistoryTests(TransactionTestCase):
+    databases = HISTORY_DATABASES
+
+    def setUp(self):
+        sharding.assignments.clear()
+        self.addCleanup(sharding.assignments.clear)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        self.admin = User.objects.create(username='boss', is_staff=True)
+        self.client = APIClient()
+
+    def calculate(self, user, num1):
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('calculate'), {'num1': num1, 'num2': 1, 'operation': 'add'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['calculation']['id']
+
+    def test_history_is_written_to_and_read_from_owner_shard(self):
+        for i, user in enumerate(self.users):
+            self.calculate(user, i)
+        id_block = sharding.get_config()['id_block']
+        aliases = sharding.databases()
+        for user in self.users:
+            shard = sharding.database_for_user(user.pk)
+            calculation = Calculation.objects.using(shard).get(user=user)
+            self.assertEqual(calculation.pk // id_block, aliases.index(shard))
+
+            self.client.force_authenticate(user)
+            response = self.client.get(reverse('calculations-list'))
+            self.assertEqual([row['username'] for row in response.data['results']], [user.username])
+            self.assertEqual(self.client.get(reverse('statistics')).data['total_calculations'], 1)
+
+    def test_admin_views_scatter_gather_across_shards(self):
+        ids = [self.calculate(user, i) for i, user in enumerate(self.users * 2)]
+        self.client.force_authenticate(self.admin)
+
+        seen = []
+        url = reverse('admin-calculations') + '?page_size=4'
+        while url:
+            response = self.client.get(url)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        self.assertEqual([row['id'] for row in seen], ids[::-1])
+        self.assertEqual({row['username'] for row in seen}, {user.username for user in self.users})
+
+        response = self.client.get(reverse('admin-calculations'), {'username': 'user1'})
+        self.assertEqual({row['username'] for row in response.data['results']}, {'user1'})
+
+        statistics = self.client.get(reverse('statistics')).data
+        self.assertEqual(statistics['total_calculations'], 6)
+        self.assertEqual({row['count'] for row in statistics['by_user']}, {2})
+        self.assertEqual([row['id'] for row in statistics['recent_calculations']], ids[::-1][:5])
+
+        response = self.client.get(reverse('calculation-detail', args=[ids[1]]))
+        self.assertEqual(response.data['user']['username'], 'user1')
+        self.assertEqual(self.client.delete(reverse('calculation-detail', args=[ids[1]])).status_code, 204)
+        self.assertEqual(self.client.get(reverse('statistics')).data['total_calculations'], 5)
+
+    def test_clear_history_and_user_deletion_reach_shard(self):
+        user = next(user for user in self.users if sharding.database_for_user(user.pk) != 'default')
+        shard = sharding.database_for_user(user.pk)
+        self.calculate(user, 1)
+        self.calculate(user, 2)
+        response = self.client.post(reverse('clear-history'), {}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+
+        self.calculate(user, 3)
+        user.delete()
+        self.assertFalse(Calculation.objects.using(shard).filter(user_id=user.pk).exists())
+
+    def test_rebalance_moves_history_and_keeps_timestamps(self):
+        user = self.users[1]
+        self.calculate(user, 1)
+        self.calculate(user, 2)
+        source = sharding.database_for_user(user.pk)
+        target = next(alias for alias in sharding.databases() if alias != source)
+        created = sorted(Calculation.objects.using(source).values_list('created_at', flat=True))
+
+        call_command('rebalance_shards', user=['user1'], to=target, wait=0, stdout=mock.MagicMock())
+
+        self.assertEqual(sharding.database_for_user(user.pk), target)
+        self.assertFalse(Calculation.objects.using(source).filter(user=user).exists())
+        self.assertEqual(sorted(Calculation.objects.using(target).values_list('created_at', flat=True)), created)
+        self.client.force_authenticate(user)
+        self.assertEqual(len(self.client.get(reverse('calculations-list')).data['results']), 2)
+        self.assertEqual(self.client.get(reverse('statistics')).data['total_calculations'], 2)
+
+        call_command('rebalance_shards', all=True, wait=0, stdout=mock.MagicMock())
+        self.assertTrue(Calculation.objects.using(source).filter(user=user).exists())
+
+
+class ShardAwareHistoryTests(TestCase):
+    """
+    Варианты тестов истории для настроенных шардов (CALCULATOR_SHARDS):
+    исходные тесты работают с одной базой, здесь история читается через
+    шард владельца или все шарды.
+    """
+    databases = HISTORY_DATABASES
+
+    def setUp(self):
+        sharding.assignments.clear()
+        self.addCleanup(sharding.assignments.clear)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        self.admin = User.objects.create(username='root', is_staff=True)
+        self.client = APIClient()
+
+    def test_writes_and_pages_stay_in_owner_shard(self):
+        for user in self.users:
+            self.client.force_authenticate(user)
+            self.client.post(reverse('calculate-batch'), {'operations': [
+                {'num1': 1, 'num2': 2, 'operation': 'add'},
+                {'num1': 1, 'num2': 0, 'operation': 'divide'},
+            ]}, format='json')
+            self.client.post(reverse('calculate-array'), {
+                'operation': 'multiply', 'num1': [1, 2, 3], 'num2': 2, 'history': 'rows',
+            }, format='json')
+            response = self.client.post(reverse('calculate'), {'num1': '10', 'num2': '400', 'operation': 'power', 'mode': 'decimal'}, format='json')
+            calculation = Calculation.objects.for_user(user.pk).get(pk=response.data['calculation']['id'])
+            self.assertEqual(response.data['calculation'], CalculationSerializer(calculation).data)
+            self.assertEqual(Calculation.objects.for_user(user.pk).count(), 5)
+
+            url = reverse('calculations-list') + '?page_size=2'
+            seen = []
+            while url:
+                with CaptureQueriesContext(connections[sharding.database_for_user(user.pk)]) as queries:
+                    response = self.client.get(url)
+                self.assertFalse(any('OFFSET' in q['sql'] for q in queries.captured_queries))
+                seen.extend(row['id'] for row in response.data['results'])
+                url = response.data['next']
+            self.assertEqual(seen, list(Calculation.objects.for_user(user.pk).values_list('id', flat=True)))
+        self.assertEqual(all_calculations().count(), 15)
+
+    def test_admin_list_query_count_is_constant(self):
+        for i, user in enumerate(self.users):
+            Calculation.objects.create(user=user, num1=i, num2=2, operation='multiply', result=i * 2)
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin-calculations'))
+        self.assertEqual(len(response.data['results']), 3)
+        # Запрос списка и чтение версии истории для ETag; с шардами —
+        # ещё имена пользователей для строк из других шардов.
+        self.assertEqual(len(queries.captured_queries), 3 if sharding.enabled() else 2)
+
+    def test_search_and_date_filters_use_owner_shard(self):
+        user = self.users[1]
+        Calculation.objects.create(user=user, num1=2, num2=3, operation='add', result=5)
+        calculation = Calculation.objects.create(user=user, num1=16, operation='sqrt', result=4)
+        Calculation.objects.for_user(user.pk).filter(pk=calculation.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connections[sharding.database_for_user(user.pk)]) as queries:
+            response = self.client.get(reverse('calculations-list'), {'search': 'ad'})
+        self.assertEqual([row['result'] for row in response.data['results']], [5.0])
+        self.assertTrue(any('calculator_calculation_fts' in query['sql'] for query in queries))
+
+        queryset = filter_history(Calculation.objects.for_user(user.pk), {'last': '1h'})
+        self.assertEqual(list(queryset.values_list('result', flat=True)), [5.0])
+
+    @override_settings(CALCULATOR_WRITE_BEHIND={'ENABLED': True, 'MAX_BATCH': 1000, 'FLUSH_INTERVAL': 3600})
+    def test_write_behind_drains_into_owner_shards(self):
+        self.addCleanup(setattr, writebehind, '_buffer', None)
+        buffer = writebehind.get_write_behind()
+        for i, user in enumerate(self.users):
+            buffer.enqueue(Calculation(user=user, num1=i, operation='sqrt', result=i ** 0.5))
+        self.assertEqual(buffer.drain(), 3)
+        for user in self.users:
+            self.assertEqual(Calculation.objects.for_user(user.pk).count(), 1)
+        self.assertEqual(all_calculations(expression='√(1)').count(), 1)
+
+
+class ShardAwareMaintenanceTests(TransactionTestCase):
+    """Очистка, архивация и события по всем настроенным шардам."""
+    databases = HISTORY_DATABASES
+
+    def setUp(self):
+        sharding.assignments.clear()
+        self.addCleanup(sharding.assignments.clear)
+        self.user = User.objects.create(username='galina')
+        self.keeper = User.objects.create(username='hoarder')
+        now = timezone.now()
+        for user in (self.user, self.keeper):
+            for days in range(10):
+                calculation = Calculation.objects.create(user=user, num1=days, num2=1, operation='add', result=days + 1)
+                Calculation.objects.for_user(user.pk).filter(pk=calculation.pk).update(created_at=now - timedelta(days=days, hours=1))
+
+    def remaining_ages(self, user):
+        return sorted(int(n) for n in Calculation.objects.for_user(user.pk).values_list('num1', flat=True))
+
+    @override_settings(CALCULATOR_RETENTION={
+        'DEFAULT': {'MAX_AGE_DAYS': 7, 'MAX_ROWS': 5},
+        'USERS': {'hoarder': {'MAX_AGE_DAYS': 3}},
+    })
+    def test_archive_history_covers_every_shard(self):
+        dry_run = sum(retention.apply_retention(using=using, dry_run=True) for using in sharding.databases())
+        self.assertEqual(dry_run, 5 + 7)
+
+        call_command('archive_history', stdout=mock.MagicMock())
+        self.assertEqual(self.remaining_ages(self.user), [0, 1, 2, 3, 4])
+        self.assertEqual(self.remaining_ages(self.keeper), [0, 1, 2])
+        self.assertEqual(sharding.scatter(ArchivedCalculation.objects.all()).count(), 12)
+        self.assertEqual(stats.get_statistics()['total_calculations'], all_calculations().count())
+
+    def test_clear_history_keeps_rollups_in_step(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(reverse('clear-history'), {}, format='json').json()['deleted'], 10)
+        self.assertFalse(Calculation.objects.for_user(self.user.pk).exists())
+        self.assertEqual(Calculation.objects.for_user(self.keeper.pk).count(), 10)
+        self.assertEqual(stats.get_statistics()['total_calculations'], all_calculations().count())
+
+    async def test_admin_stream_collects_events_from_every_shard(self):
+        admin = await User.objects.acreate(username='oksana', is_staff=True)
+        with mock.patch.object(events, '_broker', events.EventBroker()):
+            token = str(CalculatorRefreshToken.for_user(admin).access_token)
+            response = await AsyncClient().get(reverse('events'), {'token': token, 'scope': 'all'})
+            stream = aiter(response.streaming_content)
+            self.assertIn(b'event: ready', await asyncio.wait_for(anext(stream), 1))
+            await Calculation.objects.abulk_create([
+                Calculation(user=self.user, num1=1, num2=1, operation='add', result=2),
+                Calculation(user=self.keeper, num1=2, num2=2, operation='add', result=4),
+            ])
+            # С шардами строки пишутся по группам, и событий несколько.
+            usernames = []
+            while len(usernames) < 2:
+                chunk = (await asyncio.wait_for(anext(stream), 2)).decode()
+                lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+                self.assertEqual(lines['event'], 'created')
+                usernames.extend(item['username'] for item in json.loads(lines['data'])['calculations'])
+            await stream.aclose()
+        self.assertEqual(sorted(usernames), ['galina', 'hoarder'])
+
+
+@override_settings(CALCULATOR_REPLICATION={'REPLICAS': {'default': ['default']}, 'PIN_SECONDS': 5})
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class ReplicaRoutingTests(TestCase):
+    """Реплика default здесь — сама default: проверяется выбор, а не копирование."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='rita')
+        self.other = User.objects.create(username='roman')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_state(self, method, user):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = user
+        token = replication.start_request(request, {**replication.get_config(), 'replicas': {'default': ['replica']}})
+        self.addCleanup(replication.finish_request, token)
+
+    def test_only_unpinned_safe_requests_read_from_replica(self):
+        self.assertEqual(replication.read_alias('default'), 'default')
+
+        self.read_state('get', self.user)
+        self.assertEqual(replication.read_alias('default'), 'replica')
+        self.assertEqual(replication.read_alias('shard1'), 'shard1')
+        queryset = replication.for_read(sharding.ScatterQuerySet([Calculation.objects.using('default')]))
+        self.assertEqual(queryset.db, 'replica')
+
+        self.read_state('post', self.user)
+        self.assertEqual(replication.read_alias('default'), 'default')
+
+        replication.pin([str(self.user.pk)])
+        self.assertTrue(replication.is_pinned(self.user.pk))
+        self.read_state('get', self.user)
+        self.assertEqual(replication.read_alias('default'), 'default')
+        self.read_state('get', self.other)
+        self.assertEqual(replication.read_alias('default'), 'replica')
+        self.assertEqual(replication.primary_for('default'), 'default')
+
+    def test_writer_reads_primary_within_pin_window(self):
+        decisions = []
+        decide = replication.ReadState.decide
+
+        def record(state):
+            decisions.append(decide(state))
+            return decisions[-1]
+
+        Calculation.objects.create(user=self.user, num1=1, num2=2, operation='add', result=3)
+        caches['default'].clear()
+        with mock.patch.object(replication.ReadState, 'decide', record):
+            self.assertEqual(len(self.client.get(reverse('calculations-list')).data['results']), 1)
+            self.client.post(reverse('calculate'), {'num1': 2, 'num2': 2, 'operation': 'add'}, format='json')
+            response = self.client.get(reverse('calculations-list'))
+            self.assertEqual(len(response.data['results']), 2)
+            self.client.force_authenticate(self.other)
+            self.client.get(reverse('statistics'))
+        self.assertEqual(decisions, [True, False, True])
+
+    def test_replica_databases_and_sync(self):
+        from pathlib import Path
+        from web_calculator.database import database_config, replica_databases
+
+        _, config = database_config(Path('/srv'), {})
+        replicas = replica_databases({'default': config}, {'CALCULATOR_REPLICAS': '2'})
+        self.assertEqual(list(replicas['default']), ['default_replica1', 'default_replica2'])
+        self.assertEqual(replicas['default']['default_replica2']['NAME'], '/srv/db_replica2.sqlite3')
+        self.assertEqual(replicas['default']['default_replica1']['TEST'], {'MIRROR': 'default'})
+        self.assertEqual(replica_databases({'default': config}, {}), {})
+        _, config = database_config(Path('/srv'), {'CALCULATOR_DB_PROFILE': 'postgres'})
+        with self.assertRaises(ValueError):
+            replica_databases({'default': config}, {'CALCULATOR_REPLICAS': '1'})
+
+        with tempfile.TemporaryDirectory() as directory:
+            primary, replica = Path(directory, 'primary.sqlite3'), Path(directory, 'replica.sqlite3')
+            with sqlite3.connect(primary) as db:
+                db.execute('CREATE TABLE t (x INTEGER)')
+                db.execute('INSERT INTO t VALUES (42)')
+            databases = {'primary': {'NAME': primary}, 'replica': {'NAME': replica}}
+            with mock.patch.object(replication, 'connections', {
+                alias: mock.Mock(settings_dict=config) for alias, config in databases.items()
+            }):
+                self.assertTrue(replication.sync_replica('primary', 'replica'))
+            with sqlite3.connect(replica) as db:
+                self.assertEqual(db.execute('SELECT x FROM t').fetchall(), [(42,)])
+
+    def test_sync_thread_is_started_only_by_server_entrypoints(self):
+        # Тесты, migrate и команды не должны копировать базы в фоне.
+        self.assertIsNone(replication._sync)
+        for module in ('web_calculator.wsgi', 'web_calculator.asgi'):
+            sys.modules.pop(module, None)
+            with mock.patch.object(replication, 'start_simulation') as start, \
+                    mock.patch.object(retention, 'start_scheduler'):
+                import_module(module)
+            start.assert_called_once_with()
+
+    def test_test_mirror_is_read_as_primary(self):
+        mirror = {**connection.settings_dict, 'TEST': {'MIRROR': 'default'}}
+        with mock.patch.dict(connections.settings, {'mirror': mirror}), \
+                override_settings(CALCULATOR_REPLICATION={'REPLICAS': {'default': ['mirror']}}):
+            self.assertTrue(replication.is_mirror('mirror', 'default'))
+            self.assertEqual(replication.get_config()['replicas'], {})
+
+
+@override_settings(CALCULATOR_SHARDING={'DATABASES': ['default']})
+class BenchmarkCommandTests(TransactionTestCase):
+    def test_writes_json_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command(
+                'benchmark', rows=30, users=2, clients=1, requests=4,
+                endpoints='calculate,calculations,admin_calculations', output=output,
+                engine_iterations=30, serialization_rows=20,
+                stdout=mock.MagicMock()
+            )
+            with open(output, encoding='utf-8') as f:
+                report = json.load(f)
+
+        self.assertEqual(report['parameters']['rows'], 30)
+        self.assertEqual(set(report['endpoints']), {'calculate', 'calculations', 'admin_calculations'})
+        for summary in report['endpoints'].values():
+            self.assertEqual(summary['requests'], 4)
+            self.assertEqual(summary['errors'], 0)
+            self.assertIsNotNone(summary['latency_ms']['p95'])
+            self.assertGreater(summary['queries_per_request']['mean'], 0)
+        self.assertEqual(Calculation.objects.filter(user__username__startswith='bench_user_').count(), 34)
+        self.assertEqual(set(report['engine']), {'float', 'decimal', 'fraction'})
+        serialization = report['serialization']
+        self.assertEqual(serialization['fast']['rows'], 20)
+        self.assertIn('gzip', serialization['compression'])
+        self.assertGreater(serialization['compression']['gzip']['saved_percent'], 0)
+        self.assertIsNotNone(report['endpoints']['calculations']['response_bytes']['mean'])
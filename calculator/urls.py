@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('', views.calculator_view, name='calculator'),
@@ -16,10 +16,25 @@ urlpatterns = [
     path('api/token/refresh/', views.TokenRefreshView.as_view(), name='token_refresh'),
     
     path('api/calculate/', views.CalculateView.as_view(), name='calculate'),
+    path('api/calculate/batch/', views.CalculateBatchView.as_view(), name='calculate-batch'),
+    path('api/calculate/array/', views.CalculateArrayView.as_view(), name='calculate-array'),
     path('api/calculations/', views.CalculationListView.as_view(), name='calculations-list'),
+    path('api/calculations/export/', views.CalculationExportView.as_view(), name='calculations-export'),
     path('api/calculations/<int:pk>/', views.CalculationDetailView.as_view(), name='calculation-detail'),
     path('api/admin/calculations/', views.AdminCalculationListView.as_view(), name='admin-calculations'),
+    path('api/admin/calculations/export/', views.AdminCalculationExportView.as_view(), name='admin-calculations-export'),
+    path('api/archive/calculations/', views.ArchivedCalculationListView.as_view(), name='archived-calculations'),
     path('api/statistics/', views.statistics_view, name='statistics'),
+    path('api/admin/cache-statistics/', views.cache_statistics_view, name='cache-statistics'),
+    path('api/admin/metrics/', views.metrics_view, name='metrics'),
+    path('api/admin/profiles/', views.profile_list_view, name='profiles'),
+    path('api/admin/profiles/<str:profile_id>/', views.profile_download_view, name='profile-download'),
     path('api/clear-history/', views.clear_history, name='clear-history'),
+    path('api/purge-jobs/<uuid:pk>/', views.purge_job_view, name='purge-job'),
     path('api/get-csrf-token/', views.get_csrf_token, name='get-csrf-token'),
+    
+    path('api/async/calculate/', async_views.calculate_view, name='async-calculate'),
+    path('api/async/calculations/', async_views.calculation_list_view, name='async-calculations-list'),
+    path('api/async/statistics/', async_views.statistics_view, name='async-statistics'),
+    path('api/events/', async_views.events_view, name='events'),
 ]
\ No newline at end of file
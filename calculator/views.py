@@ -1,20 +1,38 @@
 from django.shortcuts import render
+from django.http import FileResponse, Http404, HttpResponse
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
+from django.db import transaction
 from django.db.models import Q
+from django.urls import reverse
 from rest_framework import status, permissions, generics, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.settings import api_settings
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.views import TokenRefreshView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.views.decorators.csrf import csrf_exempt, csrf_protect, ensure_csrf_cookie
 from django.utils.decorators import method_decorator
+from django.utils import timezone
 from django.middleware.csrf import get_token
-from .models import Calculation
-from .serializers import UserSerializer, UserSerializerWithToken, CalculationSerializer
-import math
+from .authentication import stateless_login_requested
+from .models import ArchivedCalculation, Calculation, PurgeJob
+from . import arrays, conditional, events, metrics, numeric, profiling, purge, replication, sharding, stats
+from .pagination import CalculationCursorPagination
+from .renderers import CalculationJSONRenderer
+from .export import EXPORT_FORMATS, export_response
+from .cache import get_result_cache
+from .filtering import filter_history
+from .search import CalculationSearchFilter
+from .writebehind import flush_for_read, get_write_behind
+from .engine import OPERATION_SYMBOLS, CalculationError, evaluate, evaluate_array, evaluate_batch
+from .expressions import ExpressionError, compile_expression
+from .serializers import (
+    UserSerializer, UserSerializerWithToken, CalculationSerializer, CalculationListSerializer,
+    calculation_payload
+)
 from datetime import datetime, timedelta
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -46,11 +64,13 @@ class RegisterView(APIView):
                 password=password
             )
             
-            login(request, user)
-            
-            refresh = RefreshToken.for_user(user)
             serializer = UserSerializerWithToken(user)
             
+            if stateless_login_requested(request):
+                return Response(serializer.data)
+            
+            login(request, user)
+            
             response_data = serializer.data
             
             response = Response(response_data)
@@ -90,11 +110,13 @@ class LoginView(APIView):
         user = authenticate(username=username, password=password)
         
         if user is not None:
-            login(request, user)
-            
-            refresh = RefreshToken.for_user(user)
             serializer = UserSerializerWithToken(user)
             
+            if stateless_login_requested(request):
+                return Response(serializer.data)
+            
+            login(request, user)
+            
             response_data = serializer.data
             
             response = Response(response_data)
@@ -159,54 +181,43 @@ class CalculateView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
+        if request.data.get('operation') == 'expression':
+            return self.calculate_expression(request)
+        
+        mode = request.data.get('mode') or numeric.get_config()['default_mode']
+        if mode != numeric.FLOAT:
+            return self.calculate_exact(request, mode)
+        
         try:
             num1 = float(request.data.get('num1', 0))
             num2 = float(request.data.get('num2', 0))
             operation = request.data.get('operation')
             
-            if operation == 'add':
-                result = num1 + num2
-            elif operation == 'subtract':
-                result = num1 - num2
-            elif operation == 'multiply':
-                result = num1 * num2
-            elif operation == 'divide':
-                if num2 == 0:
-                    return Response(
-                        {'error': 'Деление на ноль невозможно'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                result = num1 / num2
-            elif operation == 'power':
-                result = math.pow(num1, num2)
-            elif operation == 'sqrt':
-                if num1 < 0:
-                    return Response(
-                        {'error': 'Квадратный корень из отрицательного числа'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                result = math.sqrt(num1)
+            if operation == 'sqrt':
                 num2 = None
-            else:
-                return Response(
-                    {'error': 'Неверная операция'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
             
-            calculation = Calculation.objects.create(
-                user=request.user,
+            result_cache = get_result_cache()
+            result = result_cache.get(operation, num1, num2) if result_cache else None
+            if result is None:
+                result = evaluate(operation, num1, num2)
+                if result_cache:
+                    result_cache.set(operation, num1, num2, result)
+            
+            calculation = Calculation(
+                user_id=request.user.pk,
                 num1=num1,
                 num2=num2,
                 operation=operation,
-                result=round(result, 10)
+                result=result
             )
             
-            serializer = CalculationSerializer(calculation)
-            return Response({
-                'result': round(result, 10),
-                'calculation': serializer.data
-            })
+            return self.respond(calculation)
             
+        except CalculationError as e:
+            return Response(
+                {'error': e.message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except ValueError:
             return Response(
                 {'error': 'Некорректный ввод чисел'},
@@ -218,39 +229,311 @@ class CalculateView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class CalculationListView(generics.ListAPIView):
-    serializer_class = CalculationSerializer
-    permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['expression', 'operation']
-    ordering_fields = ['created_at', 'result', 'num1', 'num2']
+    def calculate_exact(self, request, mode):
+        try:
+            mode = numeric.resolve_mode(mode)
+            operation = request.data.get('operation')
+            fields = numeric.calculate(
+                operation,
+                request.data.get('num1', 0),
+                request.data.get('num2', 0),
+                mode,
+                precision=numeric.resolve_precision(request.data.get('precision'))
+            )
+        except CalculationError as e:
+            return Response(
+                {'error': e.message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        calculation = Calculation(user_id=request.user.pk, operation=operation, **fields)
+        return self.respond(calculation)
     
-    def get_queryset(self):
-        user = self.request.user
-        queryset = Calculation.objects.filter(user=user)
+    def calculate_expression(self, request):
+        try:
+            expression, result = evaluate_expression(request.data.get('expression'))
+        except CalculationError as e:
+            return Response(
+                {'error': e.message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        operation = self.request.query_params.get('operation', None)
-        date_from = self.request.query_params.get('date_from', None)
-        date_to = self.request.query_params.get('date_to', None)
+        calculation = Calculation(
+            user_id=request.user.pk,
+            operation='expression',
+            expression=expression,
+            result=result
+        )
         
-        if operation:
-            queryset = queryset.filter(operation=operation)
+        return self.respond(calculation)
+    
+    def respond(self, calculation):
+        data = {'result': calculation.result}
+        if calculation.mode != numeric.FLOAT:
+            data['result_exact'] = calculation.result_exact
         
-        if date_from:
-            try:
-                date_from = datetime.strptime(date_from, '%Y-%m-%d')
-                queryset = queryset.filter(created_at__date__gte=date_from)
-            except ValueError:
-                pass
+        write_behind = get_write_behind()
+        if write_behind is None:
+            calculation.save()
+        else:
+            write_behind.enqueue(calculation)
+            data['queued'] = True
+        
+        data['calculation'] = calculation_payload(calculation, user=self.request.user)
+        return Response(data)
+
+def evaluate_expression(source):
+    compiled = compile_expression(source)
+    max_length = Calculation._meta.get_field('expression').max_length
+    if len(compiled.normalized) > max_length:
+        raise ExpressionError('Выражение слишком длинное')
+    return compiled.normalized, compiled.evaluate()
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CalculateBatchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        operations = request.data
+        if isinstance(operations, dict):
+            operations = operations.get('operations')
+        
+        if not isinstance(operations, list) or not operations:
+            return Response(
+                {'error': 'Ожидается непустой список операций'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_size = getattr(settings, 'CALCULATOR_BATCH_MAX_SIZE', 10000)
+        if len(operations) > max_size:
+            return Response(
+                {'error': f'Слишком много операций в пакете (максимум {max_size})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if date_to:
+        valid_operations = dict(Calculation.OPERATION_CHOICES)
+        default_mode = numeric.get_config()['default_mode']
+        items = []
+        errors = {}
+        calculations = []
+        
+        for index, item in enumerate(operations):
+            if not isinstance(item, dict):
+                errors[index] = 'Некорректный формат операции'
+                continue
+            
+            operation = item.get('operation')
+            if operation not in valid_operations:
+                errors[index] = 'Неверная операция'
+                continue
+            
+            if operation == 'expression':
+                try:
+                    expression, result = evaluate_expression(item.get('expression'))
+                except CalculationError as e:
+                    errors[index] = e.message
+                    continue
+                calculations.append((index, Calculation(
+                    user_id=request.user.pk,
+                    operation=operation,
+                    expression=expression,
+                    result=result
+                )))
+                continue
+            
+            mode = item.get('mode') or default_mode
+            if mode != numeric.FLOAT:
+                try:
+                    fields = numeric.calculate(
+                        operation,
+                        item.get('num1', 0),
+                        item.get('num2', 0),
+                        numeric.resolve_mode(mode),
+                        precision=numeric.resolve_precision(item.get('precision'))
+                    )
+                except CalculationError as e:
+                    errors[index] = e.message
+                    continue
+                calculation = Calculation(user_id=request.user.pk, operation=operation, **fields)
+                calculation.build_expression()
+                calculations.append((index, calculation))
+                continue
+            
             try:
-                date_to = datetime.strptime(date_to, '%Y-%m-%d')
-                queryset = queryset.filter(created_at__date__lte=date_to)
-            except ValueError:
-                pass
+                num1 = float(item.get('num1', 0))
+                num2 = None if operation == 'sqrt' else float(item.get('num2', 0))
+            except (TypeError, ValueError):
+                errors[index] = 'Некорректный ввод чисел'
+                continue
+            
+            items.append((index, (operation, num1, num2)))
         
-        return queryset
+        outcomes = evaluate_batch([operands for _, operands in items])
+        
+        for (index, (operation, num1, num2)), (result, error) in zip(items, outcomes):
+            if error:
+                errors[index] = error
+                continue
+            calculation = Calculation(
+                user_id=request.user.pk,
+                num1=num1,
+                num2=num2,
+                operation=operation,
+                result=result
+            )
+            calculation.build_expression()
+            calculations.append((index, calculation))
+        
+        Calculation.objects.bulk_create(
+            [calculation for _, calculation in calculations],
+            batch_size=getattr(settings, 'CALCULATOR_BULK_BATCH_SIZE', 500)
+        )
+        
+        results = [None] * len(operations)
+        for index, calculation in calculations:
+            results[index] = {
+                'index': index,
+                'result': calculation.result,
+                'calculation': calculation_payload(calculation, user=request.user)
+            }
+        for index, error in errors.items():
+            results[index] = {'index': index, 'error': error}
+        
+        return Response({
+            'results': results,
+            'succeeded': len(calculations),
+            'failed': len(errors)
+        })
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CalculateArrayView(APIView):
+    """
+    Одна операция над массивами операндов. Тело — JSON
+    {"operation", "num1": [...], "num2": [...] или число, "history"}
+    либо двоичное application/octet-stream (operation и history тогда
+    передаются в query string). С Accept: application/octet-stream ответ
+    тоже двоичный, см. calculator.arrays.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, arrays.ArrayBinaryParser]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, arrays.ArrayBinaryRenderer]
+    
+    def post(self, request):
+        binary_request = isinstance(request.data, bytes)
+        params = request.query_params if binary_request else request.data
+        operation = params.get('operation')
+        
+        try:
+            if operation not in OPERATION_SYMBOLS:
+                raise CalculationError('Неверная операция', 'operation')
+            history = arrays.resolve_history(params.get('history'))
+            if binary_request:
+                num1, num2 = arrays.parse_binary(request.data, operation)
+            else:
+                num1, num2 = arrays.parse_json(request.data, operation)
+            max_rows = arrays.get_config()['max_history_rows']
+            if history == arrays.HISTORY_ROWS and len(num1) > max_rows:
+                raise CalculationError(f'Построчная запись истории ограничена {max_rows} элементами', 'history')
+        except CalculationError as e:
+            return Response(
+                {'error': e.message},
+                status=status.HTTP_400_BAD_REQUEST,
+                content_type='application/json'
+            )
+        
+        results, codes = evaluate_array(operation, num1, num2)
+        errors = arrays.failures(codes)
+        summary = self.record_history(history, operation, num1, num2, results, errors)
+        
+        if request.accepted_renderer.format == arrays.ArrayBinaryRenderer.format:
+            response = Response(arrays.encode_binary(results, codes))
+            response['X-Calculator-Count'] = len(num1)
+            response['X-Calculator-Failed'] = len(errors)
+            return response
+        
+        data = {
+            'count': len(num1),
+            'results': arrays.to_list(results, errors),
+            'errors': errors,
+            'succeeded': len(num1) - len(errors),
+            'failed': len(errors),
+        }
+        if summary is not None:
+            data['calculation'] = calculation_payload(summary, user=request.user)
+        return Response(data)
+    
+    def record_history(self, history, operation, num1, num2, results, errors):
+        if history == arrays.HISTORY_NONE:
+            return None
+        
+        user_id = self.request.user.pk
+        if history == arrays.HISTORY_SUMMARY:
+            symbol = OPERATION_SYMBOLS[operation]
+            term = f"{symbol}(a)" if operation == 'sqrt' else f"a {symbol} b"
+            calculation = Calculation(
+                user_id=user_id,
+                operation=operation,
+                expression=f"Σ({term}) [{len(num1) - len(errors)} из {len(num1)}]",
+                result=numeric.approximate(arrays.total(results))
+            )
+            calculation.save()
+            return calculation
+        
+        num2 = [None] * len(num1) if num2 is None else list(num2)
+        calculations = []
+        for index, (a, b, result) in enumerate(zip(list(num1), num2, list(results))):
+            if index in errors:
+                continue
+            calculation = Calculation(user_id=user_id, num1=a, num2=b, operation=operation, result=result)
+            calculation.build_expression()
+            calculations.append(calculation)
+        Calculation.objects.bulk_create(
+            calculations,
+            batch_size=getattr(settings, 'CALCULATOR_BULK_BATCH_SIZE', 500)
+        )
+        return None
+
+class CalculationListMixin:
+    serializer_class = CalculationListSerializer
+    pagination_class = CalculationCursorPagination
+    renderer_classes = [CalculationJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+    
+    def get_requested_fields(self):
+        return CalculationListSerializer.parse_fields(self.request.query_params.get('fields'))
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+    
+    def get_ordering_columns(self):
+        columns = {'created_at'}
+        ordering = self.request.query_params.get('ordering', '')
+        for name in ordering.split(','):
+            name = name.strip().lstrip('-')
+            if name in self.ordering_fields:
+                columns.add('username' if name == 'user__username' else name)
+        return columns
+    
+    def filter_queryset(self, queryset):
+        if isinstance(queryset, sharding.ScatterQuerySet):
+            return queryset.map(self.filter_queryset)
+        queryset = super().filter_queryset(replication.for_read(queryset))
+        return CalculationListSerializer.project(
+            queryset,
+            fields=self.get_requested_fields(),
+            extra_columns=self.get_ordering_columns()
+        )
+
+class CalculationListView(conditional.ConditionalListMixin, CalculationListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    filter_backends = [CalculationSearchFilter, filters.OrderingFilter]
+    search_fields = ['expression', 'operation']
+    ordering_fields = ['created_at', 'result', 'num1', 'num2']
+    
+    def get_queryset(self):
+        flush_for_read()
+        queryset = Calculation.objects.for_user(self.request.user.pk)
+        return filter_history(queryset, self.request.query_params)
 
 class CalculationDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CalculationSerializer
@@ -259,71 +542,226 @@ class CalculationDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Calculation.objects.all()
-        return Calculation.objects.filter(user=user)
+            queryset = Calculation.objects.all()
+        else:
+            queryset = Calculation.objects.for_user(user.pk)
+        if queryset.db == sharding.USERS_DATABASE:
+            queryset = queryset.select_related('user')
+        return queryset
+    
+    def get_object(self):
+        if not self.request.user.is_staff or not sharding.enabled():
+            return super().get_object()
+        # Администратор открывает чужие записи: шард ищется по диапазону id.
+        pk = self.kwargs[self.lookup_field]
+        for using in sharding.databases_for_id(pk):
+            calculation = Calculation.objects.using(using).filter(pk=pk).first()
+            if calculation is not None:
+                self.check_object_permissions(self.request, calculation)
+                return calculation
+        raise Http404
     
     def perform_update(self, serializer):
         if not self.request.user.is_staff:
-            serializer.save(user=self.request.user)
+            serializer.save(user_id=self.request.user.pk)
         else:
             serializer.save()
     
     def perform_destroy(self, instance):
-        if self.request.user.is_staff or instance.user == self.request.user:
+        if self.request.user.is_staff or instance.user_id == self.request.user.pk:
             instance.delete()
         else:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("У вас нет прав для удаления этой записи")
 
-class AdminCalculationListView(generics.ListAPIView):
-    serializer_class = CalculationSerializer
+class AdminCalculationListView(conditional.ConditionalListMixin, CalculationListMixin, generics.ListAPIView):
     permission_classes = [IsAdminUser]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [CalculationSearchFilter, filters.OrderingFilter]
     search_fields = ['expression', 'operation', 'user__username']
-    ordering_fields = ['created_at', 'result', 'user__username']
+    
+    @property
+    def ordering_fields(self):
+        # Имена пользователей не лежат в шардах, сортировать по ним там нечем.
+        if sharding.enabled():
+            return ['created_at', 'result']
+        return ['created_at', 'result', 'user__username']
+    
+    def get_version_user_id(self):
+        user_id = self.request.query_params.get('user_id')
+        if user_id and user_id.isdigit() and not self.request.query_params.get('username'):
+            return int(user_id)
+        return stats.ALL_USERS
     
     def get_queryset(self):
-        queryset = Calculation.objects.all()
-        
+        flush_for_read()
         user_id = self.request.query_params.get('user_id', None)
         username = self.request.query_params.get('username', None)
         
-        if user_id:
-            queryset = queryset.filter(user_id=user_id)
+        if user_id and user_id.isdigit():
+            queryset = Calculation.objects.for_user(user_id)
+        else:
+            queryset = sharding.scatter(Calculation.objects.all())
+            if user_id:
+                queryset = queryset.filter(user_id=user_id)
         
         if username:
-            queryset = queryset.filter(user__username__icontains=username)
+            if sharding.enabled():
+                queryset = queryset.filter(user_id__in=list(
+                    User.objects.filter(username__icontains=username).values_list('id', flat=True)
+                ))
+            else:
+                queryset = queryset.filter(user__username__icontains=username)
         
-        return queryset
+        return filter_history(queryset, self.request.query_params)
+
+class ArchivedCalculationListView(CalculationListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at', 'result']
+    
+    def get_queryset(self):
+        user_id = self.request.query_params.get('user_id', None)
+        if not self.request.user.is_staff:
+            user_id = self.request.user.pk
+        
+        if user_id and str(user_id).isdigit():
+            queryset = sharding.for_user(ArchivedCalculation.objects.all(), user_id)
+        else:
+            queryset = sharding.scatter(ArchivedCalculation.objects.all())
+        
+        return filter_history(queryset, self.request.query_params)
+
+class CalculationExportMixin:
+    pagination_class = None
+    export_filename = 'calculations'
+    
+    def list(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': 'Неподдерживаемый формат экспорта'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        fields = self.get_requested_fields() or list(CalculationListSerializer.COLUMNS)
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(queryset, fields, export_format, self.export_filename)
+
+class CalculationExportView(CalculationExportMixin, CalculationListView):
+    pass
+
+class AdminCalculationExportView(CalculationExportMixin, AdminCalculationListView):
+    export_filename = 'all_calculations'
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def statistics_view(request):
+    flush_for_read()
     user = request.user
+    # Окно by_day сдвигается с датой, поэтому она входит в ETag.
+    not_modified, validators = conditional.check(
+        request,
+        stats.ALL_USERS if user.is_staff else user.pk,
+        extra=(timezone.localdate(),)
+    )
+    if not_modified is not None:
+        return not_modified
+    
     if user.is_staff:
-        total_calculations = Calculation.objects.count()
-        recent_calculations = Calculation.objects.order_by('-created_at')[:5]
+        statistics = stats.get_statistics()
+        recent_calculations = sharding.scatter(Calculation.objects.order_by('-created_at'))
     else:
-        total_calculations = Calculation.objects.filter(user=user).count()
-        recent_calculations = Calculation.objects.filter(user=user).order_by('-created_at')[:5]
+        statistics = stats.get_statistics(user_id=user.pk)
+        recent_calculations = Calculation.objects.for_user(user.pk).order_by('-created_at')
+    
+    recent_calculations = replication.for_read(recent_calculations)
+    recent_calculations = CalculationListSerializer.project(recent_calculations)[:5]
+    statistics['recent_calculations'] = CalculationListSerializer(recent_calculations, many=True).data
     
-    return Response({
-        'total_calculations': total_calculations,
-        'recent_calculations': CalculationSerializer(recent_calculations, many=True).data
-    })
+    return conditional.finalize(Response(statistics), validators)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_statistics_view(request):
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return Response({'enabled': False})
+    
+    return Response({'enabled': True, **result_cache.stats()})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    return HttpResponse(
+        metrics.get_registry().render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list_view(request):
+    return Response({'results': profiling.list_profiles()})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_download_view(request, profile_id):
+    path = profiling.profile_path(profile_id)
+    try:
+        profile = open(path, 'rb') if path is not None else None
+    except FileNotFoundError:
+        # Профиль вытеснен из буфера между проверкой и открытием.
+        profile = None
+    if profile is None:
+        raise Http404
+    return FileResponse(
+        profile,
+        as_attachment=True,
+        filename=f'profile-{profile_id}.json',
+        content_type='application/json'
+    )
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def clear_history(request):
     user = request.user
     if user.is_staff and request.data.get('all_users', False):
-        Calculation.objects.all().delete()
+        target_user_id = None
         message = 'Вся история очищена'
     else:
-        Calculation.objects.filter(user=user).delete()
+        target_user_id = user.pk
         message = 'Ваша история очищена'
     
-    return Response({'message': message})
+    job = PurgeJob(requested_by_id=user.pk, target_user_id=target_user_id)
+    config = purge.get_config()
+    total = sum(queryset.count() for queryset in job.calculations())
+    
+    if total > config['background_threshold']:
+        job.total = total
+        job.save()
+        transaction.on_commit(lambda: purge.start(job))
+        return Response({
+            'message': 'Очистка истории запущена',
+            'job_id': str(job.pk),
+            'status_url': reverse('purge-job', args=[job.pk]),
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    deleted = sum(
+        queryset.delete_in_batches(batch_size=config['batch_size'])
+        for queryset in job.calculations()
+    )
+    return Response({'message': message, 'deleted': deleted})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def purge_job_view(request, pk):
+    job = PurgeJob.objects.filter(pk=pk).first()
+    if job is None or not (request.user.is_staff or job.requested_by_id == request.user.pk):
+        return Response(
+            {'error': 'Задание не найдено'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    return Response(purge.job_payload(job))
 
 @api_view(['GET'])
 def get_csrf_token(request):
@@ -333,10 +771,10 @@ def calculator_view(request):
     return render(request, 'calculator/calculator.html')
 
 def history_view(request):
-    return render(request, 'calculator/history.html')
+    return render(request, 'calculator/history.html', {'events_enabled': events.stream_supported(request)})
 
 def admin_panel_view(request):
-    return render(request, 'calculator/admin_panel.html')
+    return render(request, 'calculator/admin_panel.html', {'events_enabled': events.stream_supported(request)})
 
 def simple_calc_view(request):
     return render(request, 'calculator/simple_calc.html')
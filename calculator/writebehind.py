@@ -0,0 +1,185 @@
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+
+BUFFERED = 'buffered'
+FLUSH_ON_READ = 'flush_on_read'
+DURABILITY_MODES = (BUFFERED, FLUSH_ON_READ)
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи истории вычислений.
+
+    Запросы только кладут несохранённые Calculation в очередь, фоновый
+    поток сбрасывает её через bulk_create, когда набирается max_batch
+    записей или проходит flush_interval секунд. Если очередь дорастает
+    до max_pending, запись выполняется синхронно в потоке запроса.
+
+    Если пачка шарда не записалась, её строки пишутся по одной, чтобы
+    одна плохая строка не блокировала остальные. Строка, которая не
+    записалась max_attempts сбросов подряд, снимается с очереди в
+    dead_letters и попадает в лог.
+    """
+
+    def __init__(self, max_batch=500, flush_interval=1.0, max_pending=10000, durability=BUFFERED,
+                 max_attempts=3, dead_letter_size=1000):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.durability = durability
+        self.max_attempts = max_attempts
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name='calculation-write-behind', daemon=True
+            )
+            self._thread.start()
+
+    def enqueue(self, calculation):
+        if self._thread is None:
+            self.start()
+        calculation.build_expression()
+        with self._lock:
+            self._pending.append(calculation)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self.flush()
+        elif pending >= self.max_batch:
+            self._wakeup.set()
+
+    def flush(self):
+        from . import sharding
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            groups = {}
+            for calculation in batch:
+                groups.setdefault(sharding.database_for_user(calculation.user_id), []).append(calculation)
+            saved, failed = 0, []
+            for using, group in groups.items():
+                saved_group, failed_group = self._write(using, group)
+                saved += saved_group
+                failed.extend(failed_group)
+            if failed:
+                self._retry_later(failed)
+            return saved
+
+    def _write(self, using, group):
+        """Пишет пачку шарда; при ошибке — по одной строке. Возвращает (записано, не записано)."""
+        from .models import Calculation
+
+        objects = Calculation.objects.using(using)
+        try:
+            objects.bulk_create(group, batch_size=self.max_batch)
+            return len(group), []
+        except Exception:
+            if len(group) == 1:
+                logger.exception('Не удалось сохранить вычисление')
+                group[0].pk = None
+                return 0, group
+            logger.exception('Не удалось сохранить пачку из %d вычислений, запись по одной', len(group))
+
+        saved, failed = 0, []
+        for calculation in group:
+            # Транзакция пачки откатилась, id из неё недействительны.
+            calculation.pk = None
+            try:
+                objects.bulk_create([calculation])
+                saved += 1
+            except Exception:
+                logger.exception('Не удалось сохранить вычисление %s', calculation.expression)
+                calculation.pk = None
+                failed.append(calculation)
+        return saved, failed
+
+    def _retry_later(self, failed):
+        retry = []
+        for calculation in failed:
+            attempts = calculation.write_attempts = getattr(calculation, 'write_attempts', 0) + 1
+            if attempts < self.max_attempts:
+                retry.append(calculation)
+                continue
+            self.dead_letters.append(calculation)
+            logger.error(
+                'Вычисление пользователя %s (%s) отброшено после %d попыток записи',
+                calculation.user_id, calculation.expression, attempts
+            )
+        with self._lock:
+            self._pending[:0] = retry
+
+    def drain(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval, 1.0) * 5)
+            self._thread = None
+        return self.flush()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            close_old_connections()
+            self.flush()
+        connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_behind():
+    global _buffer
+
+    config = getattr(settings, 'CALCULATOR_WRITE_BEHIND', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                durability = config.get('DURABILITY', BUFFERED)
+                if durability not in DURABILITY_MODES:
+                    raise ValueError(f'Неизвестный режим CALCULATOR_WRITE_BEHIND DURABILITY: {durability}')
+                _buffer = WriteBehindBuffer(
+                    max_batch=config.get('MAX_BATCH', 500),
+                    flush_interval=config.get('FLUSH_INTERVAL', 1.0),
+                    max_pending=config.get('MAX_PENDING', 10000),
+                    durability=durability,
+                    max_attempts=config.get('MAX_ATTEMPTS', 3)
+                )
+                atexit.register(_buffer.drain)
+    return _buffer
+
+
+def flush_for_read():
+    buffer = get_write_behind()
+    if buffer is not None and buffer.durability == FLUSH_ON_READ:
+        buffer.flush()
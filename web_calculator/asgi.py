@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_calculator.settings')
 
 application = get_asgi_application()
+
+# Фоновые потоки (архивация по расписанию, имитация отставания
+# SQLite-реплик) нужны только работающему серверу: тесты, migrate и
+# другие команды этот модуль не импортируют.
+from calculator import replication, retention  # noqa: E402
+
+retention.start_scheduler()
+replication.start_simulation()
@@ -0,0 +1,156 @@
+"""
+Профили подключения к БД, выбираемые переменной окружения
+CALCULATOR_DB_PROFILE:
+
+- sqlite (по умолчанию): WAL, synchronous=NORMAL, busy timeout, mmap
+  и увеличенный page cache; транзакции на запись берут блокировку
+  сразу (BEGIN IMMEDIATE), поэтому конкурирующие записи ждут в очереди,
+  а не падают с "database is locked" при повышении блокировки.
+- sqlite-basic: прежнее поведение SQLite (rollback journal, без
+  тюнинга) — для сравнения в бенчмарке.
+- postgres: постоянные соединения (CONN_MAX_AGE) с проверкой живости,
+  либо пул psycopg при DB_POOL=1.
+
+CALCULATOR_SHARDS=N добавляет к default ещё N-1 баз истории shard1..
+с тем же профилем (см. calculator.sharding): файлы db_shardK.sqlite3
+рядом с основной базой или базы PostgreSQL <DB_NAME>_shardK.
+
+CALCULATOR_REPLICAS=N добавляет каждой базе истории N реплик только
+для чтения (см. calculator.replication): для SQLite — копии
+<база>_replicaK.sqlite3, которые обновляет имитация репликации, для
+PostgreSQL — те же базы на хостах из DB_REPLICA_HOSTS (через запятую).
+"""
+import os
+
+
+PROFILES = ('sqlite', 'sqlite-basic', 'postgres')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
+
+def _int(env, name, default):
+    value = env.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def sqlite_config(base_dir, env):
+    pragmas = {
+        **SQLITE_PRAGMAS,
+        'busy_timeout': _int(env, 'DB_BUSY_TIMEOUT_MS', SQLITE_PRAGMAS['busy_timeout']),
+        'mmap_size': _int(env, 'DB_MMAP_SIZE', SQLITE_PRAGMAS['mmap_size']),
+        'cache_size': _int(env, 'DB_CACHE_SIZE', SQLITE_PRAGMAS['cache_size']),
+    }
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('DB_NAME') or base_dir / 'db.sqlite3',
+        'CONN_MAX_AGE': _int(env, 'DB_CONN_MAX_AGE', 600),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': pragmas['busy_timeout'] / 1000,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items()),
+        },
+    }
+
+
+def sqlite_basic_config(base_dir, env):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('DB_NAME') or base_dir / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=DELETE',
+        },
+    }
+
+
+def postgres_config(base_dir, env):
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('DB_NAME', 'web_calculator'),
+        'USER': env.get('DB_USER', 'postgres'),
+        'PASSWORD': env.get('DB_PASSWORD', ''),
+        'HOST': env.get('DB_HOST', 'localhost'),
+        'PORT': env.get('DB_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    if env.get('DB_POOL') in ('1', 'true', 'True'):
+        # Пул psycopg (Django 5.1+) несовместим с CONN_MAX_AGE > 0.
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {
+            'min_size': _int(env, 'DB_POOL_MIN_SIZE', 2),
+            'max_size': _int(env, 'DB_POOL_MAX_SIZE', 20),
+            'timeout': _int(env, 'DB_POOL_TIMEOUT', 10),
+        }
+    else:
+        config['CONN_MAX_AGE'] = _int(env, 'DB_CONN_MAX_AGE', 600)
+        config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
+def database_config(base_dir, env=None):
+    env = os.environ if env is None else env
+    profile = env.get('CALCULATOR_DB_PROFILE', 'sqlite')
+    builders = {
+        'sqlite': sqlite_config,
+        'sqlite-basic': sqlite_basic_config,
+        'postgres': postgres_config,
+    }
+    if profile not in builders:
+        raise ValueError(
+            f"Неизвестный CALCULATOR_DB_PROFILE={profile!r}, ожидается один из: {', '.join(PROFILES)}"
+        )
+    return profile, builders[profile](base_dir, env)
+
+
+def shard_databases(base_dir, env=None):
+    """Возвращает {alias: config} дополнительных шардов истории."""
+    env = os.environ if env is None else env
+    count = _int(env, 'CALCULATOR_SHARDS', 1)
+    if count < 1:
+        raise ValueError('CALCULATOR_SHARDS должно быть положительным')
+    profile = env.get('CALCULATOR_DB_PROFILE', 'sqlite')
+
+    shards = {}
+    for index in range(1, count):
+        if profile == 'postgres':
+            name = f"{env.get('DB_NAME', 'web_calculator')}_shard{index}"
+        else:
+            default_name = env.get('DB_NAME') or base_dir / 'db.sqlite3'
+            name = str(default_name).removesuffix('.sqlite3') + f'_shard{index}.sqlite3'
+        _, shards[f'shard{index}'] = database_config(base_dir, {**env, 'DB_NAME': name})
+    return shards
+
+
+def replica_databases(databases, env=None):
+    """
+    Возвращает {primary: {alias: config}} реплик баз истории databases.
+    В тестах реплика — зеркало своей primary.
+    """
+    env = os.environ if env is None else env
+    count = _int(env, 'CALCULATOR_REPLICAS', 0)
+    if count < 0:
+        raise ValueError('CALCULATOR_REPLICAS не может быть отрицательным')
+    hosts = [host.strip() for host in env.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+
+    replicas = {}
+    for primary, config in databases.items():
+        if not count:
+            break
+        replicas[primary] = {}
+        for index in range(1, count + 1):
+            replica = {**config, 'TEST': {'MIRROR': primary}}
+            if config['ENGINE'] == 'django.db.backends.postgresql':
+                if len(hosts) < count:
+                    raise ValueError('DB_REPLICA_HOSTS должен содержать хост для каждой реплики')
+                replica['HOST'] = hosts[index - 1]
+            else:
+                replica['NAME'] = str(config['NAME']).removesuffix('.sqlite3') + f'_replica{index}.sqlite3'
+            replicas[primary][f'{primary}_replica{index}'] = replica
+    return replicas
@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 from datetime import timedelta
 
+from .database import database_config, replica_databases, shard_databases
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = 'django-insecure-=x!&_v^f#6@!5t)j7k8$+q@*z%b^4y$!9@3^7&6@!5t)j7k8$+q'
@@ -24,6 +26,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'calculator.middleware.MetricsMiddleware',
+    'calculator.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -32,6 +36,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'calculator.middleware.ReplicaMiddleware',
+    'calculator.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'web_calculator.urls'
@@ -54,11 +60,52 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'web_calculator.wsgi.application'
 
+DATABASE_PROFILE, DEFAULT_DATABASE = database_config(BASE_DIR)
+
+HISTORY_DATABASES = {
+    'default': DEFAULT_DATABASE,
+    **shard_databases(BASE_DIR),
+}
+
+REPLICA_DATABASES = replica_databases(HISTORY_DATABASES)
+
 DATABASES = {
+    **HISTORY_DATABASES,
+    **{alias: config for replicas in REPLICA_DATABASES.values() for alias, config in replicas.items()},
+}
+
+DATABASE_ROUTERS = ['calculator.replication.ReplicaRouter', 'calculator.sharding.ShardRouter']
+
+# История пользователя живёт в одном из шардов, см. calculator.sharding.
+CALCULATOR_SHARDING = {
+    'DATABASES': list(HISTORY_DATABASES),
+    'ID_BLOCK': 2 ** 40,
+    'ASSIGNMENT_TTL': 5,
+}
+
+# Чтение истории с реплик, см. calculator.replication. SQLite-реплики
+# обновляются копированием раз в SIMULATED_LAG_SECONDS.
+CALCULATOR_REPLICATION = {
+    'REPLICAS': {primary: list(replicas) for primary, replicas in REPLICA_DATABASES.items()},
+    'PIN_SECONDS': 5,
+    'CACHE': 'default',
+    'SIMULATED_LAG_SECONDS': (
+        float(os.environ.get('CALCULATOR_REPLICA_LAG', 2)) if DATABASE_PROFILE != 'postgres' else None
+    ),
+}
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'calculations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'calculations',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -94,12 +141,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'calculator.authentication.StatelessJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'calculator.pagination.CalculationCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 SIMPLE_JWT = {
@@ -117,6 +166,8 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_USER_CLASS': 'calculator.authentication.ClaimsUser',
+    'TOKEN_REFRESH_SERIALIZER': 'calculator.authentication.CalculatorTokenRefreshSerializer',
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -165,4 +216,107 @@ SESSION_COOKIE_SECURE = False
 
 SESSION_COOKIE_SAMESITE = 'Lax'
 
-SESSION_COOKIE_AGE = 60 * 60 * 24 * 7
\ No newline at end of file
+SESSION_COOKIE_AGE = 60 * 60 * 24 * 7
+CALCULATOR_BATCH_MAX_SIZE = 10000
+
+CALCULATOR_VECTORIZE_THRESHOLD = 64
+
+CALCULATOR_ARRAY = {
+    'MAX_SIZE': 1_000_000,
+    'MAX_HISTORY_ROWS': 10000,
+    'DEFAULT_HISTORY': 'summary',
+}
+
+CALCULATOR_BULK_BATCH_SIZE = 500
+
+CALCULATOR_EXPORT_CHUNK_SIZE = 2000
+
+CALCULATOR_STATS_DAYS = 30
+
+CALCULATOR_STATS_TOP_USERS = 10
+
+CALCULATOR_RESULT_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'calculations',
+}
+
+CALCULATOR_EXPRESSIONS = {
+    'MAX_LENGTH': 200,
+    'MAX_DEPTH': 32,
+    'TIME_LIMIT': 0.05,
+    'CACHE_SIZE': 1024,
+}
+
+CALCULATOR_WRITE_BEHIND = {
+    'ENABLED': False,
+    'DURABILITY': 'buffered',
+    'MAX_BATCH': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 10000,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Числовые режимы: float (быстрый путь), decimal с точностью
+# DECIMAL_PRECISION знаков и точные дроби fraction. Клиент выбирает
+# режим полем mode, точность Decimal — полем precision.
+CALCULATOR_NUMERIC = {
+    'DEFAULT_MODE': 'float',
+    'DECIMAL_PRECISION': 50,
+    'MAX_PRECISION': 1000,
+    'MAX_DIGITS': 1000,
+}
+
+CALCULATOR_PURGE = {
+    'BATCH_SIZE': 5000,
+    'BACKGROUND_THRESHOLD': 50000,
+}
+
+# Политики хранения истории: DEFAULT действует для всех, USERS
+# (по имени пользователя) заменяет её целиком. MAX_AGE_DAYS и MAX_ROWS
+# можно задавать вместе. SCHEDULE_INTERVAL (секунды) включает
+# периодическую архивацию в процессе сервера (поток запускают wsgi.py и
+# asgi.py, а не команды и тесты).
+CALCULATOR_RETENTION = {
+    'DEFAULT': {
+        'MAX_AGE_DAYS': None,
+        'MAX_ROWS': None,
+    },
+    'USERS': {},
+    'BATCH_SIZE': 5000,
+    'COMPACT': True,
+    'SCHEDULE_INTERVAL': None,
+}
+
+# Вход без серверной сессии по умолчанию; клиент может переопределить
+# полем stateless в теле запросов login/register.
+CALCULATOR_STATELESS_LOGIN = False
+
+CALCULATOR_METRICS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+# Сжатие ответов; br — только если установлен пакет brotli.
+CALCULATOR_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+}
+
+CALCULATOR_EVENTS = {
+    'ENABLED': True,
+    'QUEUE_SIZE': 1000,
+    'HEARTBEAT_SECONDS': 15,
+    'MAX_DELETED_IDS': 1000,
+}
+
+CALCULATOR_PROFILING = {
+    'ENABLED': True,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 50,
+    'SLOW_THRESHOLD_MS': None,
+    'AUTO_URL_NAMES': ('calculations-list', 'admin-calculations'),
+    'SAMPLE_INTERVAL_MS': 5,
+}